@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bench_config.py
+#
+"""Compare cold (parse) and warm (compiled scene cache) config loading.
+
+Generates a configuration with many panels and scenes in a temporary
+directory and measures ``parse_config`` without cache, with an outdated
+cache (parse + write cache) and with a valid cache.
+
+Usage::
+
+    python benchmarks/bench_config.py [NUM_PANELS [SCENES_PER_PANEL]]
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from midiscenemanager.config import get_cache_filename, parse_config
+
+
+def make_config(num_panels, num_scenes):
+    lines = ["[global]", "default_panel: panel0", ""]
+
+    for p in range(num_panels):
+        lines += ["[panel:panel%i]" % p, "title: Panel %i" % p, "cols: 6", "scenes:"]
+        lines += ["    scene%i_%i" % (p, s) for s in range(num_scenes)]
+        lines.append("")
+
+    for p in range(num_panels):
+        for s in range(num_scenes):
+            lines += [
+                "[scene:scene%i_%i]" % (p, s),
+                "title: Scene %i/%i" % (p, s),
+                "on_enter:",
+                "    bank_select ch=%i bank=%i" % (p % 16 + 1, s),
+                "    program_change ch=%i program=%i" % (p % 16 + 1, s % 128),
+                "    channel_volume ch=%i value=100" % (p % 16 + 1),
+                "    control_change ch=%i cc=74 value=%i delay=10" % (p % 16 + 1, s % 128),
+                "on_exit:",
+                "    all_notes_off ch=%i" % (p % 16 + 1),
+                "",
+            ]
+
+    return "\n".join(lines)
+
+
+def timeit(func, repeat=5):
+    best = None
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    num_panels = int(args[0]) if args else 24
+    num_scenes = int(args[1]) if len(args) > 1 else 200
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'bench.cfg')
+
+        with open(filename, 'w') as fp:
+            fp.write(make_config(num_panels, num_scenes))
+
+        def cold():
+            if os.path.exists(get_cache_filename(filename)):
+                os.unlink(get_cache_filename(filename))
+
+            parse_config(filename)
+
+        nocache = timeit(lambda: parse_config(filename, cache=False))
+        cold = timeit(cold)
+        parse_config(filename)
+        warm = timeit(lambda: parse_config(filename))
+
+    print("%i panels x %i scenes, best of 5 runs" % (num_panels, num_scenes))
+    print("no cache:          %8.1f ms" % (nocache * 1000))
+    print("cold (write cache): %7.1f ms" % (cold * 1000))
+    print("warm (read cache):  %7.1f ms  (%.1fx faster)" % (warm * 1000, nocache / warm))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bench_eventqueue.py
+#
+"""Compare the pending event stores in ``midiscenemanager.eventqueue``.
+
+For each store and backlog size, schedules that many events spread over
+ten minutes at 120 bpm / 480 ppqn and measures the time per event for
+inserting them and for expiring them in tick order, as the sequencer does.
+
+Usage::
+
+    python benchmarks/bench_eventqueue.py [SIZE ...]
+
+"""
+
+import random
+import sys
+import time
+
+from midiscenemanager.eventqueue import EventHeap, TimingWheel
+
+# ticks in ten minutes at 120 bpm and 480 ppqn
+SPAN = 10 * 60 * 2 * 480
+
+
+def bench(factory, size):
+    rnd = random.Random(size)
+    events = [(rnd.randrange(SPAN), seq, None) for seq in range(size)]
+    store = factory()
+
+    start = time.perf_counter()
+    for event in events:
+        store.push(event)
+    insert = time.perf_counter() - start
+
+    # expire like the sequencer loop: wait for next pending tick, pop due
+    expired = 0
+    start = time.perf_counter()
+    while expired < size:
+        expired += len(store.pop_due(store.next_tick()))
+    expire = time.perf_counter() - start
+
+    return insert / size * 1e9, expire / size * 1e9
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    sizes = [int(arg) for arg in args] or [1000, 100000, 1000000]
+
+    print("Events spread over %i ticks, ns per event" % SPAN)
+    print("%-14s %10s %10s %10s" % ("store", "size", "insert", "expire"))
+
+    for name, factory in (('EventHeap', EventHeap), ('TimingWheel', TimingWheel)):
+        for size in sizes:
+            insert, expire = bench(factory, size)
+            print("%-14s %10i %10.0f %10.0f" % (name, size, insert, expire))
+
+
+if __name__ == '__main__':
+    main()
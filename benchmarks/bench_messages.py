@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bench_messages.py
+#
+"""Measure the cost of queuing single channel messages via MidiOutWrapper.
+
+Compares the fast path of ``MidiOutWrapper.send_control_change``, which
+takes ready-made messages from the shared message table and adds them to
+the sequencer directly, with the former path, which built each message with
+:mod:`~midiscenemanager.commands` and queued it as a batch of one, for a
+stream of 'Expression' controller changes.
+
+Reports messages/sec and the memory blocks and bytes still allocated per
+queued message (i.e. what a message costs while it waits in the queue).
+The sequencer is stopped, so the queue is not drained during the run. The
+fast path reduces allocation, but does not remove it: the messages are
+reused, the queued ``(tick, seq, message)`` events are not.
+
+Usage::
+
+    python benchmarks/bench_messages.py [NUM_MESSAGES [REPEAT]]
+
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from midiscenemanager import commands
+from midiscenemanager.midiio import MidiOutWrapper
+
+
+class NullMidiOut(object):
+    def send_message(self, message):
+        pass
+
+    def close_port(self):
+        pass
+
+
+def legacy_send(wrapper, value):
+    wrapper._send_many(commands.control_change(11, value, ch=1), deltas=0)
+
+
+def fast_send(wrapper, value):
+    wrapper.send_control_change(11, value, ch=1)
+
+
+def bench(send, num_messages):
+    """Return (messages/sec, blocks/message, bytes/message) for queuing ``num_messages``."""
+    wrapper = MidiOutWrapper(NullMidiOut(), 'null')
+    wrapper.midi.stop()
+    values = [i % 128 for i in range(num_messages)]
+    # fill the message table and warm up
+    for value in range(128):
+        send(wrapper, value)
+
+    wrapper.midi.queue.clear()
+    gc.collect()
+    gc.disable()
+
+    try:
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+
+        for value in values:
+            send(wrapper, value)
+
+        elapsed = time.perf_counter() - start
+        blocks = sys.getallocatedblocks() - blocks
+
+        wrapper.midi.queue.clear()
+        tracemalloc.start()
+
+        for value in values:
+            send(wrapper, value)
+
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    finally:
+        gc.enable()
+
+    return num_messages / elapsed, blocks / num_messages, size / num_messages
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    num_messages = int(args[0]) if args else 100000
+    repeat = int(args[1]) if len(args) > 1 else 5
+
+    print("%i 'Control Change' messages, best of %i runs" % (num_messages, repeat))
+    print("%-10s %14s %14s %14s" % ("path", "msgs/s", "blocks/msg", "bytes/msg"))
+
+    for name, send in (('before', legacy_send), ('after', fast_send)):
+        results = [bench(send, num_messages) for i in range(repeat)]
+        rate = max(result[0] for result in results)
+        blocks = min(result[1] for result in results)
+        size = min(result[2] for result in results)
+        print("%-10s %14.0f %14.2f %14.1f" % (name, rate, blocks, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bench_sequencer.py
+#
+"""Measure how many events/sec the sequencer can schedule and dispatch.
+
+Compares the current ``SequencerThread`` event store with the former
+implementation, which kept ``MidiEvent`` instances, compared by a Python
+``__lt__`` method, in a heap and moved due events through a second heap,
+for bursts of 10k events.
+
+Usage::
+
+    python benchmarks/bench_sequencer.py [NUM_EVENTS [REPEAT]]
+
+"""
+
+import sys
+import time
+
+from heapq import heappush, heappop
+
+from midiscenemanager.sequencer import SequencerThread
+
+
+class NullMidiOut(object):
+    def send_message(self, message):
+        pass
+
+
+class BenchSequencer(SequencerThread):
+    """Sequencer which only counts events instead of sending them."""
+
+    def __init__(self, *args, **kwargs):
+        super(BenchSequencer, self).__init__(NullMidiOut(), *args, **kwargs)
+        self.sent = 0
+
+    def handle_event(self, message):
+        self.sent += 1
+
+
+class _LegacyMidiEvent(object):
+    """The former ``sequencer.MidiEvent``, ordered by tick only."""
+
+    __slots__ = ('tick', 'message')
+
+    def __init__(self, tick, message):
+        self.tick = tick
+        self.message = message
+
+    def __lt__(self, other):
+        return self.tick < other.tick
+
+
+class LegacySequencer(BenchSequencer):
+    """Event store and dispatch loop as they were before (tick, seq) tuples."""
+
+    def __init__(self, *args, **kwargs):
+        super(LegacySequencer, self).__init__(*args, **kwargs)
+        self._pending = []
+
+    def add_many(self, events, tick=None, deltas=None):
+        for delta, msg in zip(deltas, events):
+            self.queue.append(_LegacyMidiEvent(tick + delta, msg))
+
+    def _process(self, now):
+        pending = self._pending
+        due = []
+        tick = self._tick_at(now)
+
+        for evt in self.get_events():
+            heappush(pending, evt)
+
+        while pending and pending[0].tick <= tick:
+            heappush(due, heappop(pending))
+
+        for i in range(len(due)):
+            self.handle_event(heappop(due).message)
+
+        return pending[0].tick if pending else None
+
+
+def bench(cls, num_events, spread):
+    """Schedule a burst of events over ``spread`` ticks and dispatch them.
+
+    Returns events/sec for the whole run (ingest + dispatch).
+
+    """
+    now = [0]
+    seq = cls(clock=lambda: now[0])
+    seq._start_clock()
+    messages = [[0xB0, i % 128, i % 127] for i in range(num_events)]
+    # mix of immediate and (out of order) future events
+    deltas = [(i * 7919) % spread for i in range(num_events)]
+
+    start = time.perf_counter()
+    seq.add_many(messages, tick=0, deltas=deltas)
+
+    while True:
+        deadline = seq._process(now[0])
+
+        if deadline is None:
+            break
+
+        now[0] = seq.tick_to_time(deadline)
+
+    elapsed = time.perf_counter() - start
+    assert seq.sent == num_events
+    return num_events / elapsed
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    num_events = int(args[0]) if args else 10000
+    repeat = int(args[1]) if len(args) > 1 else 5
+
+    print("%i-event bursts, best of %i runs" % (num_events, repeat))
+    print("%-22s %14s %14s %8s" % ("spread (ticks)", "before ev/s", "after ev/s", "speedup"))
+
+    for spread in (1, 480, num_events):
+        before = max(bench(LegacySequencer, num_events, spread) for i in range(repeat))
+        after = max(bench(BenchSequencer, num_events, spread) for i in range(repeat))
+        print("%-22i %14.0f %14.0f %7.1fx" % (spread, before, after, after / before))
+
+
+if __name__ == '__main__':
+    main()
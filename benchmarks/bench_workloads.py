@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bench_workloads.py
+#
+"""Measure throughput, lateness and CPU use of the sequencer in real time.
+
+Runs idle, steady-rate, burst, scene switching and many-ports workloads
+against in-memory MIDI outputs (see ``harness.py``), so it needs no MIDI
+hardware. The many-ports workload runs with both sequencer engines.
+
+Usage::
+
+    python benchmarks/bench_workloads.py [-h] [--wheel] [--duration SECONDS]
+        [--rate EVENTS_PER_SEC] [--burst EVENTS] [--switches N] [--ports N]
+
+"""
+
+import argparse
+import os
+import tempfile
+
+from harness import Result, run_burst, run_idle, run_ports, run_scenes, run_steady
+
+from midiscenemanager.config import parse_config
+from midiscenemanager.eventqueue import TimingWheel
+
+
+def make_scene_config(num_scenes=8):
+    lines = ["[global]", "default_panel: main", "",
+             "[panel:main]", "title: Main", "scenes:"]
+    lines += ["    scene%i" % i for i in range(num_scenes)]
+
+    for i in range(num_scenes):
+        lines += [
+            "",
+            "[scene:scene%i]" % i,
+            "on_enter:",
+            "    bank_select ch=1 bank=%i" % i,
+            "    program_change ch=1 program=%i" % i,
+            "    channel_volume ch=1 value=100",
+            "    control_change ch=2 cc=91 value=%i" % (i * 8),
+            "on_exit:",
+            "    all_notes_off ch=1",
+        ]
+
+    fd, filename = tempfile.mkstemp(suffix='.cfg')
+
+    with os.fdopen(fd, 'w') as fp:
+        fp.write("\n".join(lines) + "\n")
+
+    try:
+        return parse_config(filename, cache=False)
+    finally:
+        os.remove(filename)
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--wheel', action='store_true',
+                    help="use a TimingWheel as pending event store")
+    ap.add_argument('--duration', type=float, default=2.0,
+                    help="duration of idle and steady workloads (default: %(default)s)")
+    ap.add_argument('--rate', type=int, default=1000,
+                    help="events/sec of steady workload (default: %(default)s)")
+    ap.add_argument('--burst', type=int, default=10000,
+                    help="events per burst (default: %(default)s)")
+    ap.add_argument('--switches', type=int, default=500,
+                    help="number of scene switches (default: %(default)s)")
+    ap.add_argument('--ports', type=int, default=32,
+                    help="number of outputs of many-ports workload (default: %(default)s)")
+    args = ap.parse_args(args)
+
+    def options():
+        return dict(pending=TimingWheel()) if args.wheel else {}
+
+    print(Result.HEADER)
+    print(run_idle(args.duration, **options()).format())
+    print(run_steady(args.rate, args.duration, **options()).format())
+    print(run_steady(args.rate * 10, args.duration, **options()).format())
+    print(run_burst(args.burst, **options()).format())
+    print(run_scenes(make_scene_config(), args.switches).format())
+    print(run_ports(args.ports, duration=args.duration, engine='thread').format())
+    print(run_ports(args.ports, duration=args.duration, engine='asyncio').format())
+
+
+if __name__ == '__main__':
+    main()
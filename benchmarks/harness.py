@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# harness.py
+#
+"""Benchmark harness for the sequencer and scene dispatch path.
+
+Runs the real :class:`~midiscenemanager.sequencer.SequencerThread` in real
+time against :class:`RecordingMidiOut`, an in-memory stand-in for an rtmidi
+output, so no MIDI hardware or driver is needed.
+
+Each workload returns a :class:`Result` with throughput, the lateness of
+sent messages relative to their scheduled time and the CPU time used by the
+process while the workload ran.
+
+"""
+
+import time
+
+from collections import namedtuple
+
+from midiscenemanager.sequencer import SequencerThread
+
+__all__ = ('RecordingMidiOut', 'Result', 'run_burst', 'run_idle', 'run_ports', 'run_scenes',
+           'run_steady')
+
+perf_counter_ns = time.perf_counter_ns
+
+
+class RecordingMidiOut(object):
+    """Stand-in for ``rtmidi.MidiOut`` recording ``(perf_counter_ns(), message)``."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, message):
+        self.sent.append((perf_counter_ns(), message))
+
+    def close_port(self):
+        pass
+
+    def wait_for(self, count, timeout=60):
+        """Wait until ``count`` messages were sent. Returns False on timeout."""
+        end = time.perf_counter() + timeout
+
+        while len(self.sent) < count:
+            if time.perf_counter() > end:
+                return False
+
+            time.sleep(0.001)
+
+        return True
+
+
+class Result(namedtuple('Result', 'name,events,seconds,lateness,cpu')):
+    """Result of a workload run.
+
+    ``seconds`` is the time from scheduling the first until sending the last
+    message, ``lateness`` a sorted list of the lateness of all messages in
+    ns and ``cpu`` the process CPU time divided by wall time.
+
+    """
+
+    @property
+    def throughput(self):
+        return self.events / self.seconds if self.seconds else 0.
+
+    def percentile(self, percent):
+        if not self.lateness:
+            return None
+
+        index = min(len(self.lateness) - 1, int(len(self.lateness) * percent / 100.))
+        return self.lateness[index]
+
+    def format(self):
+        def ms(value):
+            return "-" if value is None else "%.3f" % (value / 1e6)
+
+        return "%-18s %8i %12.0f %9s %9s %9s %6.1f%%" % (
+            self.name, self.events, self.throughput, ms(self.percentile(50)),
+            ms(self.percentile(99)), ms(self.lateness[-1] if self.lateness else None),
+            self.cpu * 100)
+
+    HEADER = "%-18s %8s %12s %9s %9s %9s %7s" % (
+        "workload", "events", "events/s", "p50 ms", "p99 ms", "max ms", "cpu")
+
+
+class _Run(object):
+    # Measures wall and process CPU time of a block
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = (time.process_time() - self.cpu) / self.wall
+
+
+def _start_sequencer(engine='thread', **kwargs):
+    midiout = RecordingMidiOut()
+
+    if engine == 'asyncio':
+        from midiscenemanager.aiosequencer import AsyncSequencer
+        seq = AsyncSequencer(midiout, **kwargs)
+    else:
+        seq = SequencerThread(midiout, **kwargs)
+
+    seq.start()
+
+    # wait until the clock is running
+    while seq._tempo[1] is None:
+        time.sleep(0.001)
+
+    return seq, midiout
+
+
+def _lateness(seq, scheduled, sent):
+    # ``scheduled`` maps id(message) to its tick
+    return sorted(t - seq.tick_to_time(scheduled[id(msg)]) for t, msg in sent)
+
+
+def run_idle(duration=2.0, **kwargs):
+    """Run the sequencer without events and measure its CPU use."""
+    seq, midiout = _start_sequencer(**kwargs)
+
+    try:
+        with _Run() as run:
+            time.sleep(duration)
+    finally:
+        seq.stop()
+
+    return Result('idle', 0, run.wall, [], run.cpu)
+
+
+def run_steady(rate=1000, duration=2.0, **kwargs):
+    """Send ``rate`` events per second for ``duration`` seconds.
+
+    The events are scheduled up-front at evenly spaced ticks.
+
+    """
+    seq, midiout = _start_sequencer(**kwargs)
+    count = int(rate * duration)
+    spacing = seq.seconds_to_ticks(1. / rate)
+    messages = [[0xB0, i % 128, i % 127] for i in range(count)]
+
+    try:
+        with _Run() as run:
+            base = seq.tick + seq.seconds_to_ticks(0.01)
+            scheduled = {id(msg): base + i * spacing for i, msg in enumerate(messages)}
+            seq.add_many(messages, tick=base, deltas=[i * spacing for i in range(count)])
+            midiout.wait_for(count, timeout=duration * 2 + 10)
+    finally:
+        seq.stop()
+
+    return Result('steady %i/s' % rate, len(midiout.sent), run.wall,
+                  _lateness(seq, scheduled, midiout.sent), run.cpu)
+
+
+def run_ports(num_ports=32, rate=100, duration=2.0, engine='thread'):
+    """Send ``rate`` events per second to each of ``num_ports`` outputs.
+
+    ``engine`` is ``'thread'`` (a sequencer thread per output) or
+    ``'asyncio'`` (all outputs on one event loop).
+
+    """
+    outputs = [_start_sequencer(engine) for i in range(num_ports)]
+    count = int(rate * duration)
+    lateness = []
+    sent = 0
+
+    try:
+        with _Run() as run:
+            for seq, midiout in outputs:
+                spacing = seq.seconds_to_ticks(1. / rate)
+                base = seq.tick + seq.seconds_to_ticks(0.01)
+                seq.add_many([[0xB0, 7, i % 128] for i in range(count)], tick=base,
+                             deltas=[i * spacing for i in range(count)])
+                midiout.base = base
+                midiout.spacing = spacing
+
+            for seq, midiout in outputs:
+                midiout.wait_for(count, timeout=duration * 2 + 10)
+    finally:
+        for seq, midiout in outputs:
+            seq.stop()
+
+    for seq, midiout in outputs:
+        sent += len(midiout.sent)
+        lateness.extend(t - seq.tick_to_time(midiout.base + i * midiout.spacing)
+                        for i, (t, msg) in enumerate(midiout.sent))
+
+    return Result('ports %i %s' % (num_ports, engine), sent, run.wall,
+                  sorted(lateness), run.cpu)
+
+
+def run_burst(size=10000, bursts=5, interval=0.2, **kwargs):
+    """Send ``bursts`` bursts of ``size`` events due immediately."""
+    seq, midiout = _start_sequencer(**kwargs)
+    scheduled = {}
+
+    try:
+        with _Run() as run:
+            for n in range(bursts):
+                messages = [[0xB0, i % 128, n] for i in range(size)]
+                tick = seq.tick
+                scheduled.update((id(msg), tick) for msg in messages)
+                seq.add_many(messages, tick=tick)
+                midiout.wait_for((n + 1) * size)
+                time.sleep(interval)
+    finally:
+        seq.stop()
+
+    # throughput while sending, i.e. without the pauses between bursts
+    busy = run.wall - bursts * interval
+    return Result('burst %ix%i' % (bursts, size), len(midiout.sent), busy,
+                  _lateness(seq, scheduled, midiout.sent), run.cpu)
+
+
+def run_scenes(config, switches=1000, interval=0.002):
+    """Switch between the scenes of ``config`` via SceneEngine and MidiOutWrapper.
+
+    ``config`` is a dict as returned by
+    :func:`~midiscenemanager.config.parse_config`. Lateness is the time from
+    requesting the scene switch until the first message was sent.
+
+    """
+    from midiscenemanager.engine import SceneEngine
+    from midiscenemanager.midiio import MidiOutWrapper
+
+    midiout = RecordingMidiOut()
+    engine = SceneEngine(config, MidiOutWrapper(midiout, 'recording'))
+    names = list(engine.scenes)
+    requested = []
+    marks = []
+
+    try:
+        with _Run() as run:
+            for i in range(switches):
+                marks.append(len(midiout.sent))
+                requested.append(perf_counter_ns())
+                engine.enter(names[i % len(names)])
+                time.sleep(interval)
+    finally:
+        engine.close()
+
+    lateness = sorted(midiout.sent[mark][0] - t for mark, t in zip(marks, requested)
+                      if mark < len(midiout.sent))
+    return Result('scenes %i' % len(names), len(midiout.sent), run.wall, lateness, run.cpu)
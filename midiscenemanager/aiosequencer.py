@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# aiosequencer.py
+#
+"""Asyncio-based alternative to :class:`~.sequencer.SequencerThread`.
+
+A :class:`~.sequencer.SequencerThread` per MIDI output means one thread per
+port. :class:`AsyncSequencer` instead schedules its deadlines with
+``loop.call_at`` on an asyncio event loop, which many sequencers can share.
+By default this is the loop of one daemon thread (see
+:func:`get_event_loop_thread`), so any number of outputs need one extra
+thread only.
+
+"""
+
+import asyncio
+import threading
+
+from .sequencer import Sequencer
+
+__all__ = ('AsyncSender', 'AsyncSequencer', 'EventLoopThread', 'get_event_loop_thread')
+
+_loop_thread = None
+_loop_thread_lock = threading.Lock()
+
+
+class EventLoopThread(threading.Thread):
+    """Daemon thread running an asyncio event loop forever."""
+
+    def __init__(self):
+        super(EventLoopThread, self).__init__(name='EventLoopThread', daemon=True)
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+
+    def start(self):
+        super(EventLoopThread, self).start()
+        self._ready.wait()
+
+
+def get_event_loop_thread():
+    """Return the shared :class:`EventLoopThread`, starting it on first use."""
+    global _loop_thread
+
+    with _loop_thread_lock:
+        if _loop_thread is None or not _loop_thread.is_alive():
+            _loop_thread = EventLoopThread()
+            _loop_thread.start()
+
+        return _loop_thread
+
+
+class AsyncSequencer(Sequencer):
+    """Sequencer scheduled with ``call_at`` on an asyncio event loop.
+
+    ``loop`` is the event loop to run on, by default the loop of the shared
+    :class:`EventLoopThread`. The loop must be running in another thread
+    than the one calling :meth:`stop`. Events may be added from any thread.
+
+    Since the loop sleeps with millisecond resolution on most platforms,
+    events may be up to about one millisecond late. See
+    :class:`~.sequencer.Sequencer` for the other constructor arguments.
+
+    """
+
+    def __init__(self, midiout, *args, loop=None, **kwargs):
+        self.loop = loop or get_event_loop_thread().loop
+        self._timer = None
+        self._started = False
+        super(AsyncSequencer, self).__init__(midiout, *args, **kwargs)
+
+    def _wake(self):
+        if self._started and not self._stopped.is_set():
+            self.loop.call_soon_threadsafe(self._run)
+
+    def start(self):
+        self._started = True
+        self.loop.call_soon_threadsafe(self._begin)
+
+    def _begin(self):
+        self._start_clock()
+        self._run()
+
+    def _run(self):
+        # Process due events and schedule the next call at the deadline.
+        # May be called before the deadline, when events were added.
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self._stopped.is_set():
+            return
+
+        self._deadline = -1
+        deadline = self._process(self.clock())
+
+        with self._wakeup:
+            # Publish deadline before looking at the input queue, see _notify()
+            self._deadline = float('inf') if deadline is None else deadline
+
+            if self.queue:
+                self._deadline = -1
+                self._timer = self.loop.call_soon(self._run)
+            elif deadline is not None:
+                delay = (self.tick_to_time(deadline) - self.clock()) / 1e9
+                self._timer = self.loop.call_at(self.loop.time() + delay, self._run)
+
+    def _halt(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        self._finished.set()
+
+    def is_alive(self):
+        return self._started and not self._finished.is_set()
+
+    def stop(self, timeout=5):
+        """Stop scheduling and wait until a currently running batch is finished."""
+        self._stopped.set()
+
+        if self.is_alive():
+            self.loop.call_soon_threadsafe(self._halt)
+            self._finished.wait(timeout)
+
+
+class AsyncSender(object):
+    """Awaitable variants of the ``send_*`` methods of a :class:`~.midiio.MidiOutWrapper`.
+
+    Each ``send_*`` method of the wrapper is available as a coroutine
+    function, which queues the messages like the original and returns when
+    the sequencer has sent them::
+
+        await wrapper.aio.send_program_change(program=10)
+
+    The coroutines can be awaited on any running event loop.
+
+    """
+
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+
+    def __getattr__(self, name):
+        if not name.startswith('send_'):
+            raise AttributeError(name)
+
+        method = getattr(self.wrapper, name)
+
+        async def send(*args, **kwargs):
+            await self.wait_for(method(*args, **kwargs))
+
+        send.__name__ = name
+        send.__doc__ = method.__doc__
+        return send
+
+    async def wait_for(self, tick=None):
+        """Return when all events queued up to ``tick`` (default: now) have been sent."""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def done():
+            if not future.done():
+                future.set_result(None)
+
+        self.wrapper.midi.add_callback(lambda: loop.call_soon_threadsafe(done), tick)
+        await future
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+#
+# commands.py
+#
+"""Build MIDI messages for the commands used in scene definitions.
+
+Each command function takes the arguments of the scene command, checks them
+and returns a tuple of ready-to-send MIDI messages as ``bytes``. The ramp
+commands return a ramp spec instead, whose messages are generated when the
+sequencer runs it (see :mod:`~midiscenemanager.ramps`).
+
+"""
+
+import binascii
+
+from rtmidi.midiconstants import (ALL_NOTES_OFF, ALL_SOUND_OFF, BALANCE, BANK_SELECT_LSB,
+                                  BANK_SELECT_MSB, BREATH_CONTROLLER, CHANNEL_PRESSURE,
+                                  CHANNEL_VOLUME, CONTROL_CHANGE, EXPRESSION_CONTROLLER,
+                                  FOOT_CONTROLLER, LOCAL_CONTROL, MODULATION_WHEEL, NOTE_OFF,
+                                  NOTE_ON, PAN, PITCH_BEND, POLY_PRESSURE, PROGRAM_CHANGE,
+                                  RESET_ALL_CONTROLLERS)
+
+
+def check_value(value, name, maxval=127, minval=0):
+    """Raise ValueError if value is not an integer in range minval..maxval."""
+    if not isinstance(value, int) or not minval <= value <= maxval:
+        raise ValueError("Value for '%s' must be an integer in range %i..%i, not %r." %
+                         (name, minval, maxval, value))
+    return value
+
+
+# Status bytes of channel messages by message kind (0x80..0xE0 >> 4 - 8) and channel - 1
+CHANNEL_STATUS = tuple(tuple(kind | ch for ch in range(16)) for kind in range(0x80, 0xF0, 0x10))
+
+
+class MessageTable(object):
+    """Ready-to-send channel messages as ``bytes``, which are created once and reused.
+
+    :meth:`get` looks messages up in nested lists indexed by status byte and
+    data bytes, so, once a message was created, getting it again allocates
+    no memory (queuing it for sending still does). Tables are filled on first
+    use, so only the messages actually sent take up memory.
+
+    """
+
+    def __init__(self):
+        self._tables = [None] * 0x70
+
+    def get(self, kind, data1, data2=None, ch=1):
+        """Return message of ``kind`` (e.g. 0xB0) for given data bytes and channel (1-16)."""
+        check_value(ch, 'ch', 16, 1)
+        check_value(data1, 'data1')
+        status = CHANNEL_STATUS[(check_value(kind, 'status', 0xEF, 0x80) >> 4) - 8][ch - 1]
+        rows = self._tables[status - 0x80]
+
+        if rows is None:
+            rows = self._tables[status - 0x80] = [None] * 128
+
+        row = rows[data1]
+
+        if row is None:
+            row = rows[data1] = [None] * 129
+
+        # slot 128 holds the two-byte message
+        index = 128 if data2 is None else check_value(data2, 'data2')
+        msg = row[index]
+
+        if msg is None:
+            msg = row[index] = bytes((status, data1) if data2 is None else (status, data1, data2))
+
+        return msg
+
+
+# Shared by all outputs, since the messages are immutable
+MESSAGES = MessageTable()
+
+# Default number of ticks between the values of a ramp
+RAMP_INTERVAL = 10
+# Upper limit for delays and ramp durations in ticks
+MAX_TICKS = 0x7FFFFFFF
+
+# Controllers whose effect depends on the order of other controllers (data
+# entry and (N)RPN), and channel mode messages, which trigger actions (e.g.
+# 'All Notes Off') or reset other state. Messages for them never replace or
+# make redundant other messages.
+ORDERED_CONTROLLERS = frozenset((6, 38, 96, 97, 98, 99, 100, 101) + tuple(range(120, 128)))
+
+# Argument names of scene commands, which are Python keywords
+ARG_ALIASES = {'from': 'start', 'to': 'end'}
+
+
+def parse_sysex_string(s):
+    return binascii.unhexlify(s.replace(' ', ''))
+
+
+def split_sysex(data):
+    """Split ``bytes`` with one or more sysex messages at their F0/F7 boundaries.
+
+    Returns a tuple of the messages. Raises ValueError if the data does not
+    consist of complete sysex messages only.
+
+    """
+    parts = data.split(b'\xF7')
+
+    if len(parts) < 2 or parts.pop():
+        raise ValueError("Sysex data must end with F7.")
+
+    for part in parts:
+        if not part.startswith(b'\xF0') or (len(part) > 1 and max(part[1:]) > 127):
+            raise ValueError("Invalid sysex message: %s" % (part + b'\xF7').hex())
+
+    return tuple(part + b'\xF7' for part in parts)
+
+
+def chunk_sysex(message, size):
+    """Split a sysex message into chunks of at most ``size`` bytes."""
+    if not size or len(message) <= size:
+        return (message,)
+
+    return tuple(message[i:i + size] for i in range(0, len(message), size))
+
+
+def channel_message(status, data1=None, data2=None, ch=1):
+    """Return a MIDI channel mode message."""
+    msg = [(check_value(status, 'status', 0xEF, 0x80) & 0xF0) | (check_value(ch, 'ch', 16, 1) - 1)]
+
+    if data1 is not None:
+        msg.append(check_value(data1, 'data1'))
+
+        if data2 is not None:
+            msg.append(check_value(data2, 'data2'))
+
+    return (bytes(msg),)
+
+
+def system_common_message(status=0xF7, data1=None, data2=None):
+    """Return a MIDI system common message."""
+    msg = [check_value(status, 'status', 0xF7, 0xF1)]
+
+    if status in (0xF1, 0xF2, 0xF3):
+        msg.append(check_value(data1, 'data1'))
+
+    if status == 0xF2:
+        msg.append(check_value(data2, 'data2'))
+
+    return (bytes(msg),)
+
+
+def system_realtime_message(status=0xF8):
+    """Return a MIDI system realtime message."""
+    return (bytes([check_value(status, 'status', 0xFF, 0xF8)]),)
+
+
+def system_exclusive(value=""):
+    """Return MIDI system exclusive message(s) given as a string of hex digits.
+
+    The data may contain several messages, e.g. a bulk dump, which are
+    returned as separate messages.
+
+    """
+    try:
+        data = parse_sysex_string(value) if isinstance(value, str) else bytes(value)
+        return split_sysex(data)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("Invalid sysex string: %r" % value)
+
+
+def note_off(note=60, velocity=0, ch=1):
+    """Return a 'Note Off' message."""
+    return channel_message(NOTE_OFF, note, velocity, ch=ch)
+
+
+def note_on(note=60, velocity=127, ch=1):
+    """Return a 'Note On' message."""
+    return channel_message(NOTE_ON, note, velocity, ch=ch)
+
+
+def poly_pressure(note=60, value=0, ch=1):
+    """Return a 'Polyphonic Pressure' (Aftertouch) message."""
+    return channel_message(POLY_PRESSURE, note, value, ch=ch)
+
+
+def control_change(cc=0, value=0, ch=1):
+    """Return a 'Control Change' message."""
+    return channel_message(CONTROL_CHANGE, cc, value, ch=ch)
+
+
+def program_change(program=0, ch=1):
+    """Return a 'Program Change' message."""
+    return channel_message(PROGRAM_CHANGE, program, ch=ch)
+
+
+def channel_pressure(value=0, ch=1):
+    """Return a 'Channel Pressure' (Aftertouch) message."""
+    return channel_message(CHANNEL_PRESSURE, value, ch=ch)
+
+
+def pitch_bend(value=8192, ch=1):
+    """Return a 'Pitch Bend' message."""
+    check_value(value, 'value', 16383)
+    return channel_message(PITCH_BEND, value & 0x7f, (value >> 7) & 0x7f, ch=ch)
+
+
+def bank_select(bank=None, msb=None, lsb=None, ch=1):
+    """Return 'Bank Select' MSB and/or LSB 'Control Change' messages."""
+    if bank is not None:
+        check_value(bank, 'bank', 16383)
+        msb = (bank >> 7) & 0x7F
+        lsb = bank & 0x7F
+
+    msgs = ()
+
+    if msb is not None:
+        msgs += control_change(BANK_SELECT_MSB, msb, ch=ch)
+
+    if lsb is not None:
+        msgs += control_change(BANK_SELECT_LSB, lsb, ch=ch)
+
+    return msgs
+
+
+def _ramp(status, controllers, start, end, duration, interval, maxval, ch):
+    check_value(start, 'from', maxval)
+    check_value(end, 'to', maxval)
+    check_value(duration, 'duration', MAX_TICKS)
+    check_value(interval, 'interval', MAX_TICKS, 1)
+    status |= check_value(ch, 'ch', 16, 1) - 1
+    return ((status, controllers, start, end, duration, interval),)
+
+
+def cc_ramp(cc=7, start=0, end=127, duration=480, interval=RAMP_INTERVAL, ch=1):
+    """Return a ramp of 'Control Change' values from ``start`` to ``end``.
+
+    ``duration`` and ``interval``, the minimum time between values, are
+    given in ticks.
+
+    """
+    return _ramp(CONTROL_CHANGE, (check_value(cc, 'cc'),), start, end, duration, interval,
+                 127, ch)
+
+
+def cc14_ramp(cc=7, start=0, end=16383, duration=480, interval=RAMP_INTERVAL, ch=1):
+    """Return a ramp of 14-bit values for controller ``cc`` (MSB) and ``cc + 32`` (LSB)."""
+    check_value(cc, 'cc', 31)
+    return _ramp(CONTROL_CHANGE, (cc, cc + 32), start, end, duration, interval, 16383, ch)
+
+
+def pitch_bend_ramp(start=8192, end=8192, duration=480, interval=RAMP_INTERVAL, ch=1):
+    """Return a ramp of 'Pitch Bend' values from ``start`` to ``end``."""
+    return _ramp(PITCH_BEND, (), start, end, duration, interval, 16383, ch)
+
+
+def modulation(value=0, ch=1):
+    """Return a 'Modulation' (CC #1) 'Control Change' message."""
+    return control_change(MODULATION_WHEEL, value, ch=ch)
+
+
+def breath_controller(value=0, ch=1):
+    """Return a 'Breath Controller' (CC #2) 'Control Change' message."""
+    return control_change(BREATH_CONTROLLER, value, ch=ch)
+
+
+def foot_controller(value=0, ch=1):
+    """Return a 'Foot Controller' (CC #4) 'Control Change' message."""
+    return control_change(FOOT_CONTROLLER, value, ch=ch)
+
+
+def channel_volume(value=127, ch=1):
+    """Return a 'Volume' (CC #7) 'Control Change' message."""
+    return control_change(CHANNEL_VOLUME, value, ch=ch)
+
+
+def balance(value=63, ch=1):
+    """Return a 'Balance' (CC #8) 'Control Change' message."""
+    return control_change(BALANCE, value, ch=ch)
+
+
+def pan(value=63, ch=1):
+    """Return a 'Pan' (CC #10) 'Control Change' message."""
+    return control_change(PAN, value, ch=ch)
+
+
+def expression(value=127, ch=1):
+    """Return a 'Expression' (CC #11) 'Control Change' message."""
+    return control_change(EXPRESSION_CONTROLLER, value, ch=ch)
+
+
+def all_sound_off(ch=1):
+    """Return a 'All Sound Off' (CC #120) 'Control Change' message."""
+    return control_change(ALL_SOUND_OFF, 0, ch=ch)
+
+
+def reset_all_controllers(ch=1):
+    """Return a 'Reset All Controllers' (CC #121) 'Control Change' message."""
+    return control_change(RESET_ALL_CONTROLLERS, 0, ch=ch)
+
+
+def local_control(value=1, ch=1):
+    """Return a 'Local Control On/Off' (CC #122) 'Control Change' message."""
+    return control_change(LOCAL_CONTROL, 127 if value else 0, ch=ch)
+
+
+def all_notes_off(ch=1):
+    """Return a 'All Notes Off' (CC #123) 'Control Change' message."""
+    return control_change(ALL_NOTES_OFF, 0, ch=ch)
+
+
+# Maps command names used in scene definitions to message building functions
+COMMANDS = {func.__name__: func for func in (
+    channel_message,
+    system_common_message,
+    system_realtime_message,
+    system_exclusive,
+    note_off,
+    note_on,
+    poly_pressure,
+    control_change,
+    program_change,
+    channel_pressure,
+    pitch_bend,
+    cc_ramp,
+    cc14_ramp,
+    pitch_bend_ramp,
+    bank_select,
+    modulation,
+    breath_controller,
+    foot_controller,
+    channel_volume,
+    balance,
+    pan,
+    expression,
+    all_sound_off,
+    reset_all_controllers,
+    local_control,
+    all_notes_off,
+)}
+
+
+def trigger_key(message):
+    """Return the key to look up the scene triggered by a MIDI message.
+
+    For 'Note On' messages, the key ignores the velocity and 'Note On'
+    messages with velocity 0 (i.e. 'Note Off') return None. For all other
+    messages the key is the complete message as ``bytes``.
+
+    """
+    if message[0] & 0xF0 == NOTE_ON:
+        return bytes(message[:2]) if message[2] else None
+
+    return bytes(message)
+
+
+def compile_command(cmd, args, delay=0):
+    """Compile a scene command into a tuple of ``(delta, message)`` pairs.
+
+    ``delay`` is the default delta in ticks, if ``args`` has no ``'delay'``
+    item. Arguments named like Python keywords are renamed according to
+    :data:`ARG_ALIASES`. Raises ValueError if the command is unknown or its
+    arguments or delay are invalid.
+
+    """
+    func = COMMANDS.get(cmd)
+
+    if func is None:
+        raise ValueError("Unknown command '%s'." % cmd)
+
+    args = {ARG_ALIASES.get(name, name): value for name, value in args.items()}
+    delay = check_value(args.pop('delay', delay), 'delay', MAX_TICKS)
+
+    try:
+        messages = func(**args)
+    except TypeError as exc:
+        raise ValueError("Invalid arguments for command '%s': %s" % (cmd, exc))
+
+    return tuple((delay, msg) for msg in messages)
@@ -1,15 +1,38 @@
 # -*- coding: utf-8 -*-
 """Scene definition and parsing."""
 
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import time
+
 from collections import OrderedDict, namedtuple
 
+from .commands import compile_command, trigger_key
+from .ramps import is_ramp
 from .saneconfigparser import ConfigParser
+from .version import __version__
+
+# Bump when the structure of the parsed configuration changes
+CACHE_VERSION = 6
 
 
-Scene = namedtuple('Scene', 'title,on_enter,on_exit')
+# 'on_enter' and 'on_exit' are tuples of (port, ((delta, message), ...)) pairs,
+# where port is a port alias or None for the default port and message is
+# bytes or a ramp spec tuple (see ramps.py). 'quantize' is None, 'beat',
+# 'bar' or a number of ticks (see SequencerThread.quantize)
+Scene = namedtuple('Scene', 'title,on_enter,on_exit,quantize')
+Scene.__new__.__defaults__ = (None,)
 Panel = namedtuple('Panel', 'title,scenes,cols,rows')
 
 
+class ConfigError(ValueError):
+    """Raised when the scene configuration contains an invalid value."""
+    pass
+
+
 def parse_number(s):
     if s.endswith(('h', 'H')):
         return int(s[:-1], 16)
@@ -24,31 +47,135 @@ def parse_command(s):
     for arg in args:
         try:
             name, val = arg.split('=')
+        except ValueError:
+            raise ValueError("Invalid command argument: %s" % arg)
+
+        try:
             kwargs[name] = parse_number(val)
-        except:
-            pass
+        except ValueError:
+            # port aliases, sysex data given as hex digits, etc.
+            kwargs[name] = val
 
     return cmd, kwargs
 
 
-def parse_scenes(parser):
+def compile_commands(lines, ports=()):
+    """Parse and compile command lines into a tuple of (port, messages) pairs.
+
+    ``messages`` is a tuple of (delta, message) pairs for the output with
+    the alias ``port`` given by the 'port' argument of the commands or for
+    the default output if ``port`` is None. ``ports`` are the valid aliases.
+    The pairs are in order of the first command for each port.
+
+    Unless a command has a 'delay' argument, its messages are delayed by its
+    line index in ticks.
+
+    """
+    compiled = OrderedDict()
+
+    for i, line in enumerate(line for line in lines.splitlines() if line.strip()):
+        try:
+            cmd, args = parse_command(line)
+            port = args.pop('port', None)
+
+            if port is not None:
+                port = str(port)
+
+            if port is not None and port not in ports:
+                raise ValueError("Unknown port alias '%s'." % port)
+
+            compiled[port] = compiled.get(port, ()) + compile_command(cmd, args, delay=i)
+        except ValueError as exc:
+            raise ConfigError("Command #%i '%s': %s" % (i, line.strip(), exc))
+
+    return tuple(compiled.items())
+
+
+def parse_quantize(s):
+    """Parse the 'quantize' option of a scene.
+
+    Returns None, 'beat', 'bar' or a positive number of ticks.
+
+    """
+    s = s.strip().lower()
+
+    if not s or s == 'none':
+        return None
+    elif s in ('beat', 'bar'):
+        return s
+
+    try:
+        ticks = parse_number(s)
+    except ValueError:
+        ticks = 0
+
+    if ticks <= 0:
+        raise ConfigError("Invalid quantize value '%s', must be 'beat', 'bar' or a number "
+                          "of ticks." % s)
+
+    return ticks
+
+
+def parse_scenes(parser, ports=()):
     scenes = OrderedDict()
 
     for sect in parser.sections():
         if sect.startswith('scene:'):
             name = sect.split(':', 1)[1].strip()
-            scenes[name] = Scene(
-                title=parser.get(sect, 'title', name),
-                on_enter=[parse_command(line)
-                          for line in parser.get(sect, 'on_enter', '').splitlines()
-                          if line.strip()],
-                on_exit=[parse_command(line)
-                         for line in parser.get(sect, 'on_exit', '').splitlines()
-                         if line.strip()],
-            )
+            commands = {}
+
+            for option in ('on_enter', 'on_exit'):
+                try:
+                    commands[option] = compile_commands(parser.get(sect, option, ''), ports)
+                except ConfigError as exc:
+                    raise ConfigError("Scene '%s', '%s': %s" % (name, option, exc))
+
+            try:
+                quantize = parse_quantize(parser.get(sect, 'quantize', ''))
+            except ConfigError as exc:
+                raise ConfigError("Scene '%s': %s" % (name, exc))
+
+            scenes[name] = Scene(title=parser.get(sect, 'title', name), quantize=quantize,
+                                 **commands)
     return scenes
 
 
+def parse_triggers(parser):
+    """Return dict mapping trigger keys of incoming MIDI messages to scene names.
+
+    The MIDI messages triggering a scene are given as commands in its
+    'trigger' option. See :func:`~midiscenemanager.commands.trigger_key`.
+
+    """
+    triggers = {}
+
+    for sect in parser.sections():
+        if sect.startswith('scene:'):
+            name = sect.split(':', 1)[1].strip()
+
+            try:
+                # triggers only accept commands without port alias
+                messages = dict(compile_commands(parser.get(sect, 'trigger', ''))).get(None, ())
+
+                for delta, msg in messages:
+                    if is_ramp(msg):
+                        raise ConfigError("Ramps can not be used as triggers.")
+
+                    key = trigger_key(msg)
+
+                    if key is None:
+                        raise ConfigError("'Note On' trigger needs a velocity > 0.")
+                    elif triggers.get(key, name) != name:
+                        raise ConfigError("Message %s already triggers scene '%s'." %
+                                          (key.hex(), triggers[key]))
+
+                    triggers[key] = name
+            except ConfigError as exc:
+                raise ConfigError("Scene '%s', 'trigger': %s" % (name, exc))
+
+    return triggers
+
+
 def parse_panels(parser):
     panels = OrderedDict()
 
@@ -64,19 +191,144 @@ def parse_panels(parser):
     return panels
 
 
-def parse_config(filename):
+def parse_ports(parser):
+    """Return dict mapping port aliases from section 'ports' to MIDI port names."""
+    return OrderedDict(parser.items('ports')) if parser.has_section('ports') else OrderedDict()
+
+
+def parse_config(filename, cache=True):
+    """Parse scene configuration file and return dict with scenes, panels and triggers.
+
+    If ``cache`` is true, the parsed and compiled configuration is cached in
+    a file next to the configuration file (see :func:`load_cache`) and read
+    from there on the next call, unless the configuration file has changed.
+
+    """
+    if cache:
+        config = load_cache(filename)
+
+        if config is not None:
+            return config
+
+        # before reading, so a change while parsing invalidates the cache
+        stat = os.stat(filename)
+
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+
     parser = ConfigParser()
-    parser.read(filename)
+    parser.read_string(data.decode('utf-8'), filename)
+    ports = parse_ports(parser)
     config = {
         'default_panel': parser.get('global', 'default_panel'),
-        'scenes': parse_scenes(parser),
+        'ports': ports,
+        'scenes': parse_scenes(parser, ports),
         'panels': parse_panels(parser),
+        'triggers': parse_triggers(parser),
     }
+
+    if cache:
+        save_cache(filename, config, stat, hashlib.sha1(data).hexdigest())
+
     return config
 
 
+def get_cache_filename(filename):
+    return filename + '.cache'
+
+
+def _cache_key():
+    return (CACHE_VERSION, __version__, marshal.version, tuple(sys.version_info[:2]))
+
+
+def load_cache(filename):
+    """Return cached configuration for given config file or None.
+
+    The cache is only used if it was written by the same version of this
+    module and of Python and if the modification time and size of the
+    configuration file are unchanged. Otherwise the SHA-1 digest of its
+    content is compared, so touching the file does not invalidate the
+    cache.
+
+    """
+    try:
+        with open(get_cache_filename(filename), 'rb') as fp:
+            (key, stat, digest, default_panel, ports, scenes, panels,
+             triggers) = marshal.loads(fp.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if key != _cache_key():
+        return None
+
+    try:
+        st = os.stat(filename)
+
+        if stat is None or (st.st_mtime_ns, st.st_size) != tuple(stat):
+            with open(filename, 'rb') as fp:
+                if hashlib.sha1(fp.read()).hexdigest() != digest:
+                    return None
+    except OSError:
+        return None
+
+    return {
+        'default_panel': default_panel,
+        'ports': OrderedDict(ports),
+        'scenes': OrderedDict((item[0], Scene(*item[1:])) for item in scenes),
+        'panels': OrderedDict((item[0], Panel(*item[1:])) for item in panels),
+        'triggers': triggers,
+    }
+
+
+def save_cache(filename, config, stat, digest):
+    """Write configuration to cache file next to the configuration file.
+
+    ``stat`` is the :func:`os.stat` result of the configuration file and
+    ``digest`` the SHA-1 digest of its content as parsed.
+
+    Errors are ignored, e.g. if the directory is not writable.
+
+    """
+    cachefile = get_cache_filename(filename)
+
+    # A file modified within the timestamp resolution of the file system
+    # may change again with the same time, so only its digest is used then
+    if time.time_ns() - stat.st_mtime_ns > 2 * 10 ** 9:
+        stat = (stat.st_mtime_ns, stat.st_size)
+    else:
+        stat = None
+
+    data = (
+        _cache_key(),
+        stat,
+        digest,
+        config['default_panel'],
+        tuple(config['ports'].items()),
+        tuple((name,) + tuple(scene) for name, scene in config['scenes'].items()),
+        tuple((name,) + tuple(panel) for name, panel in config['panels'].items()),
+        config['triggers'],
+    )
+
+    tmpfile = None
+
+    try:
+        # unique name, since other instances may write the cache at the same time
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(cachefile)),
+                                         prefix=os.path.basename(cachefile) + '.',
+                                         suffix='.tmp', delete=False) as fp:
+            tmpfile = fp.name
+            fp.write(marshal.dumps(data))
+
+        os.replace(tmpfile, cachefile)
+    except OSError:
+        if tmpfile is not None:
+            try:
+                os.unlink(tmpfile)
+            except OSError:
+                pass
+
+
 if __name__ == '__main__':
     import pprint
-    import sys
 
-    pprint.pprint(parse_scenes(sys.argv[1]))
+    pprint.pprint(parse_config(sys.argv[1]))
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# engine.py
+#
+"""GUI-independent scene switching logic."""
+
+import logging
+import threading
+
+from itertools import count
+
+from .transitions import TransitionCache
+
+log = logging.getLogger(__name__)
+
+
+class SceneEngine(object):
+    """Keep track of the current scene and send the MIDI messages of scene changes.
+
+    ``config`` is a dict as returned by :func:`~midiscenemanager.config.parse_config`.
+    ``midi`` is the default :class:`~midiscenemanager.midiio.MidiOutWrapper`
+    or None, in which case scene changes are only tracked. ``ports`` is a
+    :class:`~midiscenemanager.midiio.MidiOutPool` with the outputs for the
+    port aliases used by scene commands. Messages for ports, which are not
+    open, are dropped.
+
+    Callables added with :meth:`add_listener` are called with ``(event, scene)``
+    after the messages for entering (``event == 'enter'``) or exiting
+    (``event == 'exit'``) a scene have been queued.
+
+    When switching directly from one scene to another, only the messages
+    of the compiled transition between them are sent (see
+    :mod:`~midiscenemanager.transitions`), which leaves out messages of the
+    old scene's 'on_exit' list overridden by the new scene's 'on_enter' list.
+    This is only done if both scenes have the same 'quantize' setting.
+
+    The messages of a scene with a 'quantize' setting are scheduled for the
+    next beat or bar of the default output's sequencer, on all outputs at
+    the same time. This also applies to the transition into the scene and
+    to its 'on_exit' messages.
+
+    The messages sent when entering a scene are tagged with a new
+    transaction id. When the scene is exited, the messages with this tag
+    which are still pending (e.g. delayed ones or ramps) are cancelled, so
+    they do not go out after the next scene has started. 'on_exit' messages,
+    whether sent by :meth:`exit` or as part of a transition, are never
+    cancelled, so e.g. delayed note offs always go out.
+
+    Scene changes may be requested from several threads, e.g. the GUI and a
+    MIDI input callback, and are serialized by ``lock``.
+
+    """
+
+    def __init__(self, config, midi=None, ports=None):
+        self.scenes = config['scenes']
+        self.panels = config['panels']
+        self.default_panel = config.get('default_panel')
+        self.triggers = config.get('triggers', {})
+        self.port_aliases = config.get('ports', {})
+        self.midi = midi
+        self.ports = {} if ports is None else ports
+        self.current_scene = None
+        # tag of the messages sent for entering the current scene
+        self.current_tag = None
+        self._tags = count(1)
+        self.transitions = TransitionCache(self.scenes)
+        self.lock = threading.RLock()
+        self._listeners = []
+
+    def add_listener(self, func):
+        self._listeners.append(func)
+
+    def remove_listener(self, func):
+        self._listeners.remove(func)
+
+    def _notify(self, event, scene):
+        for func in self._listeners:
+            func(event, scene)
+
+    def enter(self, scene, force=False):
+        """Make ``scene`` the current scene, exiting the current one first.
+
+        Raises KeyError, if there is no scene with this name. Does nothing, if
+        ``scene`` already is the current scene, unless ``force`` is true.
+        With ``force``, the messages of the scene are sent even if the state
+        cache of an output considers them redundant.
+
+        """
+        if scene not in self.scenes:
+            raise KeyError("Unknown scene '%s'." % scene)
+
+        with self.lock:
+            previous = self.current_scene
+            quantize = self.scenes[scene].quantize
+
+            switch = previous is not None and scene != previous and not force
+
+            if switch and self.scenes[previous].quantize == quantize:
+                log.debug("Switching from scene '%s' to '%s'.", previous, scene)
+                on_exit, on_enter = self.transitions.get(previous, scene)
+                self._cancel()
+                self.current_scene = scene
+                self.current_tag = next(self._tags)
+                # the 'on_exit' messages are never cancelled, as with exit()
+                when = self._grid_time(quantize)
+                self._send_at(on_exit, when)
+                self._send_at(on_enter, when, tag=self.current_tag)
+                self._notify('exit', previous)
+                self._notify('enter', scene)
+            elif scene != previous or force:
+                if scene != previous:
+                    self.exit()
+                else:
+                    self._cancel()
+
+                log.debug("Entering scene '%s'.", scene)
+                self.current_scene = scene
+                self.current_tag = next(self._tags)
+                self._send(self.scenes[scene].on_enter, force, quantize, tag=self.current_tag)
+                self._notify('enter', scene)
+
+    def exit(self):
+        """Exit the current scene, if there is one."""
+        with self.lock:
+            scene = self.current_scene
+
+            if scene is not None:
+                log.debug("Exiting scene '%s'.", scene)
+                self._cancel()
+                self.current_scene = None
+                self._send(self.scenes[scene].on_exit, quantize=self.scenes[scene].quantize)
+                self._notify('exit', scene)
+
+    def _cancel(self):
+        # Cancel the pending messages sent for entering the current scene
+        tag = self.current_tag
+
+        if tag is not None:
+            self.current_tag = None
+
+            for name, output in self.outputs():
+                if output.cancel(tag):
+                    log.debug("Cancelled pending messages of scene '%s' on output '%s'.",
+                              self.current_scene, name)
+
+    def _send(self, commands, force=False, quantize=None, tag=None):
+        self._send_at(commands, self._grid_time(quantize), force, tag)
+
+    def _grid_time(self, quantize):
+        # Return the clock time of the next grid position or None to send now.
+        # The sequencers were started at different times, so the grid
+        # position is computed once on the default (or first started) output
+        # and converted into the ticks of each output via the clock time.
+        if quantize:
+            for name, output in self.outputs():
+                clock = output.midi
+
+                if clock.started:
+                    return clock.tick_to_time(clock.quantize(clock.tick, quantize))
+
+        return None
+
+    def _send_at(self, commands, when=None, force=False, tag=None):
+        # Each output has its own sequencer thread, so this only queues the
+        # messages and all outputs send them in parallel
+        for port, messages in commands:
+            midi = self.midi if port is None else self.ports.get(port)
+
+            if midi:
+                if when is not None and midi.midi.started:
+                    tick = midi.midi.time_to_tick(when)
+                else:
+                    # not quantized or output not started yet: send now
+                    tick = None
+
+                midi.send_messages(messages, tick=tick, force=force, tag=tag)
+
+    def outputs(self):
+        """Return list of (name, output) pairs for the default and all aliased outputs.
+
+        The name of the default output is its port name.
+
+        """
+        outputs = [(self.midi.name, self.midi)] if self.midi else []
+
+        if self.ports:
+            outputs.extend(self.ports.items())
+
+        return outputs
+
+    def toggle(self, scene):
+        """Enter ``scene`` or exit it, if it is the current scene.
+
+        Returns the name of the current scene afterwards or None.
+
+        """
+        with self.lock:
+            if scene == self.current_scene:
+                self.exit()
+            else:
+                self.enter(scene)
+
+            return self.current_scene
+
+    def close(self):
+        """Stop the sequencers and close the MIDI outputs."""
+        if self.midi:
+            self.midi._cleanup()
+            self.midi = None
+
+        if self.ports:
+            self.ports.close()
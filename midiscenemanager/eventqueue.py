@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+#
+# eventqueue.py
+#
+"""Pending event stores for :class:`~midiscenemanager.sequencer.SequencerThread`.
+
+Events are ``(tick, seq, ...)`` tuples, where ``seq`` is a unique running
+number. A store must implement the following interface:
+
+``push(event)``
+    Add one event.
+``extend(events)``
+    Add several events.
+``pop_due(tick)``
+    Remove and return all events with a tick less than or equal to ``tick``
+    as a list sorted by ``(tick, seq)``.
+``next_tick()``
+    Return the tick of the earliest event or None if the store is empty.
+``__len__()``
+    Return the number of stored events.
+
+"""
+
+from heapq import heapify, heappop, heappush
+from math import ceil
+
+__all__ = ('EventHeap', 'TimingWheel')
+
+
+class EventHeap(object):
+    """Pending event store backed by a binary heap.
+
+    Insert and expire are O(log n). This is the default store and the best
+    choice for the usual number of pending events.
+
+    """
+
+    def __init__(self):
+        self._heap = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, event):
+        heappush(self._heap, event)
+
+    def extend(self, events):
+        heap = self._heap
+
+        if len(events) > len(heap):
+            # cheaper to rebuild the heap in O(n + k)
+            heap.extend(events)
+            heapify(heap)
+        else:
+            for event in events:
+                heappush(heap, event)
+
+    def pop_due(self, tick):
+        heap = self._heap
+        due = []
+
+        while heap and heap[0][0] <= tick:
+            due.append(heappop(heap))
+
+        return due
+
+    def next_tick(self):
+        return self._heap[0][0] if self._heap else None
+
+
+class TimingWheel(object):
+    """Pending event store backed by a hierarchical timing wheel.
+
+    The wheel has ``levels`` levels of ``2 ** bits`` slots each. A slot on
+    level 0 holds the events for a single tick, a slot on level ``n`` the
+    events for ``2 ** (bits * n)`` ticks. Events are put on the lowest level,
+    whose slots still distinguish their tick from the current position and
+    are moved down ("cascaded") a level when the position reaches their
+    slot. Events beyond the range of the top level are kept in an overflow
+    heap.
+
+    Insert and expire are O(1) amortized. A bitmap of the non-empty slots of
+    each level lets the wheel skip over empty slots. But the constant
+    factors are much higher than for :class:`EventHeap`: in
+    ``benchmarks/bench_eventqueue.py`` (events spread over ten minutes),
+    inserting is about 2-3 times slower at any size and expiring is only
+    faster from about a million pending events on. Below that, the heap is
+    the better choice.
+
+    Fractional ticks are rounded up to the next whole tick.
+
+    """
+
+    def __init__(self, bits=8, levels=4):
+        self._bits = bits
+        self._size = 1 << bits
+        self._mask = self._size - 1
+        self._levels = levels
+        self._wheels = [[[] for i in range(self._size)] for level in range(levels)]
+        # number of events on each level
+        self._counts = [0] * levels
+        # bitmap of the non-empty slots of each level
+        self._occupied = [0] * levels
+        # events beyond the range of the wheel (a heap)
+        self._overflow = []
+        # events added for a tick that has already expired
+        self._late = []
+        # next tick to expire
+        self._now = 0
+
+    def __len__(self):
+        return sum(self._counts) + len(self._overflow) + len(self._late)
+
+    def push(self, event):
+        tick = event[0]
+        now = self._now
+
+        if tick.__class__ is not int:
+            tick = ceil(tick)
+
+        if tick < now:
+            self._late.append(event)
+            return
+
+        # lowest level whose slots tell apart the tick and current position
+        level = (((tick ^ now) | 1).bit_length() - 1) // self._bits
+
+        if level < self._levels:
+            idx = (tick >> (self._bits * level)) & self._mask
+            self._wheels[level][idx].append(event)
+            self._counts[level] += 1
+            self._occupied[level] |= 1 << idx
+        else:
+            heappush(self._overflow, event)
+
+    def extend(self, events):
+        push = self.push
+
+        for event in events:
+            push(event)
+
+    def _cascade(self):
+        # Called when the position has reached the start of a slot on level 1
+        # or higher: move the events from these slots to the lower levels,
+        # starting at the highest level.
+        now = self._now
+        bits = self._bits
+        top = 0
+
+        for level in range(1, self._levels + 1):
+            if now & ((1 << (bits * level)) - 1):
+                break
+
+            top = level
+
+        if top == self._levels:
+            overflow = self._overflow
+            end = now + (1 << (bits * self._levels))
+
+            while overflow and ceil(overflow[0][0]) < end:
+                self.push(heappop(overflow))
+
+            top -= 1
+
+        for level in range(top, 0, -1):
+            idx = (now >> (bits * level)) & self._mask
+            slot = self._wheels[level][idx]
+
+            if slot:
+                self._wheels[level][idx] = []
+                self._counts[level] -= len(slot)
+                self._occupied[level] &= ~(1 << idx)
+
+                for event in slot:
+                    self.push(event)
+
+    def pop_due(self, tick):
+        due = self._late
+        self._late = []
+
+        limit = int(tick)
+        bits = self._bits
+        mask = self._mask
+        counts = self._counts
+        wheel = self._wheels[0]
+
+        while self._now <= limit:
+            now = self._now
+
+            if counts[0]:
+                end = min(limit, now | mask)
+                occupied = self._occupied[0]
+                # non-empty slots from the current position up to the end
+                pending = occupied & ((2 << (end & mask)) - 1) & ~((1 << (now & mask)) - 1)
+
+                while pending:
+                    lowest = pending & -pending
+                    idx = lowest.bit_length() - 1
+                    slot = wheel[idx]
+                    due.extend(slot)
+                    counts[0] -= len(slot)
+                    wheel[idx] = []
+                    pending ^= lowest
+                    occupied ^= lowest
+
+                self._occupied[0] = occupied
+                self._now = end + 1
+            else:
+                # Nothing on the lowest level, skip ahead to the start of the
+                # next non-empty slot on any level. Events on a level are
+                # always in later slots of its current rotation.
+                boundary = None
+
+                for level in range(1, self._levels):
+                    if counts[level]:
+                        shift = bits * level
+                        start = ((now >> shift) & mask) + 1
+                        occupied = self._occupied[level] >> start
+                        idx = start + (occupied & -occupied).bit_length() - 1
+                        tick = ((now >> (shift + bits)) << (shift + bits)) | (idx << shift)
+
+                        if boundary is None or tick < boundary:
+                            boundary = tick
+
+                if boundary is None:
+                    if self._overflow:
+                        # jump to the wheel rotation of the earliest overflow event
+                        shift = bits * self._levels
+                        boundary = max(((now >> shift) + 1) << shift,
+                                       (ceil(self._overflow[0][0]) >> shift) << shift)
+                    else:
+                        boundary = limit + 1
+
+                self._now = min(boundary, limit + 1)
+
+            if not self._now & mask:
+                self._cascade()
+
+        if len(due) > 1:
+            due.sort()
+
+        return due
+
+    def next_tick(self):
+        if self._late:
+            return min(self._late)[0]
+
+        now = self._now
+
+        for level in range(self._levels):
+            if self._counts[level]:
+                idx = (now >> (self._bits * level)) & self._mask
+                # Events on level 0 are in the current slot or later ones,
+                # events on higher levels always in later slots
+                start = idx + 1 if level else idx
+                occupied = self._occupied[level] >> start
+
+                if occupied:
+                    i = start + (occupied & -occupied).bit_length() - 1
+
+                    if level:
+                        return min(self._wheels[level][i])[0]
+
+                    return (now & ~self._mask) | i
+
+        if self._overflow:
+            return self._overflow[0][0]
+
+        return None
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+#
+# headless.py
+#
+"""Switch scenes without a GUI, controlled via stdin or a socket.
+
+Commands are read one per line. Each command is answered with a line
+starting with ``OK`` or ``ERR``:
+
+``<scene>`` or ``enter <scene>``
+    Enter the given scene.
+``force <scene>``
+    Enter the given scene and send all its messages, even if it is the
+    current scene or the state cache considers them redundant.
+``toggle <scene>``
+    Enter the given scene or exit it, if it is the current scene.
+``exit``
+    Exit the current scene.
+``current``
+    Show the name of the current scene.
+``list``
+    Show the names of all scenes.
+``metrics``
+    Show the sequencer metrics of all outputs (needs ``--metrics``).
+``start``, ``stop``
+    Start or stop sending MIDI clock on the default output.
+``bpm <value>``
+    Set the tempo of all outputs (MIDI clock and quantized scenes).
+``quit``
+    Close the connection (socket) or stop the program (stdin).
+
+Scenes can also be switched by MIDI messages received on the MIDI input
+given with ``--input``, as configured by the 'trigger' option of scenes.
+
+While a MIDI input or a socket is used, the program keeps running after the
+end of standard input (or with ``--no-stdin``) until it receives SIGINT or
+SIGTERM.
+
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socketserver
+import sys
+import threading
+
+from .config import ConfigError, parse_config
+from .engine import SceneEngine
+from .metrics import MetricsDumper
+from .realtime import SCHED_POLICIES, parse_cpus
+
+log = logging.getLogger('midiscenemanager')
+
+
+class CommandHandler(object):
+    """Execute text commands on a :class:`~.engine.SceneEngine`.
+
+    Calls may come from several threads and are serialized.
+
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = engine.lock
+
+    def __call__(self, line):
+        """Execute command line and return reply line."""
+        cmd, _, arg = line.strip().partition(' ')
+        arg = arg.strip()
+        engine = self.engine
+
+        with self.lock:
+            try:
+                if cmd == 'list':
+                    return 'OK ' + ' '.join(engine.scenes)
+                elif cmd == 'metrics':
+                    return 'OK ' + '; '.join("%s: %s" % (name, output.metrics.format())
+                                             for name, output in engine.outputs()
+                                             if output.metrics)
+                elif cmd == 'current':
+                    pass
+                elif cmd == 'bpm' and arg:
+                    try:
+                        bpm = float(arg)
+                    except ValueError:
+                        bpm = 0
+
+                    if bpm <= 0:
+                        return "ERR Invalid tempo: %s" % arg
+
+                    for name, output in engine.outputs():
+                        output.midi.bpm = bpm
+                elif cmd in ('start', 'stop') and not arg:
+                    if not engine.midi:
+                        return "ERR No MIDI output."
+                    elif cmd == 'start':
+                        engine.midi.midi.start_midi_clock()
+                    else:
+                        engine.midi.midi.stop_midi_clock()
+                elif cmd == 'exit':
+                    engine.exit()
+                elif cmd == 'toggle' and arg:
+                    engine.toggle(arg)
+                elif cmd == 'enter' and arg:
+                    engine.enter(arg)
+                elif cmd == 'force' and arg:
+                    engine.enter(arg, force=True)
+                elif cmd and not arg and cmd not in ('bpm', 'enter', 'force', 'toggle'):
+                    engine.enter(cmd)
+                else:
+                    return "ERR Invalid command: %s" % line.strip()
+            except KeyError as exc:
+                return "ERR %s" % exc.args[0]
+
+            return 'OK ' + (engine.current_scene or '')
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode('utf-8', 'replace')
+
+            if line.strip() == 'quit':
+                break
+            elif line.strip():
+                self.wfile.write((self.server.handler(line) + '\n').encode('utf-8'))
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+def make_server(address, handler):
+    """Return a socket server for ``address`` passing commands to ``handler``.
+
+    ``address`` is either ``host:port`` for a TCP socket or the file system
+    path of a Unix domain socket. Raises ValueError for a path, if the
+    platform has no Unix domain sockets (e.g. Windows).
+
+    """
+    host, sep, port = address.rpartition(':')
+
+    if sep and port.isdigit():
+        server = TCPServer((host or 'localhost', int(port)), _RequestHandler)
+    elif not hasattr(socketserver, 'UnixStreamServer'):
+        raise ValueError("Unix domain sockets are not supported on this platform, "
+                         "use HOST:PORT instead.")
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+
+        server = UnixServer(address, _RequestHandler)
+
+    server.handler = handler
+    return server
+
+
+def main(args=None):
+    """Entry point of the headless scene manager."""
+    ap = argparse.ArgumentParser(prog='midiscenemanager-headless',
+                                 description=__doc__.splitlines()[0])
+    ap.add_argument('-a', '--api', default='UNSPECIFIED', help="MIDI API (default: %(default)s)")
+    ap.add_argument('-p', '--port', help="MIDI output port name or number")
+    ap.add_argument('-i', '--input', metavar='PORT',
+                    help="MIDI input port name or number for scene triggers")
+    ap.add_argument('--sysex-chunk-size', type=int, default=0, metavar='BYTES',
+                    help="Split sysex messages into chunks of this size (default: no chunks)")
+    ap.add_argument('--sysex-rate', type=int, default=0, metavar='BYTES',
+                    help="Limit sysex transfers to this many bytes/sec (default: no limit)")
+    ap.add_argument('-c', '--state-cache', action='store_true',
+                    help="Drop messages which would not change the state of the devices")
+    ap.add_argument('-m', '--metrics', type=float, metavar='SECONDS',
+                    help="Collect sequencer metrics and log them every SECONDS (0: on exit)")
+    ap.add_argument('--log-messages', action='store_true',
+                    help="Log every sent MIDI message (with --verbose)")
+    ap.add_argument('-b', '--bpm', type=float, default=120.0,
+                    help="Tempo for MIDI clock and quantized scenes (default: %(default)s)")
+    ap.add_argument('--clock', action='store_true',
+                    help="Send MIDI clock on the output port from startup on")
+    ap.add_argument('-e', '--engine', choices=('thread', 'asyncio'), default='thread',
+                    help="Sequencer engine: a thread per output or one shared asyncio loop "
+                         "(default: %(default)s)")
+    ap.add_argument('--sched-policy', choices=SCHED_POLICIES,
+                    help="Scheduling policy of the sequencer threads (default: unchanged)")
+    ap.add_argument('--sched-priority', type=int, metavar='N',
+                    help="Real-time priority for the 'fifo' and 'rr' policies (default: 50)")
+    ap.add_argument('--cpus', type=parse_cpus, metavar='LIST',
+                    help="Pin the sequencer threads to these CPUs, e.g. '2,3' or '0-1'")
+    ap.add_argument('--lock-memory', action='store_true',
+                    help="Lock the process memory into RAM to avoid page faults")
+    ap.add_argument('-s', '--scene', help="Scene to enter at startup")
+    ap.add_argument('-l', '--listen', metavar='ADDRESS',
+                    help="Accept commands on socket at HOST:PORT or Unix socket path")
+    ap.add_argument('-n', '--no-stdin', action='store_true',
+                    help="Do not read commands from standard input")
+    ap.add_argument('-v', '--verbose', action='store_true', help="Enable debug logging")
+    ap.add_argument('config', help="Scene configuration file")
+    args = ap.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(levelname)s: %(message)s")
+
+    try:
+        engine = SceneEngine(parse_config(args.config))
+    except ConfigError as exc:
+        return "Error in configuration file '{}': {}".format(args.config, exc)
+
+    options = dict(sysex_chunk_size=args.sysex_chunk_size, sysex_rate=args.sysex_rate,
+                   state_cache=args.state_cache, metrics=args.metrics is not None,
+                   log_messages=args.log_messages, bpm=args.bpm, engine=args.engine,
+                   sched_policy=args.sched_policy, sched_priority=args.sched_priority,
+                   cpus=args.cpus, lock_memory=args.lock_memory)
+
+    if args.port is not None:
+        from .midiio import get_midiout
+
+        try:
+            engine.midi = get_midiout(args.port, api=args.api, **options)
+        except Exception as exc:
+            return "Could not open MIDI port: {}".format(exc)
+
+        log.info("Opened MIDI out port '%s'.", engine.midi.name)
+
+    if engine.port_aliases:
+        from .midiio import MidiOutPool
+
+        engine.ports = MidiOutPool(api=args.api, **options)
+        engine.ports.open(engine.port_aliases)
+
+    handler = CommandHandler(engine)
+    listener = server = dumper = None
+    stopped = threading.Event()
+    sigterm = None
+
+    if threading.current_thread() is threading.main_thread():
+        sigterm = signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+
+    if args.metrics is not None:
+        dumper = MetricsDumper(lambda: [(name, output.metrics)
+                                        for name, output in engine.outputs()],
+                               args.metrics)
+
+        if args.metrics > 0:
+            dumper.start()
+
+    if args.input is not None:
+        from .midiio import get_midiin
+
+        try:
+            listener = get_midiin(args.input, engine.triggers, engine.enter, api=args.api,
+                                  midiout=engine.midi)
+        except Exception as exc:
+            engine.close()
+            return "Could not open MIDI input port: {}".format(exc)
+
+        log.info("Listening for scene triggers on MIDI input port '%s'.", listener.name)
+
+    try:
+        if args.clock and engine.midi:
+            engine.midi.midi.start_midi_clock()
+
+        if args.scene:
+            print(handler(args.scene))
+
+        if args.listen:
+            try:
+                server = make_server(args.listen, handler)
+            except (OSError, ValueError) as exc:
+                return "Could not listen on '{}': {}".format(args.listen, exc)
+
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            log.info("Listening for commands on '%s'.", args.listen)
+
+        if not args.no_stdin:
+            for line in sys.stdin:
+                if line.strip() == 'quit':
+                    stopped.set()
+                    break
+                elif line.strip():
+                    print(handler(line), flush=True)
+
+        # Keep running as a daemon for the MIDI input and socket clients
+        if listener or server:
+            stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if sigterm is not None:
+            signal.signal(signal.SIGTERM, sigterm)
+
+        if server:
+            server.shutdown()
+            server.server_close()
+
+        if dumper:
+            dumper.stop()
+            dumper.dump()
+
+        if listener:
+            listener.close()
+            stats = listener.latency_stats()
+
+            if stats:
+                log.info("MIDI trigger latency (ms): min %(min).3f, median %(median).3f, "
+                         "max %(max).3f (%(count)i triggers)", stats)
+
+        engine.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main() or 0)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# metrics.py
+#
+"""Low-overhead metrics for the sequencer: counters, histograms, queue depth."""
+
+import logging
+import threading
+
+__all__ = ('Histogram', 'MetricsDumper', 'SequencerMetrics')
+
+log = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """Histogram of non-negative integer values with bounded relative error.
+
+    Like an HDR histogram, values are counted in buckets which are linear
+    within each power of two, with ``2 ** sub_bits`` buckets per power of
+    two, so the relative error of reported values is at most
+    ``2 ** -sub_bits``. Values from ``2 ** max_bits`` up are counted in the
+    last bucket. Recording a value is O(1) and allocates nothing.
+
+    """
+
+    def __init__(self, sub_bits=5, max_bits=40):
+        self.sub_bits = sub_bits
+        self._last = self._index((1 << max_bits) - 1)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (self._last + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.sub_bits - 1
+
+        if shift <= 0:
+            return value
+
+        return (shift << self.sub_bits) + (value >> shift)
+
+    def _lowest(self, index):
+        # lowest value counted in bucket ``index``
+        sub_bits = self.sub_bits
+
+        if index < 2 << sub_bits:
+            return index
+
+        shift = (index >> sub_bits) - 1
+        return (index - (shift << sub_bits)) << shift
+
+    def record(self, value):
+        value = int(value)
+
+        if value < 0:
+            value = 0
+
+        self.counts[min(self._index(value), self._last)] += 1
+        self.count += 1
+        self.total += value
+
+        if self.min is None or value < self.min:
+            self.min = value
+
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        """Return value below or at which ``percent`` percent of the values are."""
+        if not self.count:
+            return None
+
+        threshold = self.count * percent / 100.
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            seen += count
+
+            if count and seen >= threshold:
+                if index == self._last:
+                    return self.max
+
+                # report the highest value of the bucket, but not above max
+                return max(self.min, min(self._lowest(index + 1) - 1, self.max))
+
+        return self.max
+
+    def summary(self, percentiles=(50, 99, 99.9)):
+        """Return dict with count, min, mean, max and the given percentiles."""
+        stats = {
+            'count': self.count,
+            'min': self.min,
+            'mean': self.mean(),
+            'max': self.max,
+        }
+
+        for percent in percentiles:
+            stats['p%s' % percent] = self.percentile(percent)
+
+        return stats
+
+
+class SequencerMetrics(object):
+    """Metrics collected by a :class:`~midiscenemanager.sequencer.SequencerThread`.
+
+    All times are in nanoseconds:
+
+    ``lateness``
+        Histogram of the time between the scheduled time of events and the
+        start of sending them.
+    ``send_time``
+        Histogram of the time the MIDI output took to send a message.
+    ``events``, ``batches``
+        Number of events sent and number of loop iterations, which sent
+        events.
+    ``pending``, ``max_pending``
+        Current and maximum number of events waiting for their tick.
+    ``max_batch``
+        Maximum number of events sent in one loop iteration.
+
+    Only the sequencer thread updates the metrics. Reading them from other
+    threads is not synchronized, so values may be off by a few events.
+
+    """
+
+    def __init__(self):
+        self.lateness = Histogram()
+        self.send_time = Histogram()
+        self.reset()
+
+    def reset(self):
+        self.lateness.reset()
+        self.send_time.reset()
+        self.events = 0
+        self.batches = 0
+        self.pending = 0
+        self.max_pending = 0
+        self.max_batch = 0
+
+    def record_batch(self, size, pending):
+        self.events += size
+        self.batches += 1
+        self.pending = pending
+
+        if size > self.max_batch:
+            self.max_batch = size
+
+        if pending > self.max_pending:
+            self.max_pending = pending
+
+    def snapshot(self):
+        """Return dict with the current metrics."""
+        return {
+            'events': self.events,
+            'batches': self.batches,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'max_batch': self.max_batch,
+            'lateness': self.lateness.summary(),
+            'send_time': self.send_time.summary(),
+        }
+
+    def format(self):
+        """Return the current metrics as a one-line string with times in ms."""
+        def ms(stats):
+            if not stats['count']:
+                return "-"
+
+            return "p50 %.3f p99 %.3f max %.3f" % (stats['p50'] / 1e6, stats['p99'] / 1e6,
+                                                   stats['max'] / 1e6)
+
+        snapshot = self.snapshot()
+        counts = ("events %(events)i, pending %(pending)i (max %(max_pending)i), "
+                  "max batch %(max_batch)i" % snapshot)
+        return "%s, lateness ms: %s, send ms: %s" % (counts, ms(snapshot['lateness']),
+                                                     ms(snapshot['send_time']))
+
+
+class MetricsDumper(threading.Thread):
+    """Thread logging metrics periodically.
+
+    ``sources`` is a callable returning an iterable of ``(name, metrics)``
+    pairs, where ``metrics`` is a :class:`SequencerMetrics` instance or None
+    (skipped). It is called every ``interval`` seconds.
+
+    """
+
+    def __init__(self, sources, interval=10.0, logger=None):
+        super(MetricsDumper, self).__init__(name='MetricsDumper', daemon=True)
+        self.sources = sources
+        self.interval = interval
+        self.logger = logger or log
+        self._stopped = threading.Event()
+
+    def dump(self):
+        for name, metrics in self.sources():
+            if metrics is not None:
+                self.logger.info("Metrics for '%s': %s", name, metrics.format())
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.dump()
+
+    def stop(self):
+        self._stopped.set()
+
+        if self.is_alive():
+            self.join()
@@ -4,24 +4,168 @@
 #
 """Wrapper clas for rtmidi.MidiOut to facilitate sending common MIDI events."""
 
-import binascii
+import logging
+import time
 
-import rtmidi
-from rtmidi.midiconstants import *
-from rtmidi.midiutil import open_midioutput
+from collections import deque
+from functools import partial
+from itertools import groupby
 
-from .sequencer import SequencerThread
+from rtmidi.midiconstants import (ALL_NOTES_OFF, ALL_SOUND_OFF, BALANCE, BREATH_CONTROLLER,
+                                  CHANNEL_PRESSURE, CHANNEL_VOLUME, CONTROL_CHANGE,
+                                  EXPRESSION_CONTROLLER, FOOT_CONTROLLER, LOCAL_CONTROL,
+                                  MODULATION_WHEEL, NOTE_OFF, NOTE_ON, PAN, PITCH_BEND,
+                                  POLY_PRESSURE, PROGRAM_CHANGE, RESET_ALL_CONTROLLERS)
 
+from . import commands
+from .commands import parse_sysex_string, trigger_key  # noqa:F401
+from .metrics import SequencerMetrics
+from .portregistry import get_port_registry
+from .ramps import RampEvent, bind_ramps
+from .sequencer import SONG_STOP, SequencerThread
 
-def parse_sysex_string(s):
-    return binascii.unhexlify(s.replace(' ', ''))
+log = logging.getLogger(__name__)
+
+# Names of the schedulers MidiOutWrapper can use
+ENGINES = ('thread', 'asyncio')
+
+
+class StateCache(object):
+    """Controller, program and pitch bend state of the channels of an output.
+
+    :meth:`filter` drops messages which would not change the state, as far
+    as it is known from the messages passed through it. Bank select
+    changes make the next program change on the channel go through, 'Reset
+    All Controllers' clears the controller and pitch bend state of the
+    channel and system exclusive and 'System Reset' messages clear the whole
+    state. Ramps always go through and clear the state of their controller.
+
+    """
+
+    def __init__(self):
+        self._state = {}
+
+    def invalidate(self):
+        """Forget all state, e.g. after the device was reconnected."""
+        self._state.clear()
+
+    def filter(self, messages, force=False):
+        """Return list of the (delta, message) pairs, which change the state.
+
+        With ``force`` true, all messages are returned and only recorded.
+
+        """
+        state = self._state
+        result = []
+
+        for item in messages:
+            msg = item[1]
+            status = msg[0]
+            kind = status & 0xF0
+
+            if msg.__class__ is tuple:
+                # ramp spec, the values it will send are not known here
+                for key in [(status, cc) for cc in msg[1]] or [status]:
+                    state.pop(key, None)
+            elif kind == 0xB0:
+                cc = msg[1]
+
+                if cc in commands.ORDERED_CONTROLLERS:
+                    if cc == 121:
+                        for key in [key for key in state
+                                    if key.__class__ is tuple and key[0] == status]:
+                            del state[key]
+
+                        # the device also resets pitch bend (channel pressure
+                        # is not cached)
+                        state.pop(0xE0 | (status & 0x0F), None)
+                else:
+                    key = (status, cc)
+
+                    if not force and state.get(key) == msg[2]:
+                        continue
+
+                    state[key] = msg[2]
+
+                    if cc in (0, 32):
+                        state.pop(0xC0 | (status & 0x0F), None)
+            elif kind == 0xC0 or kind == 0xE0:
+                value = bytes(msg[1:])
+
+                if not force and state.get(status) == value:
+                    continue
+
+                state[status] = value
+            elif status == 0xF0 or status == 0xFF:
+                state.clear()
+
+            result.append(item)
+
+        return result
 
 
 class MidiOutWrapper:
-    def __init__(self, midi, name, ch=1):
+    """Send MIDI messages to an rtmidi output via a :class:`SequencerThread`.
+
+    System exclusive messages can be sent in bulk transfer mode, in which
+    they are split into chunks of at most ``sysex_chunk_size`` bytes and
+    paced at ``sysex_rate`` bytes per second, so they do not overflow the
+    input buffers of slow devices. Chunks are separate sequencer events,
+    so other messages are sent interleaved with them. A value of 0 disables
+    chunking or pacing respectively.
+
+    With ``state_cache`` true, messages which would not change the
+    controller, program or pitch bend state of a channel, as set by the
+    messages sent before, are dropped (see :class:`StateCache`). The state
+    is forgotten, when the rtmidi output is replaced.
+
+    With ``metrics`` true, the sequencer collects metrics available via the
+    ``metrics`` attribute (see :class:`~.metrics.SequencerMetrics`). With
+    ``log_messages`` true, it logs each sent message at debug level.
+
+    ``bpm`` is the initial tempo of the sequencer, which determines the beat
+    and bar grid for quantized messages and the rate of MIDI clock sent
+    with :meth:`SequencerThread.start_midi_clock`.
+
+    ``engine`` selects the scheduler: ``'thread'`` runs a
+    :class:`SequencerThread` per output, ``'asyncio'`` an
+    :class:`~.aiosequencer.AsyncSequencer` on the event loop shared by all
+    outputs using it. The ``send_*`` methods return the tick of the last
+    queued message, awaitable variants of them are available via ``aio``
+    (see :class:`~.aiosequencer.AsyncSender`).
+
+    ``sched_policy``, ``sched_priority``, ``cpus`` and ``lock_memory`` are
+    the real-time settings of the sequencer thread (see
+    :class:`SequencerThread`). They are ignored with the asyncio engine.
+
+    """
+
+    def __init__(self, midi, name, ch=1, sysex_chunk_size=0, sysex_rate=0, state_cache=False,
+                 metrics=False, log_messages=False, bpm=120.0, engine='thread',
+                 sched_policy=None, sched_priority=None, cpus=None, lock_memory=False):
+        if engine not in ENGINES:
+            raise ValueError("Unknown sequencer engine '%s'." % engine)
+
         self.channel = ch
+        self.engine = engine
+        self.state = StateCache() if state_cache else None
+        self._seq_options = dict(metrics=SequencerMetrics() if metrics else None,
+                                 log_messages=log_messages, bpm=bpm)
+        realtime = dict(sched_policy=sched_policy, sched_priority=sched_priority, cpus=cpus,
+                        lock_memory=lock_memory)
+
+        if engine == 'thread':
+            self._seq_options.update(realtime)
+        elif sched_policy or cpus or lock_memory:
+            log.warning("Real-time settings are not supported by the '%s' engine.", engine)
         self.midi = midi
         self.name = name
+        self.sysex_chunk_size = sysex_chunk_size
+        self.sysex_rate = sysex_rate
+        # tick at which pending sysex chunks will have been transferred
+        self._sysex_end = 0
+        # maps tags to the tick up to which events with the tag may be pending
+        self._tag_ends = {}
 
     @property
     def midi(self):
@@ -32,136 +176,512 @@ class MidiOutWrapper:
         if hasattr(self, '_midi'):
             with self._midi.lock:
                 self._midi.midiout = obj
+
+            self.invalidate()
         else:
-            self._midi = SequencerThread(obj)
+            if self.engine == 'asyncio':
+                from .aiosequencer import AsyncSequencer as sequencer
+            else:
+                sequencer = SequencerThread
+
+            self._midi = sequencer(obj, **self._seq_options)
             self._midi.start()
 
+    def swap(self, midiout, name):
+        """Hand the output over to another rtmidi output without stopping the sequencer.
+
+        Pending events stay in the sequencer and are sent to ``midiout`` at
+        their scheduled tick, a message being sent in the meantime still goes
+        to the old output, which is closed afterwards. The state cache is
+        cleared, so the next scene sends all its messages to the new output.
+
+        """
+        old = self.midi.midiout
+        self.midi = midiout
+        self.name = name
+
+        if old is not midiout:
+            old.close_port()
+
+        log.info("Switched MIDI output to port '%s'.", name)
+
+    def reopen(self, port, api="UNSPECIFIED"):
+        """Open MIDI output ``port`` and :meth:`swap` to it.
+
+        Returns the name of the new port. If it can not be opened, the
+        exception is raised and the current output is kept.
+
+        """
+        midiout, name = open_midiout(port, api)
+        self.swap(midiout, name)
+        return name
+
     def _cleanup(self):
         self.midi.stop()
+
+        if self.midi.midi_clock_running:
+            self.midi.midiout.send_message(SONG_STOP)
+
         self.midi.midiout.close_port()
 
+    @property
+    def metrics(self):
+        return self.midi.metrics
+
+    @property
+    def aio(self):
+        try:
+            return self._aio
+        except AttributeError:
+            from .aiosequencer import AsyncSender
+            self._aio = AsyncSender(self)
+            return self._aio
+
+    @property
+    def state_cache(self):
+        return self.state is not None
+
+    @state_cache.setter
+    def state_cache(self, enable):
+        if not enable:
+            self.state = None
+        elif self.state is None:
+            self.state = StateCache()
+
+    def invalidate(self):
+        """Forget the cached device state, e.g. after reconnecting the device."""
+        if self.state:
+            self.state.invalidate()
+
+    def send_messages(self, messages, tick=None, force=False, quantize=None, tag=None):
+        """Send a sequence of (delta, message) pairs, e.g. a compiled scene command list.
+
+        The deltas are relative to ``tick`` (default: the current tick). If
+        ``quantize`` is given (``'beat'``, ``'bar'`` or a number of ticks),
+        ``tick`` is moved to the next position on this grid.
+
+        If the state cache is enabled, messages which would not change the
+        device state are dropped, unless ``force`` is true.
+
+        Ramp specs (see :mod:`~.ramps`) are started at their tick and their
+        values are generated by the sequencer.
+
+        Messages sent with a ``tag`` which have not been sent yet can be
+        dropped with :meth:`cancel`. This does not apply to the chunks of
+        system exclusive messages split into several chunks, so a transfer
+        is never cut off.
+
+        """
+        if self.state:
+            messages = self.state.filter(messages, force)
+
+        if quantize:
+            tick = self.midi.quantize(self.midi.tick if tick is None else tick, quantize)
+
+        chunks = None
+
+        if self.sysex_chunk_size or self.sysex_rate:
+            if tick is None:
+                tick = self.midi.tick
+
+            messages, chunks = self._pace_sysex(messages, tick)
+
+        end = None
+
+        if any(item[1].__class__ is tuple for item in messages):
+            if tick is None:
+                tick = self.midi.tick
+
+            messages = bind_ramps(messages, self.midi, tick, tag)
+            end = max(tick + delta + msg.spec[4] for delta, msg in messages
+                      if isinstance(msg, RampEvent))
+
+        if chunks and tag is not None:
+            # Add runs of tagged messages and untagged chunks in their order
+            last = None
+
+            for chunked, run in groupby(enumerate(messages), lambda item: item[0] in chunks):
+                run_tag = None if chunked else tag
+                run_last = self.midi.add_timed([pair for _, pair in run], tick=tick, tag=run_tag)
+                last = max(last or run_last, run_last)
+
+                if not chunked:
+                    end = max(end or run_last, run_last)
+
+            if end is not None:
+                self._tag_ends[tag] = max(end, self._tag_ends.get(tag, end))
+
+            return last
+
+        last = self.midi.add_timed(messages, tick=tick, tag=tag)
+
+        if tag is not None and last is not None:
+            self._tag_ends[tag] = max(last, end or last, self._tag_ends.get(tag, last))
+
+        return last
+
+    def cancel(self, tag):
+        """Drop the messages sent with ``tag``, which have not been sent yet.
+
+        Since the dropped messages may have been recorded by the state cache,
+        it is cleared, if messages with the tag may still have been pending.
+        Returns True in this case.
+
+        """
+        end = self._tag_ends.pop(tag, None)
+
+        if end is None or end < self.midi.tick:
+            return False
+
+        self.midi.cancel(tag)
+        self.invalidate()
+        return True
+
+    def _pace_sysex(self, messages, tick):
+        # Replace sysex messages with chunks, each scheduled after the
+        # previous chunks of all sysex messages have been transferred
+        size = self.sysex_chunk_size
+        rate = self.sysex_rate
+        end = self._sysex_end
+        paced = []
+        # indices of the chunks of messages split into more than one chunk
+        chunks = set()
+
+        for delta, msg in messages:
+            if msg[0] != 0xF0:
+                paced.append((delta, msg))
+                continue
+
+            start = max(tick + delta, end)
+
+            split = commands.chunk_sysex(msg, size)
+
+            if len(split) > 1:
+                chunks.update(range(len(paced), len(paced) + len(split)))
+
+            for chunk in split:
+                paced.append((start - tick, chunk))
+
+                if rate:
+                    start += self.midi.seconds_to_ticks(len(chunk) / rate)
+
+            end = start
+
+        self._sysex_end = end
+        return paced, chunks
+
+    def _send_many(self, messages, deltas=0):
+        return self.send_messages([(deltas, msg) for msg in messages])
+
+    def _send_channel(self, kind, data1, data2=None, ch=None, delay=0):
+        # Fast path for a single channel message: the message comes from the
+        # shared message table and is added to the sequencer directly. This
+        # reduces, but does not eliminate allocation: the queued (tick, seq,
+        # message) event still costs about two memory blocks per message.
+        msg = commands.MESSAGES.get(kind, data1, data2, ch=ch or self.channel)
+
+        if self.state is not None:
+            return self.send_messages(((delay, msg),))
+
+        return self.midi.add(msg, None, delay)
+
     def send_channel_message(self, status, data1=None, data2=None, ch=None, delay=0):
         """Send a MIDI channel mode message."""
-        msg = [(status & 0xf0) | ((ch if ch else self.channel) - 1 & 0xF)]
         if data1 is not None:
-            msg.append(data1 & 0x7F)
-            if data2 is not None:
-                msg.append(data2 & 0x7F)
-        self.midi.add(msg, delta=delay)
-
-    def send_system_common_message(self, status=0xF7, data1=None, data2=None):
-        msg = [status & 0xF7]
-        if msg[0] in (0xF1, 0xF2, 0xF3):
-            msg.append(data1 & 0x7F)
-        if msg[0] == 0xF2:
-            msg.append(data2 & 0x7F)
-        self.midi.add(msg, delta=delay)
-
-    def send_system_realtime_message(self, status=0xF8):
-        self.midi.add([status & 0xF7], delta=1)
-
-    def send_system_exclusive(self, value=""):
-        msg = parse_sysex_string(value)
-        if (msg and msg.startswith(b'\xF0') and msg.endswith(b'\xF7') and
-                all((val < 128 for val in msg[1:-1]))):
-            self.midi.add(msg, delta=delay)
-        else:
-            raise ValueError("Invalid sysex string: %s", msg)
+            return self._send_channel(status, data1, data2, ch, delay)
+
+        messages = commands.channel_message(status, ch=ch or self.channel)
+        return self._send_many(messages, deltas=delay)
+
+    def send_system_common_message(self, status=0xF7, data1=None, data2=None, delay=0):
+        """Send a MIDI system common message."""
+        return self._send_many(commands.system_common_message(status, data1, data2), deltas=delay)
+
+    def send_system_realtime_message(self, status=0xF8, delay=0):
+        """Send a MIDI system realtime message."""
+        return self._send_many(commands.system_realtime_message(status), deltas=delay)
+
+    def send_system_exclusive(self, value="", delay=0):
+        """Send MIDI system exclusive message(s) given as a string of hex digits or bytes.
+
+        Pre-parse sysex data sent repeatedly with
+        :func:`~midiscenemanager.commands.system_exclusive` and send it with
+        :meth:`send_messages` instead.
+
+        """
+        return self._send_many(commands.system_exclusive(value), deltas=delay)
 
     def send_note_off(self, note=60, velocity=0, ch=None, delay=0):
         """Send a 'Note Off' message."""
-        self.send_channel_message(NOTE_OFF, note, velocity, ch=ch, delay=delay)
+        return self._send_channel(NOTE_OFF, note, velocity, ch, delay)
 
     def send_note_on(self, note=60, velocity=127, ch=None, delay=0):
         """Send a 'Note On' message."""
-        self.send_channel_message(NOTE_ON, note, velocity, ch=ch, delay=delay)
+        return self._send_channel(NOTE_ON, note, velocity, ch, delay)
 
     def send_poly_pressure(self, note=60, value=0, ch=None, delay=0):
         """Send a 'Polyphonic Pressure' (Aftertouch) message."""
-        self.send_channel_message(POLY_PRESSURE, note, value, ch=ch, delay=delay)
+        return self._send_channel(POLY_PRESSURE, note, value, ch, delay)
 
     def send_control_change(self, cc=0, value=0, ch=None, delay=0):
         """Send a 'Control Change' message."""
-        self.send_channel_message(CONTROL_CHANGE, cc, value, ch=ch, delay=delay)
+        return self._send_channel(CONTROL_CHANGE, cc, value, ch, delay)
 
     def send_program_change(self, program=0, ch=None, delay=0):
         """Send a 'Program Change' message."""
-        self.send_channel_message(PROGRAM_CHANGE, program, ch=ch, delay=delay)
+        return self._send_channel(PROGRAM_CHANGE, program, None, ch, delay)
 
     def send_channel_pressure(self, value=0, ch=None, delay=0):
-        """Send a 'Polyphonic Pressure' (Aftertouch) message."""
-        self.send_channel_message(CHANNEL_PRESSURE, value, ch=ch, delay=delay)
+        """Send a 'Channel Pressure' (Aftertouch) message."""
+        return self._send_channel(CHANNEL_PRESSURE, value, None, ch, delay)
 
     def send_pitch_bend(self, value=8192, ch=None, delay=0):
-        """Send a 'Program Change' message."""
-        self.send_channel_message(PITCH_BEND, value & 0x7f, (value >> 7) & 0x7f, ch=ch,
-                                  delay=delay)
+        """Send a 'Pitch Bend' message."""
+        commands.check_value(value, 'value', 16383)
+        return self._send_channel(PITCH_BEND, value & 0x7F, value >> 7, ch, delay)
+
+    def _send_ramp(self, ramp, delay):
+        # Returns the tick the ramp ends at
+        return self._send_many(ramp, deltas=delay) + ramp[0][4]
+
+    def send_cc_ramp(self, cc=7, start=0, end=127, duration=480,
+                     interval=commands.RAMP_INTERVAL, ch=None, delay=0):
+        """Send a ramp of 'Control Change' values over ``duration`` ticks."""
+        return self._send_ramp(commands.cc_ramp(cc, start, end, duration, interval,
+                                                ch=ch or self.channel), delay)
+
+    def send_cc14_ramp(self, cc=7, start=0, end=16383, duration=480,
+                       interval=commands.RAMP_INTERVAL, ch=None, delay=0):
+        """Send a ramp of 14-bit 'Control Change' values over ``duration`` ticks."""
+        return self._send_ramp(commands.cc14_ramp(cc, start, end, duration, interval,
+                                                  ch=ch or self.channel), delay)
+
+    def send_pitch_bend_ramp(self, start=8192, end=8192, duration=480,
+                             interval=commands.RAMP_INTERVAL, ch=None, delay=0):
+        """Send a ramp of 'Pitch Bend' values over ``duration`` ticks."""
+        return self._send_ramp(commands.pitch_bend_ramp(start, end, duration, interval,
+                                                        ch=ch or self.channel), delay)
 
     def send_bank_select(self, bank=None, msb=None, lsb=None, ch=None, delay=0):
         """Send 'Bank Select' MSB and/or LSB 'Control Change' messages."""
-        if bank is not None:
-            msb = (bank << 7) & 0x7F
-            lsb = bank & 0x7F
-
-        if msb is not None:
-            self.send_control_change(BANK_SELECT_MSB, msb, ch=ch, delay=delay)
-
-        if lsb is not None:
-            self.send_control_change(BANK_SELECT_LSB, lsb, ch=ch, delay=delay)
+        return self._send_many(commands.bank_select(bank, msb, lsb, ch=ch or self.channel),
+                               deltas=delay)
 
     def send_modulation(self, value=0, ch=None, delay=0):
         """Send a 'Modulation' (CC #1) 'Control Change' message."""
-        self.send_control_change(MODULATION, value, ch=ch, delay=delay)
+        return self._send_channel(CONTROL_CHANGE, MODULATION_WHEEL, value, ch, delay)
 
     def send_breath_controller(self, value=0, ch=None, delay=0):
-        """Send a 'Breath Controller' (CC #3) 'Control Change' message."""
-        self.send_control_change(BREATH_CONTROLLER, value, ch=ch, delay=delay)
+        """Send a 'Breath Controller' (CC #2) 'Control Change' message."""
+        return self._send_channel(CONTROL_CHANGE, BREATH_CONTROLLER, value, ch, delay)
 
     def send_foot_controller(self, value=0, ch=None, delay=0):
         """Send a 'Foot Controller' (CC #4) 'Control Change' message."""
-        self.send_control_change(FOOT_CONTROLLER, value, ch=ch, delay=delay)
+        return self._send_channel(CONTROL_CHANGE, FOOT_CONTROLLER, value, ch, delay)
 
     def send_channel_volume(self, value=127, ch=None, delay=0):
         """Send a 'Volume' (CC #7) 'Control Change' message."""
-        self.send_control_change(CHANNEL_VOLUME, value, ch=ch, delay=delay)
+        return self._send_channel(CONTROL_CHANGE, CHANNEL_VOLUME, value, ch, delay)
 
     def send_balance(self, value=63, ch=None, delay=0):
         """Send a 'Balance' (CC #8) 'Control Change' message."""
-        self.send_control_change(BALANCE, value, ch=ch, delay=delay)
+        return self._send_channel(CONTROL_CHANGE, BALANCE, value, ch, delay)
 
     def send_pan(self, value=63, ch=None, delay=0):
         """Send a 'Pan' (CC #10) 'Control Change' message."""
-        self.send_control_change(PAN, value, ch=ch, delay=delay)
+        return self._send_channel(CONTROL_CHANGE, PAN, value, ch, delay)
 
     def send_expression(self, value=127, ch=None, delay=0):
         """Send a 'Expression' (CC #11) 'Control Change' message."""
-        self.send_control_change(EXPRESSION_CONTROLLER, value, ch=ch, delay=delay)
+        return self._send_channel(CONTROL_CHANGE, EXPRESSION_CONTROLLER, value, ch, delay)
 
     def send_all_sound_off(self, ch=None, delay=0):
         """Send a 'All Sound Off' (CC #120) 'Control Change' message."""
-        self.send_control_change(ALL_SOUND_OFF, 0, ch=ch, delay=delay)
+        return self._send_channel(CONTROL_CHANGE, ALL_SOUND_OFF, 0, ch, delay)
 
     def send_reset_all_controllers(self, ch=None, delay=0):
-        """Send a 'All Sound Off' (CC #121) 'Control Change' message."""
-        self.send_control_change(RESET_ALL_CONTROLLERS, 0, ch=ch, delay=delay)
+        """Send a 'Reset All Controllers' (CC #121) 'Control Change' message."""
+        return self._send_channel(CONTROL_CHANGE, RESET_ALL_CONTROLLERS, 0, ch, delay)
 
     def send_local_control(self, value=1, ch=None, delay=0):
         """Send a 'Local Control On/Off' (CC #122) 'Control Change' message."""
-        self.send_control_change(EXPRESSION_CONTROLLER, 0, ch=ch, delay=delay)
+        return self._send_channel(CONTROL_CHANGE, LOCAL_CONTROL, 127 if value else 0, ch, delay)
 
     def send_all_notes_off(self, ch=None, delay=0):
         """Send a 'All Notes Off' (CC #123) 'Control Change' message."""
-        self.send_control_change(ALL_NOTES_OFF, 0, ch=ch, delay=delay)
+        return self._send_channel(CONTROL_CHANGE, ALL_NOTES_OFF, 0, ch, delay)
 
     # add more convenience methods for other common MIDI events here...
 
 
-def get_midiout(port, api="UNSPECIFIED"):
-    api = getattr(rtmidi, 'API_' + api)
-    midiout, name = open_midioutput(port, api=api, interactive=False, use_virtual=False)
-    return MidiOutWrapper(midiout, name)
+def open_midiout(port, api="UNSPECIFIED"):
+    """Open MIDI output port and return an ``(rtmidi.MidiOut, port name)`` tuple.
+
+    The port is looked up in the cached port list of the
+    :class:`~.portregistry.PortRegistry` for ``api``.
+
+    """
+    return get_port_registry(api).open_output(port)
+
+
+def get_midiout(port, api="UNSPECIFIED", **kwargs):
+    """Open MIDI output port and return a :class:`MidiOutWrapper` for it.
+
+    Extra keyword arguments are passed to the wrapper.
+
+    """
+    midiout, name = open_midiout(port, api)
+    return MidiOutWrapper(midiout, name, **kwargs)
 
 
 def get_midiout_ports(api="UNSPECIFIED"):
-    mo = rtmidi.MidiOut(rtapi=getattr(rtmidi, 'API_' + api))
-    return sorted(mo.get_ports())
+    return sorted(get_port_registry(api).outputs())
+
+
+class MidiOutPool(object):
+    """MIDI outputs addressed by alias, which are opened once and kept open.
+
+    Each output is a :class:`MidiOutWrapper` with its own sequencer, so a
+    slow interface does not hold up sending to the others. With the option
+    ``engine='asyncio'``, the sequencers share one event loop thread.
+
+    """
+
+    def __init__(self, api="UNSPECIFIED", **options):
+        self.api = api
+        # passed to MidiOutWrapper
+        self.options = options
+        self._outputs = {}
+        self._ports = {}
+
+    def __len__(self):
+        return len(self._outputs)
+
+    def __contains__(self, alias):
+        return alias in self._outputs
+
+    def items(self):
+        """Return list of (alias, output) pairs of the open outputs."""
+        return list(self._outputs.items())
+
+    def get(self, alias, default=None):
+        """Return the output for given alias or ``default``, if it is not open."""
+        return self._outputs.get(alias, default)
+
+    def open(self, ports):
+        """Open outputs for a dict mapping aliases to port names or numbers.
+
+        Outputs already open for the same port are kept, outputs for aliases
+        not in ``ports`` are closed. Outputs of aliases mapped to another port
+        are handed over to the new port with :meth:`MidiOutWrapper.reopen`,
+        so their pending events are sent to it. Ports which can not be
+        opened are logged and skipped (an output stays on its old port).
+        Returns dict mapping the aliases of these to the exceptions raised.
+
+        """
+        errors = {}
+
+        for alias in set(self._outputs) - set(ports):
+            self._close(alias)
+
+        for alias, port in ports.items():
+            output = self._outputs.get(alias)
+
+            if output and self._ports[alias] == port:
+                continue
+
+            try:
+                if output:
+                    output.reopen(port, api=self.api)
+                else:
+                    self._outputs[alias] = get_midiout(port, api=self.api, **self.options)
+            except Exception as exc:
+                log.error("Could not open MIDI port '%s' for alias '%s': %s", port, alias, exc)
+                errors[alias] = exc
+            else:
+                self._ports[alias] = port
+                log.info("Opened MIDI out port '%s' as '%s'.", self._outputs[alias].name, alias)
+
+        return errors
+
+    def _close(self, alias):
+        self._outputs.pop(alias)._cleanup()
+        del self._ports[alias]
+
+    def close(self):
+        """Close all outputs."""
+        for alias in list(self._outputs):
+            self._close(alias)
+
+
+class MidiInputListener(object):
+    """Trigger scenes from incoming MIDI messages.
+
+    ``triggers`` maps trigger keys (see
+    :func:`~midiscenemanager.commands.trigger_key`) to scene names, as
+    returned in the ``'triggers'`` item by
+    :func:`~midiscenemanager.config.parse_config`. When a matching message is
+    received, ``callback`` is called with the scene name directly from the
+    rtmidi input thread.
+
+    If ``midiout`` is set to a :class:`MidiOutWrapper`, the time from
+    receiving the trigger to sending the first scene messages on it is
+    measured and logged and the last ``maxlen`` latencies (in nanoseconds)
+    are kept in ``latencies``.
+
+    """
+
+    def __init__(self, midiin, name, triggers, callback, midiout=None, maxlen=1000):
+        self.midiin = midiin
+        self.name = name
+        self.triggers = triggers
+        self.callback = callback
+        self.midiout = midiout
+        self.clock = time.perf_counter_ns
+        self.latencies = deque(maxlen=maxlen)
+        midiin.set_callback(self._on_message)
+
+    def _on_message(self, event, data=None):
+        received = self.clock()
+        scene = self.triggers.get(trigger_key(event[0]))
+
+        if scene is not None:
+            self.callback(scene)
+            midiout = self.midiout
+
+            if midiout:
+                # Runs in the sequencer thread after the messages queued by
+                # the callback for the current tick have been sent
+                midiout.midi.add_callback(partial(self._record_latency, scene, received))
+
+    def _record_latency(self, scene, received):
+        latency = self.clock() - received
+        self.latencies.append(latency)
+        log.info("Scene '%s' triggered by MIDI input, latency: %.3f ms", scene, latency / 1e6)
+
+    def latency_stats(self):
+        """Return dict with count, min, median and max of latencies in ms or None."""
+        latencies = sorted(self.latencies)
+
+        if not latencies:
+            return None
+
+        return {
+            'count': len(latencies),
+            'min': latencies[0] / 1e6,
+            'median': latencies[len(latencies) // 2] / 1e6,
+            'max': latencies[-1] / 1e6,
+        }
+
+    def close(self):
+        self.midiin.cancel_callback()
+        self.midiin.close_port()
+
+
+def get_midiin(port, triggers, callback, api="UNSPECIFIED", midiout=None):
+    midiin, name = get_port_registry(api).open_input(port)
+    return MidiInputListener(midiin, name, triggers, callback, midiout)
+
+
+def get_midiin_ports(api="UNSPECIFIED"):
+    return sorted(get_port_registry(api).inputs())
@@ -4,42 +4,56 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import time
+_import_start = time.perf_counter()  # noqa:E305
+
+import argparse
+import logging
+import os
 import sys
 import gettext
-import webbrowser
+import threading
 
+from collections import OrderedDict
 from os.path import join, dirname
 
-from kivy.config import Config
-
-Config.set('kivy', 'log_level', 'debug')  # noqa:E402
-#Config.set('kivy', 'log_level', 'info')
+# We parse our own command line options in main()
+os.environ.setdefault('KIVY_NO_ARGS', '1')
 
 from kivy.app import App
-from kivy.core.window import Window
-from kivy.garden import xpopup
+from kivy.clock import mainthread
+from kivy.core.window import Window  # noqa:F401
 from kivy.logger import Logger
-from kivy.modules import keybinding
 from kivy.properties import BoundedNumericProperty, ObjectProperty, StringProperty
 from kivy.uix.behaviors.togglebutton import ToggleButtonBehavior
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.label import Label
+from kivy.uix.recycleview import RecycleView
 from kivy.uix.screenmanager import Screen
 from kivy.uix.scrollview import ScrollView
 from kivy.uix.settings import SettingsWithNoMenu
-from kivy.uix.tabbedpanel import TabbedPanelItem
-from kivy.uix.togglebutton import ToggleButton
 from kivy.utils import platform
 from kivymd.card import MDCard
 from kivymd.tabs import MDTab
 from kivymd.theming import ThemeManager
 
-from .config import parse_config
-from .midiio import get_midiout
+from .config import ConfigError, parse_config
+from .engine import SceneEngine
+from .metrics import MetricsDumper
+from .midiio import MidiOutPool, MidiOutWrapper, get_midiin, open_midiout
+from .portregistry import get_port_registry
+from .profiling import StartupProfiler
+from .realtime import SCHED_POLICIES, parse_cpus
 from .settings import SettingDynamicOptions, settings_json
 
 from .version import __version__  # noqa:F401
 
+_import_time = time.perf_counter() - _import_start
+
+# Panels with more scenes than this show them in a RecycleView, which only
+# creates buttons for the visible scenes
+RECYCLE_THRESHOLD = 60
+
 
 def _(text):
     """This is just so we can use the default gettext format."""
@@ -60,6 +74,7 @@ class RefLabel(Label):
 
         :param str url: URL to be opened in the webbrowser
         """
+        import webbrowser
         Logger.info("Opening '{url}' in webbrowser.".format(url=url))
         webbrowser.open(url)
 
@@ -79,28 +94,84 @@ class MIDISceneButton(ToggleButtonBehavior, MDCard):
     text = StringProperty()
     subtitle = StringProperty()
 
-    def __init__(self, text='', subtitle='', scene=None, panel=None, group='scenes'):
-        super().__init__(text=text, group=group)
+    def __init__(self, text='', subtitle='', scene='', panel=None, group='scenes', **kwargs):
+        super().__init__(text=text, group=group, **kwargs)
         self.scene = scene
         self.panel = panel
 
+    def on_release(self):
+        App.get_running_app().on_scene_button(self)
+
 
 class TileGrid(GridLayout):
     pass
 
 
+class SceneRecycleView(RecycleView):
+    cols = BoundedNumericProperty(5, min=1)
+
+
 class ScenePanel(MDTab):
+    """Tab with a button for each scene of a panel.
+
+    The buttons are only created when the tab is shown for the first time.
+
+    """
     label_size = BoundedNumericProperty(20, min=8)
 
-    def __init__(self, name, panel):
+    def __init__(self, name, panel, scenes):
         super().__init__(id=name, name=name, text=panel.title or name)
-        #self.sv = ScrollView(size_hint=(1, None), size=(self.width, self.height))
-        self.sv = ScrollView(size=(self.width, self.height))
-        self.layout = TileGrid(cols=panel.cols or 5)
-        if panel.rows is not None:
-            self.layout.rows = panel.rows
-        self.sv.add_widget(self.layout)
-        self.add_widget(self.sv)
+        self.panel = panel
+        self.scenes = scenes
+        self.layout = None
+
+    def on_pre_enter(self, *args):
+        if self.layout is None:
+            self.populate()
+
+    def populate(self):
+        """Create the scene buttons."""
+        current = App.get_running_app().current_scene
+        items = []
+
+        for scenename in self.panel.scenes:
+            scene = self.scenes.get(scenename)
+            if scene:
+                items.append(dict(
+                    scene=scenename,
+                    group='scenes',
+                    text=scene.title or "Scene: %s" % scenename,
+                    panel=self,
+                    state='down' if scenename == current else 'normal'
+                ))
+
+        if len(items) > RECYCLE_THRESHOLD:
+            self.layout = SceneRecycleView(cols=self.panel.cols or 5)
+            self.layout.data = items
+            self.add_widget(self.layout)
+        else:
+            #self.sv = ScrollView(size_hint=(1, None), size=(self.width, self.height))
+            self.sv = ScrollView(size=(self.width, self.height))
+            self.layout = TileGrid(cols=self.panel.cols or 5)
+            if self.panel.rows is not None:
+                self.layout.rows = self.panel.rows
+            for item in items:
+                self.layout.add_widget(MIDISceneButton(**item))
+            self.sv.add_widget(self.layout)
+            self.add_widget(self.sv)
+
+        Logger.debug("MIDISceneManager: created {} scene buttons for panel '{}'.".format(
+                     len(items), self.name))
+
+    def set_current_scene(self, current):
+        """Update the state of the scene buttons to show the current scene."""
+        if isinstance(self.layout, SceneRecycleView):
+            for item in self.layout.data:
+                item['state'] = 'down' if item['scene'] == current else 'normal'
+            self.layout.refresh_from_data()
+        elif self.layout is not None:
+            for button in self.layout.children:
+                button.state = 'down' if button.scene == current else 'normal'
 
 
 class EnhancedSettings(SettingsWithNoMenu):
@@ -117,64 +188,109 @@ class MIDISceneManagerApp(App):
     language = StringProperty('en')
     translation = ObjectProperty(None, allownone=True)
 
-    def __init__(self, configfile, lang='en', *args, **kwargs):
-        """Class initialiser."""
-        self.midi = None
-        self.current_scene = None
-        self.parse_config(configfile)
+    def __init__(self, configfile, lang='en', *args, profiler=None, metrics=None,
+                 log_messages=False, midi_engine='thread', **kwargs):
+        """Class initialiser.
+
+        Pass a :class:`~.profiling.StartupProfiler` instance as ``profiler``
+        to record the durations of the startup phases and report them once
+        the first frame has been drawn.
+
+        If ``metrics`` is not None, the sequencers of the MIDI outputs collect
+        metrics, which are logged every ``metrics`` seconds (if > 0) and when
+        the app stops. With ``log_messages`` true, every sent MIDI message is
+        logged at debug level. ``midi_engine`` selects the sequencer engine
+        of the MIDI outputs (``'thread'`` or ``'asyncio'``).
+
+        """
+        self.profiler = profiler
+        self.metrics_interval = metrics
+        self.log_messages = log_messages
+        self.midi_engine = midi_engine
+        self._metrics_dumper = None
+        self.midiin = None
+        with self.profile('config parse'):
+            self.parse_config(configfile)
         self.register_event_type('on_scene_enter')
         self.register_event_type('on_scene_exit')
         self.language = lang
         self.switch_lang(self.language)
         super().__init__(*args, **kwargs)
 
+    def profile(self, phase):
+        """Return context manager recording the duration of a startup phase."""
+        if self.profiler:
+            return self.profiler.phase(phase)
+        return _NoProfile()
+
     def parse_config(self, configfile):
         self.configfile = configfile
-        for key, value in parse_config(configfile).items():
-            setattr(self, key, value)
+        self.engine = SceneEngine(parse_config(configfile))
+        self.engine.add_listener(self._on_engine_event)
+        self.scenes = self.engine.scenes
+        self.default_panel = self.engine.default_panel
+        # maps panel names to ScenePanel widgets once the UI is built
+        self.panels = OrderedDict(self.engine.panels)
+
+    @property
+    def midi(self):
+        return self.engine.midi
+
+    @midi.setter
+    def midi(self, midi):
+        self.engine.midi = midi
+
+    @property
+    def current_scene(self):
+        return self.engine.current_scene
+
+    def load_kv(self, filename=None):
+        with self.profile('kv load'):
+            return super().load_kv(filename)
 
     def build(self):
-        self.settings_cls = EnhancedSettings
-        self.use_kivy_settings = False
-        root = MIDISceneManagerScreen()
-
-        for panelname, panel in self.panels.items():
-            scene_panel = ScenePanel(panelname, panel)
-            scene_panel.label_size = self.config.getint('appearance', 'font_size')
-
-            for scenename in panel.scenes:
-                scene = self.scenes.get(scenename)
-                if scene:
-                    button = MIDISceneButton(
-                        scene=scenename,
-                        group='scenes',
-                        text=scene.title or "Scene: %s" % scenename,
-                        panel=scene_panel
-                    )
-                    button.bind(on_release=self.on_scene_button)
-                    scene_panel.layout.add_widget(button)
-
-            root.ids.tp.add_widget(scene_panel)
-            Logger.debug("MIDISceneManager: added scene panel '{}'.".format(panelname))
-            self.panels[panelname] = scene_panel
-
-        self.settings_panel = MDTab(id='panel_settings', name='settings', text='Settings')
-        self.settings_panel.bind(on_tab_release=lambda *args: self.open_settings())
-        root.ids.tp.add_widget(self.settings_panel)
-
-        if self.default_panel and self.default_panel in self.panels:
-            root.ids.tp.default_tab = self.panels[self.default_panel]
+        with self.profile('build'):
+            self.settings_cls = EnhancedSettings
+            self.use_kivy_settings = False
+            root = MIDISceneManagerScreen()
+
+            for panelname, panel in self.panels.items():
+                scene_panel = ScenePanel(panelname, panel, self.scenes)
+                scene_panel.label_size = self.config.getint('appearance', 'font_size')
+                root.ids.tp.add_widget(scene_panel)
+                Logger.debug("MIDISceneManager: added scene panel '{}'.".format(panelname))
+                self.panels[panelname] = scene_panel
+
+            self.settings_panel = MDTab(id='panel_settings', name='settings', text='Settings')
+            self.settings_panel.bind(on_tab_release=lambda *args: self.open_settings())
+            root.ids.tp.add_widget(self.settings_panel)
+
+            if self.default_panel and self.default_panel in self.panels:
+                root.ids.tp.default_tab = self.panels[self.default_panel]
 
         midiport = self.config.get('midi', 'port')
         if midiport:
-            self.set_midiout(midiport)
+            with self.profile('MIDI port open'):
+                self.set_midiout(midiport, background=False)
+
+        if self.engine.port_aliases:
+            with self.profile('MIDI port pool open'):
+                self.engine.ports = MidiOutPool(**self.midiout_options())
+                self.engine.ports.open(self.engine.port_aliases)
+
+        midiport = self.config.get('midi', 'input_port')
+        if midiport:
+            self.set_midiin(midiport)
 
         return root
 
     def build_config(self, config):
         """Set the default values for the configs sections."""
         config.setdefaults('appearance', {'font_size': 20})
-        config.setdefaults('midi', {'port': ""})
+        config.setdefaults('midi', {'port': "", 'input_port': "", 'sysex_chunk_size': 0,
+                                    'sysex_rate': 0, 'state_cache': 0, 'bpm': 120,
+                                    'midi_clock': 0, 'sched_policy': 'none',
+                                    'sched_priority': 50, 'cpus': "", 'lock_memory': 0})
 
     def build_settings(self, settings):
         """Add our custom section to the default configuration object."""
@@ -191,6 +307,32 @@ class MIDISceneManagerApp(App):
         """Respond to changes in the configuration."""
         if (section, key) == ('midi', 'port'):
             self.set_midiout(value)
+        elif (section, key) == ('midi', 'input_port'):
+            self.set_midiin(value)
+        elif section == 'midi' and key in ('sysex_chunk_size', 'sysex_rate', 'state_cache'):
+            options = self.midiout_options()
+            outputs = [self.midi] if self.midi else []
+
+            if self.engine.ports:
+                self.engine.ports.options.update(options)
+                outputs.extend(self.engine.ports.get(alias) for alias in self.engine.port_aliases)
+
+            for output in filter(None, outputs):
+                setattr(output, key, options[key])
+        elif (section, key) == ('midi', 'bpm'):
+            bpm = self.midiout_options()['bpm']
+
+            if self.engine.ports:
+                self.engine.ports.options['bpm'] = bpm
+
+            for name, output in self.engine.outputs():
+                output.midi.bpm = bpm
+        elif (section, key) == ('midi', 'midi_clock'):
+            if self.midi:
+                if self.config.getboolean('midi', 'midi_clock'):
+                    self.midi.midi.start_midi_clock()
+                else:
+                    self.midi.midi.stop_midi_clock()
         elif (section, key) == ('appearance', 'font_size'):
             for panel in self.panels.values():
                 try:
@@ -210,6 +352,40 @@ class MIDISceneManagerApp(App):
         self._keyboard = self.root_window.request_keyboard(self._keyboard_closed, self.root)
         self._keyboard.bind(on_key_down=self.on_key_down)
 
+        if self.profiler:
+            self.root_window.bind(on_flip=self._report_startup)
+
+        if self.metrics_interval is not None:
+            self._metrics_dumper = MetricsDumper(
+                lambda: [(name, output.metrics) for name, output in self.engine.outputs()],
+                self.metrics_interval, Logger)
+
+            if self.metrics_interval > 0:
+                self._metrics_dumper.start()
+
+        # keep the port lists for the settings up to date and open the
+        # configured ports when they are plugged in
+        registry = get_port_registry()
+        registry.add_listener(mainthread(self._on_ports_changed))
+        registry.start()
+
+    def _on_ports_changed(self, outputs, inputs):
+        port = self.config.get('midi', 'port')
+
+        if port and not self.midi:
+            self.set_midiout(port)
+
+        port = self.config.get('midi', 'input_port')
+
+        if port and not self.midiin:
+            self.set_midiin(port)
+
+    def _report_startup(self, window):
+        window.unbind(on_flip=self._report_startup)
+        Logger.info("MIDISceneManager: startup profile:")
+        for line in self.profiler.report("first frame"):
+            Logger.info("MIDISceneManager:   " + line)
+
     def on_stop(self):
         pass
 
@@ -243,41 +419,30 @@ class MIDISceneManagerApp(App):
                     self.root_window.minimum_height, self.root_window.minimum_width)
 
     def on_scene_button(self, btn):
-        if self.current_scene != btn.scene:
-            if self.current_scene:
-                self.dispatch('on_scene_exit', self.current_scene)
-            self.dispatch('on_scene_enter', btn.scene)
-        elif self.current_scene:
-            self.dispatch('on_scene_exit', self.current_scene)
-            self.current_scene = None
+        self.engine.toggle(btn.scene)
+        self.update_scene_buttons()
+
+    def on_midi_trigger(self, scene):
+        # Called from the MIDI input thread
+        self.engine.enter(scene)
+        self.update_scene_buttons()
+
+    @mainthread
+    def update_scene_buttons(self):
+        for panel in self.panels.values():
+            if isinstance(panel, ScenePanel):
+                panel.set_current_scene(self.current_scene)
+
+    @mainthread
+    def _on_engine_event(self, event, scene):
+        # May be called from the MIDI input thread
+        self.dispatch('on_scene_' + event, scene)
 
     def on_scene_enter(self, scene):
-        Logger.debug("MIDISceneManager: entering scene '{}'.".format(scene))
-        self.current_scene = scene
-        if self.midi:
-            for i, (cmd, args) in enumerate(self.scenes[scene].on_enter):
-                try:
-                    method = getattr(self.midi, 'send_' + cmd, None)
-                    if method:
-                        args.setdefault('delay', i)
-                        method(**args)
-                except Exception as exc:
-                    Logger.error("Error in 'on_enter' command #{} of scene '{}': {}".format(
-                                 i, scene, exc))
         Logger.debug("MIDISceneManager: current scene now: {}".format(scene))
 
     def on_scene_exit(self, scene):
-        Logger.debug("MIDISceneManager: exiting scene '{}'".format(scene))
-        if self.midi:
-            for i, (cmd, args) in enumerate(self.scenes[scene].on_exit):
-                try:
-                    method = getattr(self.midi, 'send_' + cmd, None)
-                    if method:
-                        args.setdefault('delay', i)
-                        method(**args)
-                except Exception as exc:
-                    Logger.error("Error in 'on_exit' command #{} of scene '{}': {}".format(
-                                 i, scene, exc))
+        Logger.debug("MIDISceneManager: exited scene '{}'".format(scene))
 
     def on_language(self, instance, language):
         self.switch_lang(language)
@@ -293,37 +458,167 @@ class MIDISceneManagerApp(App):
         else:
             self.translation = locales.ugettext
 
-    def set_midiout(self, name):
-        if not self.midi or self.midi.name != name:
+    def midiout_options(self):
+        """Return dict of keyword arguments for MidiOutWrapper from the settings."""
+        options = {}
+
+        for key in ('sysex_chunk_size', 'sysex_rate'):
+            try:
+                options[key] = max(0, self.config.getint('midi', key))
+            except (TypeError, ValueError):
+                Logger.warning("MIDISceneManager: Invalid value for '{}'.".format(key))
+                options[key] = 0
+
+        try:
+            options['bpm'] = float(self.config.get('midi', 'bpm'))
+        except (TypeError, ValueError):
+            options['bpm'] = 0
+
+        if options['bpm'] <= 0:
+            Logger.warning("MIDISceneManager: Invalid value for 'bpm'.")
+            options['bpm'] = 120.0
+
+        options['state_cache'] = self.config.getboolean('midi', 'state_cache')
+
+        policy = self.config.get('midi', 'sched_policy')
+        options['sched_policy'] = policy if policy in SCHED_POLICIES else None
+
+        try:
+            options['sched_priority'] = self.config.getint('midi', 'sched_priority')
+        except (TypeError, ValueError):
+            Logger.warning("MIDISceneManager: Invalid value for 'sched_priority'.")
+            options['sched_priority'] = None
+
+        try:
+            options['cpus'] = parse_cpus(self.config.get('midi', 'cpus'))
+        except ValueError:
+            Logger.warning("MIDISceneManager: Invalid value for 'cpus'.")
+            options['cpus'] = None
+
+        options['lock_memory'] = self.config.getboolean('midi', 'lock_memory')
+        options['metrics'] = self.metrics_interval is not None
+        options['log_messages'] = self.log_messages
+        options['engine'] = self.midi_engine
+        return options
+
+    def set_midiout(self, name, background=True):
+        """Open MIDI output port ``name`` and make it the default output.
+
+        The port is opened in a background thread, unless ``background`` is
+        false, so a slow driver does not block the UI. An already open
+        output is then handed over to the new port (see
+        :meth:`~.midiio.MidiOutWrapper.swap`), which keeps its sequencer
+        thread and the events scheduled on it.
+
+        """
+        if self.midi and self.midi.name == name:
+            return
+
+        if background:
+            threading.Thread(target=self._open_midiout, args=(name, True),
+                             name='MidiOutOpener', daemon=True).start()
+        else:
+            self._open_midiout(name)
+
+    def _open_midiout(self, name, background=False):
+        try:
+            midiout, portname = open_midiout(name)
+        except Exception as exc:
+            msg = "Could not open MIDI port: {}".format(exc)
+            (mainthread(self._show_error) if background else self._show_error)(msg)
+        else:
+            (mainthread(self._hand_over) if background else self._hand_over)(midiout, portname)
+
+    def _show_error(self, msg):
+        if self.root:
+            from kivy.garden import xpopup
+            xpopup.notification.XError(text=msg)
+        else:
+            Logger.error("MIDISceneManager: " + msg)
+
+    def _hand_over(self, midiout, name):
+        if self.midi:
+            self.midi.swap(midiout, name)
+            return
+
+        self.midi = MidiOutWrapper(midiout, name, **self.midiout_options())
+        Logger.info("MIDISceneManager: Opened MIDI out port '{}'.".format(self.midi.name))
+
+        if self.config.getboolean('midi', 'midi_clock'):
+            self.midi.midi.start_midi_clock()
+
+        if self.midiin:
+            self.midiin.midiout = self.midi
+
+    def set_midiin(self, name):
+        if self.midiin:
+            if self.midiin.name == name:
+                return
+
+            self.midiin.close()
+            self.midiin = None
+
+        if name:
             try:
-                self.midi = get_midiout(name)
+                self.midiin = get_midiin(name, self.engine.triggers, self.on_midi_trigger,
+                                         midiout=self.midi)
             except Exception as exc:
-                msg = "Could not open MIDI port: {}".format(exc)
-                if self.root:
-                    xpopup.notification.XError(text=msg)
-                else:
-                    Logger.error("MIDISceneManager: " + msg)
+                Logger.error("MIDISceneManager: Could not open MIDI input port: {}".format(exc))
             else:
-                Logger.info("MIDISceneManager: Opened MIDI out port '{}'.".format(self.midi.name))
+                Logger.info("MIDISceneManager: Opened MIDI in port '{}'.".format(
+                            self.midiin.name))
 
     def cleanup(self):
-        if self.midi:
-            self.midi._cleanup()
+        get_port_registry().stop()
+
+        if self._metrics_dumper:
+            self._metrics_dumper.stop()
+            self._metrics_dumper.dump()
+
+        if self.midiin:
+            self.midiin.close()
+
+        self.engine.close()
+
+
+class _NoProfile(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
 
 
 def main(args=None):
     """Main program entry point."""
-    if args is None:
-        args = sys.argv[1:]
+    ap = argparse.ArgumentParser(prog='midiscenemanager', description=__doc__)
+    ap.add_argument('-d', '--debug', action='store_true', help="Enable debug logging")
+    ap.add_argument('--profile-startup', action='store_true',
+                    help="Log durations of startup phases once the first frame is drawn")
+    ap.add_argument('-m', '--metrics', type=float, metavar='SECONDS',
+                    help="Collect sequencer metrics and log them every SECONDS (0: on exit)")
+    ap.add_argument('--log-messages', action='store_true',
+                    help="Log every sent MIDI message (with --debug)")
+    ap.add_argument('-e', '--engine', choices=('thread', 'asyncio'), default='thread',
+                    help="Sequencer engine: a thread per output or one shared asyncio loop "
+                         "(default: %(default)s)")
+    ap.add_argument('config', nargs='?', default=join(dirname(__file__), 'default.cfg'),
+                    help="Scene configuration file (default: built-in example)")
+    args = ap.parse_args(sys.argv[1:] if args is None else args)
+
+    if args.debug:
+        Logger.setLevel(logging.DEBUG)
+
+    profiler = None
+    if args.profile_startup:
+        profiler = StartupProfiler(_import_start)
+        profiler.add('imports', _import_time)
 
-    if args and len(args) > 1:
-        return "Usage: midiscenemanager.py <config>"
-    elif args:
-        config = args[0]
-    else:
-        config = join(dirname(__file__), 'default.cfg')
-
-    app = MIDISceneManagerApp(config)
+    try:
+        app = MIDISceneManagerApp(args.config, profiler=profiler, metrics=args.metrics,
+                                  log_messages=args.log_messages, midi_engine=args.engine)
+    except ConfigError as exc:
+        return "Error in configuration file '{}': {}".format(args.config, exc)
 
     try:
         app.run()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# portregistry.py
+#
+"""Cached enumeration of MIDI ports, refreshed in the background.
+
+Enumerating ports with a new rtmidi client each time is slow on ALSA with
+many clients. :class:`PortRegistry` keeps one client per direction for
+enumeration and caches the port lists, so the settings and opening ports
+can read them without delay. A background thread refreshes the lists
+periodically and notifies listeners when ports appear or disappear.
+
+rtmidi does not pass on ALSA sequencer announce events, so hot-plugging is
+detected by polling the (cheap) port enumeration of the existing clients.
+
+"""
+
+import logging
+import threading
+
+import rtmidi
+
+__all__ = ('PortRegistry', 'get_port_registry')
+
+log = logging.getLogger(__name__)
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+class PortRegistry(object):
+    """Cached lists of the MIDI input and output ports of an rtmidi API.
+
+    :meth:`outputs` and :meth:`inputs` return the cached lists (enumerating
+    the ports on first use). :meth:`refresh` enumerates the ports again.
+    After :meth:`start`, a daemon thread calls it every ``interval``
+    seconds. Callables added with :meth:`add_listener` are then called in
+    this thread with ``(outputs, inputs)`` when the lists have changed.
+
+    """
+
+    def __init__(self, api="UNSPECIFIED", interval=2.0):
+        self.api = api
+        self.interval = interval
+        self._rtapi = getattr(rtmidi, 'API_' + api)
+        self._lock = threading.Lock()
+        self._clients = None
+        self._ports = None
+        self._listeners = []
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def add_listener(self, func):
+        self._listeners.append(func)
+
+    def remove_listener(self, func):
+        self._listeners.remove(func)
+
+    def _enumerate(self):
+        # Must be called with the lock held
+        if self._clients is None:
+            self._clients = (rtmidi.MidiOut(rtapi=self._rtapi), rtmidi.MidiIn(rtapi=self._rtapi))
+
+        return tuple(client.get_ports() for client in self._clients)
+
+    def refresh(self):
+        """Enumerate the ports again. Returns True if the port lists have changed."""
+        with self._lock:
+            ports = self._enumerate()
+            changed = ports != self._ports
+            self._ports = ports
+
+        if changed:
+            log.debug("MIDI ports changed: outputs %r, inputs %r", *ports)
+
+            for func in self._listeners:
+                func(*ports)
+
+        return changed
+
+    def _get(self, index):
+        ports = self._ports
+
+        if ports is None:
+            self.refresh()
+            ports = self._ports
+
+        return ports[index]
+
+    def outputs(self):
+        """Return list of the names of the MIDI output ports in the order of their numbers."""
+        return list(self._get(0))
+
+    def inputs(self):
+        """Return list of the names of the MIDI input ports in the order of their numbers."""
+        return list(self._get(1))
+
+    def _find(self, ports, port):
+        # Like rtmidi.midiutil.open_midiport: port number or (part of the) name
+        if isinstance(port, int):
+            return port if 0 <= port < len(ports) else None
+
+        for number, name in enumerate(ports):
+            if name == port:
+                return number
+
+        for number, name in enumerate(ports):
+            if port in name:
+                return number
+
+        return None
+
+    def _open(self, index, client_class, port):
+        if isinstance(port, str) and port.isdigit():
+            port = int(port)
+
+        for attempt in range(2):
+            ports = self._get(index)
+            number = self._find(ports, port)
+
+            if number is not None:
+                client = client_class(rtapi=self._rtapi)
+
+                # the cached list may be stale, if ports were (un)plugged
+                if client.get_port_name(number) == ports[number]:
+                    client.open_port(number)
+                    return client, ports[number]
+
+                client.delete()
+
+            if attempt == 0:
+                self.refresh()
+
+        raise rtmidi.InvalidPortError("MIDI port '%s' not found." % port)
+
+    def open_output(self, port):
+        """Open MIDI output port given by number or (part of its) name.
+
+        Returns an ``(rtmidi.MidiOut, port name)`` tuple. The port is looked
+        up in the cached list, which is refreshed if the port is not found.
+        Raises ``rtmidi.InvalidPortError``, if there is no such port.
+
+        """
+        return self._open(0, rtmidi.MidiOut, port)
+
+    def open_input(self, port):
+        """Open MIDI input port like :meth:`open_output`, returns ``(rtmidi.MidiIn, name)``."""
+        return self._open(1, rtmidi.MidiIn, port)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as exc:
+                log.warning("Could not enumerate MIDI ports: %s", exc)
+
+    def start(self):
+        """Start refreshing the port lists in a background thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='PortRegistry', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread."""
+        self._stopped.set()
+
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+
+
+def get_port_registry(api="UNSPECIFIED"):
+    """Return the shared :class:`PortRegistry` for the given rtmidi API."""
+    with _registries_lock:
+        try:
+            return _registries[api]
+        except KeyError:
+            registry = _registries[api] = PortRegistry(api)
+            return registry
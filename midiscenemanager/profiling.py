@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# profiling.py
+#
+"""Simple wall clock profiler for the phases of application startup."""
+
+import time
+
+from contextlib import contextmanager
+
+__all__ = ('StartupProfiler',)
+
+
+class StartupProfiler(object):
+    """Records the duration of named startup phases.
+
+    ``start`` is the ``time.perf_counter()`` value at which startup began,
+    e.g. taken before the first heavy imports of the main module.
+
+    """
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.phases = []
+
+    def add(self, name, duration):
+        """Record a phase, which took ``duration`` seconds."""
+        self.phases.append((name, duration))
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager recording the time spent in its block as a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def elapsed(self):
+        """Return seconds elapsed since start."""
+        return time.perf_counter() - self.start
+
+    def report(self, total_name="total"):
+        """Return list of report lines with phase durations in milliseconds."""
+        lines = ["%-20s %8.1f ms" % (name, duration * 1000) for name, duration in self.phases]
+        lines.append("%-20s %8.1f ms" % (total_name, self.elapsed() * 1000))
+        return lines
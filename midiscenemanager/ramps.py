@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# ramps.py
+#
+"""Controller and pitch bend ramps, whose values are generated by the sequencer.
+
+The ramp commands of scene definitions (see :func:`~.commands.cc_ramp`,
+:func:`~.commands.cc14_ramp` and :func:`~.commands.pitch_bend_ramp`) compile
+to a ramp spec in place of a message. This is a plain tuple ``(status,
+controllers, start, end, duration, interval)``, so it can be cached with the
+configuration like messages, which are ``bytes``. ``controllers`` is
+``(cc,)`` for a 7-bit and ``(msb_cc, lsb_cc)`` for a 14-bit controller and
+empty for pitch bend.
+
+When a spec is sent with
+:meth:`~.midiio.MidiOutWrapper.send_messages`, it is replaced by a
+:class:`RampEvent`, which the sequencer calls like any callback. The event
+sends the value for its tick and schedules its next call for the first
+step, at which the value differs, so the sequencer holds one pending event
+per running ramp instead of all its messages and unchanged values are not
+sent at all.
+
+"""
+
+from math import ceil, floor
+
+from .commands import MESSAGES
+
+__all__ = ('RampEvent', 'bind_ramps', 'is_ramp')
+
+
+def is_ramp(message):
+    """Return True if ``message`` is a ramp spec and not a MIDI message."""
+    return message.__class__ is tuple
+
+
+class RampEvent(object):
+    """Callable sequencer event generating the values of a ramp spec.
+
+    ``tick`` is the tick the ramp starts at. Values are computed for steps
+    every ``interval`` ticks, the last one at ``tick + duration`` is always
+    the end value. If the ramp is added with a ``tag``, cancelling the tag
+    stops it.
+
+    """
+
+    __slots__ = ('sequencer', 'spec', 'tick', 'tag', 'seq', 'step', 'steps', 'sent')
+
+    def __init__(self, sequencer, spec, tick, tag=None):
+        self.sequencer = sequencer
+        self.spec = spec
+        self.tick = tick
+        self.tag = tag
+        # sequence number for the next calls, see Sequencer._schedule()
+        self.seq = next(sequencer._counter)
+        self.step = 0
+        duration, interval = spec[4:6]
+        self.steps = -(-duration // interval)
+        # last sent (14-bit) value
+        self.sent = None
+
+    def __repr__(self):
+        return "<RampEvent %r @ %s, step %i/%i>" % (self.spec, self.tick, self.step, self.steps)
+
+    def value(self, step):
+        """Return the ramp value at ``step``."""
+        start, end, duration, interval = self.spec[2:6]
+
+        if step >= self.steps:
+            return end
+
+        return start + floor((end - start) * step * interval / duration + 0.5)
+
+    def next_step(self, step, value):
+        """Return the first step after ``step``, at which the value differs from ``value``.
+
+        Returns ``steps + 1``, if the value does not change anymore. The step
+        is computed by inverting the interpolation in :meth:`value`, so the
+        sequencer thread does not have to evaluate every unchanged step of a
+        long or flat ramp.
+
+        """
+        start, end, duration, interval = self.spec[2:6]
+        steps = self.steps
+
+        if value == end:
+            return steps + 1
+
+        # first step, at which the (rounded) value reaches the next one
+        target = (abs(value - start) + 0.5) * duration / (abs(end - start) * interval)
+        next_step = max(step + 1, min(steps, ceil(target)))
+
+        # correct float rounding at the boundary
+        while next_step > step + 1 and self.value(next_step - 1) != value:
+            next_step -= 1
+
+        while next_step <= steps and self.value(next_step) == value:
+            next_step += 1
+
+        return next_step
+
+    def __call__(self):
+        step = self.step
+        value = self.value(step)
+        self._send(value)
+
+        # Thinning: skip steps, whose value does not differ from this one
+        step = self.next_step(step, value)
+
+        if step <= self.steps:
+            self.step = step
+            tick = self.tick + min(step * self.spec[5], self.spec[4])
+            self.sequencer._schedule(self, tick, self.seq, self.tag)
+
+    def _send(self, value):
+        status, controllers = self.spec[:2]
+        kind = status & 0xF0
+        ch = (status & 0x0F) + 1
+        handle_event = self.sequencer.handle_event
+
+        if not controllers:
+            handle_event(MESSAGES.get(kind, value & 0x7F, value >> 7, ch=ch))
+        elif len(controllers) == 1:
+            handle_event(MESSAGES.get(kind, controllers[0], value, ch=ch))
+        else:
+            # MSB only when it changes, since it may reset the LSB
+            if self.sent is None or self.sent >> 7 != value >> 7:
+                handle_event(MESSAGES.get(kind, controllers[0], value >> 7, ch=ch))
+
+            handle_event(MESSAGES.get(kind, controllers[1], value & 0x7F, ch=ch))
+
+        self.sent = value
+
+
+def bind_ramps(messages, sequencer, tick, tag=None):
+    """Replace the ramp specs in (delta, message) pairs with :class:`RampEvent` instances.
+
+    The ramps start at ``tick`` plus their delta and are run by ``sequencer``
+    with the given ``tag``.
+
+    """
+    return [(delta, RampEvent(sequencer, msg, tick + delta, tag)
+             if msg.__class__ is tuple else msg)
+            for delta, msg in messages]
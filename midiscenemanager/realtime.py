@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# realtime.py
+#
+"""Real-time scheduling, CPU affinity and memory locking for sequencer threads.
+
+These are only available on some platforms (mainly Linux) and usually need
+privileges (e.g. ``CAP_SYS_NICE`` or an ``rtprio`` entry in
+``/etc/security/limits.conf`` for real-time priority and ``memlock`` for
+locking memory). If a setting cannot be applied, a warning is logged and
+the thread runs with the settings it has.
+
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+
+__all__ = ('SCHED_POLICIES', 'apply_realtime', 'parse_cpus')
+
+log = logging.getLogger(__name__)
+
+# Scheduling policy names accepted by apply_realtime
+SCHED_POLICIES = ('other', 'fifo', 'rr')
+DEFAULT_PRIORITY = 50
+# Flags of mlockall(2)
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+def parse_cpus(s):
+    """Parse a CPU list like ``'0,2-3'`` into a set of CPU numbers.
+
+    Returns None for an empty string. Raises ValueError for invalid lists.
+
+    """
+    cpus = set()
+
+    for part in s.replace(' ', '').split(','):
+        if not part:
+            continue
+
+        first, sep, last = part.partition('-')
+
+        if sep:
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(first))
+
+    if any(cpu < 0 for cpu in cpus):
+        raise ValueError("Invalid CPU list: %s" % s)
+
+    return cpus or None
+
+
+def _set_policy(policy, priority):
+    # Returns (policy name, priority) in effect afterwards
+    if not hasattr(os, 'sched_setscheduler'):
+        log.warning("Real-time scheduling is not supported on this platform.")
+        return 'other', 0
+
+    sched = getattr(os, 'SCHED_' + policy.upper())
+    low = os.sched_get_priority_min(sched)
+    high = os.sched_get_priority_max(sched)
+    priority = max(low, min(high, DEFAULT_PRIORITY if priority is None else priority))
+
+    try:
+        # pid 0 is the calling thread on Linux
+        os.sched_setscheduler(0, sched, os.sched_param(priority))
+    except OSError as exc:
+        log.warning("Could not set scheduling policy '%s' with priority %i: %s",
+                    policy, priority, exc)
+
+    current = os.sched_getscheduler(0)
+    names = {getattr(os, 'SCHED_' + name.upper()): name for name in SCHED_POLICIES}
+    return names.get(current, str(current)), os.sched_getparam(0).sched_priority
+
+
+def _set_affinity(cpus):
+    if not hasattr(os, 'sched_setaffinity'):
+        log.warning("Setting the CPU affinity is not supported on this platform.")
+        return None
+
+    try:
+        os.sched_setaffinity(0, cpus)
+    except (OSError, ValueError) as exc:
+        log.warning("Could not pin thread to CPUs %s: %s", sorted(cpus), exc)
+
+    return os.sched_getaffinity(0)
+
+
+def _lock_memory():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        mlockall = libc.mlockall
+    except (OSError, AttributeError, TypeError):
+        log.warning("Locking memory is not supported on this platform.")
+        return False
+
+    if mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        log.warning("Could not lock memory: %s", os.strerror(ctypes.get_errno()))
+        return False
+
+    return True
+
+
+def apply_realtime(policy=None, priority=None, cpus=None, lock_memory=False, name='thread'):
+    """Apply scheduling settings to the calling thread.
+
+    ``policy`` is one of :data:`SCHED_POLICIES` or None (leave unchanged),
+    ``priority`` the real-time priority for the ``'fifo'`` and ``'rr'``
+    policies (clamped to the allowed range, default 50), ``cpus`` an
+    iterable of CPU numbers to pin the thread to and ``lock_memory`` whether
+    to lock all current and future memory pages of the process into RAM.
+
+    Settings which cannot be applied are skipped with a warning. Returns a
+    dict with the effective settings (``policy``, ``priority``, ``cpus``,
+    ``memory_locked``), which is also logged, using ``name`` for the thread.
+
+    """
+    if policy is not None and policy not in SCHED_POLICIES:
+        raise ValueError("Unknown scheduling policy '%s'." % policy)
+
+    effective = dict(policy=None, priority=None, cpus=None, memory_locked=False)
+
+    if policy is not None:
+        effective['policy'], effective['priority'] = _set_policy(policy, priority)
+
+    if cpus:
+        effective['cpus'] = _set_affinity(set(cpus))
+
+    if lock_memory:
+        effective['memory_locked'] = _lock_memory()
+
+    log.info("Scheduling of %s: policy %s, priority %s, CPUs %s, memory locked: %s", name,
+             effective['policy'] or 'unchanged', effective['priority'],
+             ','.join(str(cpu) for cpu in sorted(effective['cpus'])) if effective['cpus']
+             else 'all', 'yes' if effective['memory_locked'] else 'no')
+    return effective
@@ -9,10 +9,25 @@ import logging
 import threading
 import time
 
-from collections import deque
-from heapq import heappush, heappop
+from collections import deque, namedtuple
+from itertools import count
+from math import ceil
 
-from kivy.logger import Logger
+from .eventqueue import EventHeap
+from .realtime import apply_realtime
+
+log = logging.getLogger(__name__)
+
+# MIDI clock messages
+TIMING_CLOCK = b'\xF8'
+SONG_START = b'\xFA'
+SONG_CONTINUE = b'\xFB'
+SONG_STOP = b'\xFC'
+SONG_POSITION_POINTER = 0xF2
+
+# While the MIDI clock runs, large batches of due events are sent in slices
+# of this many events with due clock pulses sent between them
+CLOCK_CHECK_INTERVAL = 16
 
 try:
     range = xrange  # noqa
@@ -20,45 +35,71 @@ except NameError:
     pass
 
 
-class MidiEvent(object):
-    """Container for a MIDI message and a timing tick.
+class MidiEvent(namedtuple('MidiEvent', 'tick,message')):
+    """A MIDI message and the tick it is scheduled for.
 
-    Bascially like a two-item named tuple, but we overwrite the comparison
-    operators, so that they (except when testing for equality) use only the
-    timing ticks.
+    A compact, immutable record (a tuple subclass without an instance
+    dictionary). :meth:`Sequencer.add` accepts instances of this class, but
+    events are stored internally as plain ``(tick, seq, message)`` tuples.
 
     """
 
-    __slots__ = ('tick', 'message')
-
-    def __init__(self, tick, message):
-        self.tick = tick
-        self.message = message
+    __slots__ = ()
 
     def __repr__(self):
         return "@ %05i %r" % (self.tick, self.message)
 
-    def __eq__(self, other):
-        return (self.tick == other.tick and
-                self.message == other.message)
 
-    def __lt__(self, other):
-        return self.tick < other.tick
+class Sequencer(object):
+    """Scheduler sending out queued MIDI events at their scheduled tick.
 
-    def __le__(self, other):
-        return self.tick <= other.tick
+    This class implements the event queues, the tempo map and sending of
+    due events. Subclasses drive it by calling :meth:`_process` at the
+    deadlines it returns and implement :meth:`_wake`, see
+    :class:`SequencerThread` and :class:`~.aiosequencer.AsyncSequencer`.
 
-    def __gt__(self, other):
-        return self.tick > other.tick
+    The current tick is always derived from the time elapsed on the clock, so
+    oversleeping never accumulates into drift. Tempo changes re-anchor the
+    tempo map at the current position (tick offset + time offset), so the
+    tick count continues smoothly at the new rate.
 
-    def __ge__(self, other):
-        return self.tick >= other.tick
+    :meth:`add` and :meth:`add_many` may be called from any thread. They only
+    append to the input queue and wake up the scheduler only when it is
+    sleeping until a later deadline. The scheduler drains the whole input
+    queue on each iteration and merges it into its pending events. They
+    return the highest tick of the added events.
 
+    Events are stored as ``(tick, seq, message)`` tuples, where ``seq`` is a
+    running number, so events are ordered by tick and then by the order they
+    were added in and the ordering is done by C-level tuple comparisons.
 
-class SequencerThread(threading.Thread):
-    def __init__(self, midiout, queue=None, bpm=120.0, ppqn=480):
-        super(SequencerThread, self).__init__()
-        # log.debug("Created sequencer thread.")
+    Events can be added with a ``tag`` (any hashable, e.g. a scene or
+    transaction id), which is stored as a fourth tuple item. :meth:`cancel`
+    drops all events added with a tag so far, which have not been sent yet.
+
+    Pending events are kept in a store from :mod:`.eventqueue`, by default
+    an :class:`~.eventqueue.EventHeap`. Pass e.g. a
+    :class:`~.eventqueue.TimingWheel` instance as ``pending`` for a million
+    or more events scheduled far into the future.
+
+    The scheduler can act as MIDI clock master (see :meth:`start_midi_clock`).
+    Clock pulses are not stored as events, the scheduler computes the tick of
+    the next pulse (24 per beat) itself and sends due pulses before other
+    due events and between slices of large batches, so big bursts do not
+    delay them.
+
+    Events can be quantized to the next beat or bar, counted from where the
+    MIDI clock was started (or tick 0), see :meth:`quantize`.
+
+    Pass a :class:`~.metrics.SequencerMetrics` instance as ``metrics`` to
+    collect lateness, send time and queue depth metrics. Each sent message
+    is logged at debug level only if ``log_messages`` is true. Without
+    metrics and logging, the send path does no extra work.
+
+    """
+
+    def __init__(self, midiout, queue=None, bpm=120.0, ppqn=480, clock=None, pending=None,
+                 metrics=None, log_messages=False, beats_per_bar=4):
         self.midiout = midiout
         self.lock = threading.Lock()
 
@@ -68,17 +109,37 @@ class SequencerThread(threading.Thread):
             self.queue = deque()
             # log.debug("Created queue for MIDI output.")
 
+        # Guards the deadline and tempo changes. Notified when a thread
+        # sleeping until its deadline needs to wake up earlier.
+        self._wakeup = threading.Condition()
+        # Tick the scheduler is sleeping until, or -1 while it is awake
+        self._deadline = -1
         self._stopped = threading.Event()
         self._finished = threading.Event()
 
-        # Counts elapsed ticks when sequence is running
-        self._tickcnt = None
-        # Max number of input queue events to get in one loop
-        self._batchsize = 100
+        # Monotonic clock returning nanoseconds
+        self.clock = clock or time.perf_counter_ns
+        # Tempo map: (anchor tick, anchor clock time, tick length in ns).
+        # Always replaced as a whole, so it can be read without locking.
+        # Anchor time is None until the sequence is started.
+        self._tempo = (0., None, None)
+        # Events waiting for their tick to be reached
+        self._pending = EventHeap() if pending is None else pending
+        # Event sequence numbers, next() on it is atomic
+        self._counter = count()
+        # Tick of the next MIDI clock pulse or None if the clock is stopped
+        self._clock_next = None
+        # Tick at which the MIDI clock was started (beat and bar grid origin)
+        self._clock_origin = 0
+        # Maps cancelled tags to the sequence number at the time of cancelling
+        self._cancelled = {}
 
         # run-time options
         self.ppqn = ppqn
         self.bpm = bpm
+        self.metrics = metrics
+        self.log_messages = log_messages
+        self.beats_per_bar = beats_per_bar
 
     @property
     def bpm(self):
@@ -87,57 +148,440 @@ class SequencerThread(threading.Thread):
 
     @bpm.setter
     def bpm(self, value):
-        self._bpm = value
-        self._tick = 60. / value / self.ppqn
-        # log.debug("Changed BPM => %s, tick interval %.2f ms.",
-        #           self._bpm, self._tick * 1000)
+        with self._wakeup:
+            anchor_tick, anchor_time, _ = self._tempo
 
-    def stop(self, timeout=5):
-        """Set thread stop event, causing it to exit its mainloop."""
-        self._stopped.set()
-        # log.debug("SequencerThread stop event set.")
+            if anchor_time is not None:
+                anchor_time = self.clock()
+                anchor_tick = self._tick_at(anchor_time)
 
-        if self.is_alive():
-            self._finished.wait(timeout)
+            self._bpm = value
+            self._tick = 6e10 / value / self.ppqn
+            self._tempo = (anchor_tick, anchor_time, self._tick)
+            # log.debug("Changed BPM => %s, tick interval %.2f ms.",
+            #           self._bpm, self._tick / 1e6)
 
-        self.join()
+        # pending deadlines have moved
+        self._wake()
+
+    @property
+    def tick(self):
+        """Return number of ticks elapsed since the sequence was started."""
+        if self._tempo[1] is None:
+            return 0
+
+        return int(self._tick_at(self.clock()))
+
+    @property
+    def started(self):
+        """Return True if the sequence was started, so ticks can be converted to clock time."""
+        return self._tempo[1] is not None
+
+    def _tick_at(self, now):
+        anchor_tick, anchor_time, ticklen = self._tempo
+        return anchor_tick + (now - anchor_time) / ticklen
+
+    def _start_clock(self):
+        with self._wakeup:
+            self._tempo = (0., self.clock(), self._tick)
+
+    def tick_to_time(self, tick):
+        """Return clock time (in nanoseconds) at which given tick is due."""
+        anchor_tick, anchor_time, ticklen = self._tempo
+        return anchor_time + ceil((tick - anchor_tick) * ticklen)
+
+    def time_to_tick(self, time):
+        """Return the tick nearest to clock time ``time`` (in nanoseconds)."""
+        return int(round(self._tick_at(time)))
+
+    def quantize(self, tick, grid):
+        """Return the first tick at or after ``tick`` on the given grid.
+
+        ``grid`` is ``'beat'``, ``'bar'`` or a number of ticks. If it is None
+        or 0, ``tick`` is returned unchanged.
+
+        """
+        if not grid:
+            return tick
+
+        if grid == 'beat':
+            grid = self.ppqn
+        elif grid == 'bar':
+            grid = self.ppqn * self.beats_per_bar
+
+        origin = self._clock_origin
+        return origin + ceil((tick - origin) / grid) * grid
+
+    @property
+    def midi_clock_running(self):
+        """Return True if MIDI clock messages are being sent."""
+        return self._clock_next is not None
+
+    def start_midi_clock(self, tick=None, song_position=0, quantize=None):
+        """Start sending MIDI clock at ``tick`` (default: the current tick).
+
+        Sends 'Start', or 'Song Position Pointer' and 'Continue', if a
+        ``song_position`` (in 16th notes) is given, followed by 24 'Timing
+        Clock' messages per beat. The start tick becomes the origin of the
+        beat and bar grid.
+
+        """
+        if tick is None:
+            tick = self.tick
+
+        tick = self.quantize(tick, quantize)
+
+        def start():
+            if song_position:
+                self.handle_event(bytes((SONG_POSITION_POINTER, song_position & 0x7F,
+                                         (song_position >> 7) & 0x7F)))
+                self.handle_event(SONG_CONTINUE)
+            else:
+                self.handle_event(SONG_START)
+
+            self._clock_origin = self._clock_next = tick
+
+        self.add_callback(start, tick)
+
+    def stop_midi_clock(self, tick=None, quantize=None):
+        """Stop sending MIDI clock and send 'Stop' at ``tick`` (default: the current tick)."""
+        if tick is None:
+            tick = self.tick
+
+        def stop():
+            self._clock_next = None
+            self.handle_event(SONG_STOP)
+
+        self.add_callback(stop, self.quantize(tick, quantize))
+
+    def seconds_to_ticks(self, seconds):
+        """Return number of (fractional) ticks in ``seconds`` at the current tempo."""
+        return seconds * 1e9 / self._tick
+
+    def add(self, event, tick=None, delta=0, quantize=None, tag=None):
+        """Enqueue event for sending to MIDI output.
+
+        If ``quantize`` is given, ``tick`` is moved to the next grid position
+        (see :meth:`quantize`) before adding ``delta``. The event can be
+        dropped with :meth:`cancel`, if it is added with a ``tag``.
+
+        Wakes up the thread if it is sleeping until a later deadline.
+
+        """
+        if tick is None:
+            tick = self.tick
+
+        if isinstance(event, MidiEvent):
+            tick = event.tick or tick
+            event = event.message
+
+        if quantize:
+            tick = self.quantize(tick, quantize)
+
+        tick += delta
+
+        if tag is None:
+            self.queue.append((tick, next(self._counter), event))
+        else:
+            self.queue.append((tick, next(self._counter), event, tag))
+
+        self._notify(tick)
+        return tick
 
-    def add(self, event, tick=None, delta=0):
-        """Enqueue event for sending to MIDI output."""
+    def add_many(self, events, tick=None, deltas=None, quantize=None, tag=None):
+        """Enqueue a batch of MIDI messages for sending to MIDI output.
+
+        All messages are scheduled relative to the same base ``tick``
+        (default: the current tick, moved to the next grid position, if
+        ``quantize`` is given). ``deltas`` can be None (send all messages at
+        the base tick), a single number added to the base tick for all
+        messages or a sequence with one delta per message.
+
+        The whole batch is handed to the sequencer thread in one operation.
+        All messages get the same ``tag``, see :meth:`add`.
+
+        """
+        if tick is None:
+            tick = self.tick
+
+        if quantize:
+            tick = self.quantize(tick, quantize)
+
+        if deltas is None:
+            deltas = 0
+
+        if not isinstance(deltas, (int, float)):
+            return self.add_timed(zip(deltas, events), tick, tag=tag)
+
+        counter = self._counter
+        tick += deltas
+
+        if tag is None:
+            batch = [(tick, next(counter), msg) for msg in events]
+        else:
+            batch = [(tick, next(counter), msg, tag) for msg in events]
+
+        if batch:
+            self.queue.extend(batch)
+            self._notify(tick)
+            return tick
+
+    def add_timed(self, events, tick=None, quantize=None, tag=None):
+        """Enqueue a batch of ``(delta, message)`` pairs for sending to MIDI output.
+
+        The deltas are relative to ``tick`` (default: the current tick, moved
+        to the next grid position, if ``quantize`` is given). The whole batch
+        is handed to the sequencer thread in one operation. All messages get
+        the same ``tag``, see :meth:`add`.
+
+        """
         if tick is None:
-            tick = self._tickcnt or 0
+            tick = self.tick
+
+        if quantize:
+            tick = self.quantize(tick, quantize)
 
-        if not isinstance(event, MidiEvent):
-            event = MidiEvent(tick, event)
+        counter = self._counter
 
-        if not event.tick:
-            event.tick = tick
+        if tag is None:
+            batch = [(tick + delta, next(counter), msg) for delta, msg in events]
+        else:
+            batch = [(tick + delta, next(counter), msg, tag) for delta, msg in events]
 
-        event.tick += delta
-        self.queue.append(event)
+        if batch:
+            self.queue.extend(batch)
+            self._notify(min(batch)[0])
+            return max(batch)[0]
 
-    def get_event(self):
-        """Poll the input queue for events without blocking.
+    def add_callback(self, func, tick=None, delta=0, tag=None):
+        """Schedule ``func`` to be called (without arguments) by the scheduler.
+
+        The callback is called after all events added before it for the same
+        tick have been sent, so it can be used as a marker, e.g. to measure
+        when a batch of messages has gone out.
+
+        """
+        return self.add(func, tick, delta, tag=tag)
+
+    def _schedule(self, event, tick, seq, tag=None):
+        # Put an event into the pending events directly. Only to be called
+        # by callbacks run by the scheduler, e.g. to schedule their next call.
+        # ``seq`` must be taken from _counter when the callback was created,
+        # so cancelling its tag applies to all its calls.
+        self._pending.push((tick, seq, event) if tag is None else (tick, seq, event, tag))
+
+    def cancel(self, tag):
+        """Drop all events added with ``tag`` so far, which have not been sent yet.
+
+        This is O(1): the tag is only recorded and the scheduler drops the
+        events when they are due (lazy deletion). Events added with the same
+        tag afterwards are not affected. Cancelled tags are forgotten once
+        there are no more pending events.
+
+        """
+        with self._wakeup:
+            self._cancelled[tag] = next(self._counter)
+
+    def _drop_cancelled(self, events):
+        cancelled = self._cancelled
+        return [evt for evt in events
+                if len(evt) == 3 or evt[1] > cancelled.get(evt[3], -1)]
+
+    def _forget_cancelled(self):
+        # Called when there are no pending events. Events in the input queue
+        # may still have been added before cancelling, see cancel().
+        with self._wakeup:
+            if not self.queue:
+                self._cancelled.clear()
+
+    def _notify(self, tick):
+        # Must be called *after* putting an event in the queue. The scheduler
+        # sets the deadline before checking the queue a last time prior to
+        # sleeping, so either it sees the new event or we see its deadline.
+        if tick < self._deadline:
+            self._wake()
+
+    def _wake(self):
+        """Make the scheduler process its queues before its current deadline."""
+        raise NotImplementedError
+
+    def start(self):
+        """Start the clock and begin sending events."""
+        raise NotImplementedError
+
+    def stop(self, timeout=5):
+        """Stop sending events and wait until the scheduler has finished."""
+        raise NotImplementedError
+
+    def get_events(self):
+        """Remove all events from the input queue without blocking.
 
         Could be overwritten, e.g. if you passed in your own queue instance
         with a different API.
 
         """
-        try:
-            return self.queue.popleft()
-        except IndexError:
-            return None
+        queue = self.queue
+        popleft = queue.popleft
+        # Only take what is there now, producers may still be appending
+        return [popleft() for i in range(len(queue))]
 
-    def handle_event(self, event):
-        """Handle the event by sending it to MIDI out.
+    def handle_event(self, message):
+        """Handle the event message by sending it to MIDI out.
 
         Could be overwritten, e.g. to handle meta events, like time signature
         and tick division changes.
 
+        Callables scheduled with :meth:`add_callback` are called instead.
+
         """
-        Logger.debug("Sequencer: Midi Out: %r", event.message)
+        if callable(message):
+            message()
+            return
+
+        if self.log_messages:
+            log.debug("Midi Out: %r", message)
+
         with self.lock:
-            self.midiout.send_message(event.message)
+            self.midiout.send_message(message)
+
+    def _process(self, now):
+        """Ingest queued events and send all events due at clock time ``now``.
+
+        Returns the tick of the next pending event or None, if there is none.
+
+        """
+        pending = self._pending
+        tick = self._tick_at(now)
+
+        if self._clock_next is not None and self._clock_next <= tick:
+            self._send_clock(tick)
+
+        # Events from the input queue, which are already due, bypass the
+        # pending queue, the rest is merged into it
+        events = self.get_events()
+        due = [evt for evt in events if evt[0] <= tick]
+
+        if len(due) < len(events):
+            if due:
+                events = [evt for evt in events if evt[0] > tick]
+
+            pending.extend(events)
+
+        # Get events from the pending queue if they are due for this tick.
+        # They come out sorted, so only events from the input queue require
+        # sorting the batch (which is O(n) for pre-sorted runs).
+        if due:
+            due.extend(pending.pop_due(tick))
+            due.sort()
+        else:
+            due = pending.pop_due(tick)
+
+        if self._cancelled and due:
+            due = self._drop_cancelled(due)
+
+        # Send due events to the MIDI output in one ordered pass
+        if self._clock_next is None or len(due) <= CLOCK_CHECK_INTERVAL:
+            self._send(due)
+        else:
+            for i in range(0, len(due), CLOCK_CHECK_INTERVAL):
+                self._send(due[i:i + CLOCK_CHECK_INTERVAL])
+
+                if self._clock_next is not None:
+                    self._send_clock(self._tick_at(self.clock()))
+
+        if self.metrics is not None and due:
+            self.metrics.record_batch(len(due), len(pending))
+
+        next_tick = pending.next_tick()
+
+        if next_tick is None and self._cancelled:
+            self._forget_cancelled()
+
+        if self._clock_next is not None and (next_tick is None or self._clock_next < next_tick):
+            return self._clock_next
+
+        return next_tick
+
+    def _send(self, events):
+        handle_event = self.handle_event
+        metrics = self.metrics
+
+        if metrics is None:
+            for evt in events:
+                handle_event(evt[2])
+        else:
+            clock = self.clock
+            tick_to_time = self.tick_to_time
+            lateness = metrics.lateness.record
+            send_time = metrics.send_time.record
+
+            for evt in events:
+                start = clock()
+                handle_event(evt[2])
+                end = clock()
+                lateness(start - tick_to_time(evt[0]))
+                send_time(end - start)
+
+    def _send_clock(self, tick):
+        # Send all MIDI clock pulses due at ``tick``
+        interval = self.ppqn / 24.
+        pulse = self._clock_next
+
+        while pulse <= tick:
+            self.handle_event(TIMING_CLOCK)
+            pulse += interval
+
+        self._clock_next = pulse
+
+
+class SequencerThread(Sequencer, threading.Thread):
+    """Thread sending out queued MIDI events at their scheduled tick.
+
+    Instead of waking up on every tick, the thread converts the tick of the
+    next pending event into an absolute timestamp on the monotonic clock and
+    sleeps until then, or until :meth:`add` signals that an event was queued,
+    which is due before the current wake-up deadline. :meth:`add` takes the
+    wake-up lock only in this case.
+
+    To keep other busy threads and processes from delaying it, the thread
+    can request a real-time scheduling policy (``sched_policy`` ``'fifo'``
+    or ``'rr'`` with ``sched_priority``), be pinned to the CPU numbers in
+    ``cpus`` and lock the process memory (``lock_memory``), see
+    :func:`~.realtime.apply_realtime`. Settings which are not permitted are
+    skipped with a warning. The effective settings are available as
+    ``realtime`` once the thread has started.
+
+    See :class:`Sequencer` for the scheduling and the other constructor
+    arguments.
+
+    """
+
+    def __init__(self, midiout, *args, sched_policy=None, sched_priority=None, cpus=None,
+                 lock_memory=False, **kwargs):
+        threading.Thread.__init__(self)
+        # log.debug("Created sequencer thread.")
+        Sequencer.__init__(self, midiout, *args, **kwargs)
+        self.realtime_options = dict(policy=sched_policy, priority=sched_priority, cpus=cpus,
+                                     lock_memory=lock_memory)
+        self.realtime = None
+
+    def _wake(self):
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def start(self):
+        threading.Thread.start(self)
+
+    def stop(self, timeout=5):
+        """Set thread stop event, causing it to exit its mainloop."""
+        self._stopped.set()
+        # log.debug("SequencerThread stop event set.")
+        self._wake()
+
+        if self.is_alive():
+            self._finished.wait(timeout)
+
+        self.join()
 
     def run(self):
         """Start the thread's main loop.
@@ -146,58 +590,38 @@ class SequencerThread(threading.Thread):
         them immediately to the MIDI output or queue them for later output, if
         their timestamp has not been reached yet.
 
-        """
-        # busy loop to wait for time when next batch of events needs to
-        # be written to output
-        pending = []
-        self._tickcnt = 0
+        Between batches the thread sleeps until the next pending event is due
+        or it is woken up by :meth:`add`, :meth:`stop` or a tempo change.
 
-        try:
-            while not self._stopped.is_set():
-                due = []
-                curtime = time.time()
-
-                # Pop events off the pending queue
-                # if they are due for this tick
-                while True:
-                    if not pending or pending[0].tick > self._tickcnt:
-                        break
-
-                    evt = heappop(pending)
-                    heappush(due, evt)
-                    # log.debug("Queued pending event for output: %r", evt)
-
-                # Pop up to self._batchsize events off the input queue
-                for i in range(self._batchsize):
-                    evt = self.get_event()
+        """
+        options = self.realtime_options
 
-                    if not evt:
-                        break
+        if options['policy'] or options['cpus'] or options['lock_memory']:
+            self.realtime = apply_realtime(name="sequencer thread '%s'" % self.name, **options)
 
-                    # log.debug("Got event from input queue: %r", evt)
-                    # Check whether event should be sent out immediately
-                    # or needs to be scheduled
+        self._start_clock()
 
-                    if evt.tick <= self._tickcnt:
-                        heappush(due, evt)
-                        # log.debug("Queued event for output.")
+        try:
+            while not self._stopped.is_set():
+                deadline = self._process(self.clock())
+
+                with self._wakeup:
+                    # Publish deadline before looking at the input queue,
+                    # see _notify()
+                    if deadline is None:
+                        self._deadline = float('inf')
+                        timeout = None
                     else:
-                        heappush(pending, evt)
-                        # log.debug("Scheduled event in pending queue.")
-
-                # If this batch contains any due events,
-                # send them to the MIDI output.
-                if due:
-                    for i in range(len(due)):
-                        self.handle_event(heappop(due))
+                        self._deadline = deadline
+                        timeout = (self.tick_to_time(deadline) - self.clock()) / 1e9
 
-                # loop speed adjustment
-                elapsed = time.time() - curtime
+                    # Don't sleep if events were added while we were busy
+                    busy = self.queue or self._stopped.is_set()
 
-                if elapsed < self._tick:
-                    time.sleep(self._tick - elapsed)
+                    if not busy and (timeout is None or timeout > 0):
+                        self._wakeup.wait(timeout)
 
-                self._tickcnt += 1
+                    self._deadline = -1
         except KeyboardInterrupt:
             # log.debug("KeyboardInterrupt / INT signal received.")
             pass
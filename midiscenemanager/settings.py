@@ -5,10 +5,19 @@
 import importlib
 import json
 
+from functools import lru_cache
+
 from kivy.properties import StringProperty
 from kivy.uix.settings import SettingOptions
 
 
+@lru_cache()
+def _resolve(name):
+    # Return the function for a 'module:function' name
+    mod_name, func_name = name.rsplit(':', 1)
+    return getattr(importlib.import_module(mod_name), func_name)
+
+
 class SettingDynamicOptions(SettingOptions):
     """Implementation of an option list that creates the items in the possible
     options list by calling an external method, that should be defined in
@@ -18,17 +27,17 @@ class SettingDynamicOptions(SettingOptions):
     options_factory = StringProperty()
     """The function's name to call each time the list should be updated.
 
-    It should return a list of strings, to be used for the options.
+    It should return a list of strings, to be used for the options. The
+    function is looked up only once and should return quickly, e.g. from a
+    cache like :class:`~midiscenemanager.portregistry.PortRegistry`.
 
     """
 
     def _create_popup(self, instance):
         # Update the options
-        mod_name, func_name = self.options_factory.rsplit(':', 1)
         try:
-            mod = importlib.import_module(mod_name)
-            self.options = getattr(mod, func_name)()
-        except:
+            self.options = _resolve(self.options_factory)()
+        except Exception:
             self.options = []
         super()._create_popup(instance)
 
@@ -48,6 +57,80 @@ settings_json = json.dumps(
         "desc": "Select the MIDI output port",
         "section": "midi",
         "key": "port",
-        "options_factory": "midiio:get_midiout_ports"
+        "options_factory": "midiscenemanager.midiio:get_midiout_ports"
+    },
+    {
+        "type": "dynamic_options",
+        "title": "MIDI Input",
+        "desc": "Select the MIDI input port for scene triggers",
+        "section": "midi",
+        "key": "input_port",
+        "options_factory": "midiscenemanager.midiio:get_midiin_ports"
+    },
+    {
+        "type": "numeric",
+        "title": "Sysex chunk size",
+        "desc": "Split system exclusive messages into chunks of this many bytes (0 = off)",
+        "section": "midi",
+        "key": "sysex_chunk_size"
+    },
+    {
+        "type": "numeric",
+        "title": "Sysex transfer rate",
+        "desc": "Limit system exclusive transfers to this many bytes per second (0 = off)",
+        "section": "midi",
+        "key": "sysex_rate"
+    },
+    {
+        "type": "bool",
+        "title": "Drop redundant messages",
+        "desc": "Do not send controller and program changes, which would not change the "
+                "device state",
+        "section": "midi",
+        "key": "state_cache"
+    },
+    {
+        "type": "numeric",
+        "title": "Tempo",
+        "desc": "Tempo in BPM for MIDI clock and scenes quantized to beats or bars",
+        "section": "midi",
+        "key": "bpm"
+    },
+    {
+        "type": "bool",
+        "title": "Send MIDI clock",
+        "desc": "Send MIDI clock with Start and Stop on the MIDI output",
+        "section": "midi",
+        "key": "midi_clock"
+    },
+    {
+        "type": "options",
+        "title": "Sequencer scheduling policy",
+        "desc": "Real-time scheduling of the MIDI output threads, if permitted (for ports "
+                "opened afterwards)",
+        "section": "midi",
+        "key": "sched_policy",
+        "options": ["none", "other", "fifo", "rr"]
+    },
+    {
+        "type": "numeric",
+        "title": "Sequencer priority",
+        "desc": "Real-time priority for the 'fifo' and 'rr' scheduling policies",
+        "section": "midi",
+        "key": "sched_priority"
+    },
+    {
+        "type": "string",
+        "title": "Sequencer CPUs",
+        "desc": "Pin the MIDI output threads to these CPUs, e.g. '2,3' or '0-1' (empty = all)",
+        "section": "midi",
+        "key": "cpus"
+    },
+    {
+        "type": "bool",
+        "title": "Lock memory",
+        "desc": "Lock the program's memory into RAM to avoid delays by page faults",
+        "section": "midi",
+        "key": "lock_memory"
     },
 ])
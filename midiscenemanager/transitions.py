@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# transitions.py
+#
+"""Compile scene transitions into the minimal set of messages to send.
+
+Switching from one scene to another sends the 'on_exit' messages of the old
+and the 'on_enter' messages of the new scene in one go. Often a controller or
+program is set by both, e.g. the volume is turned down on exit and back up on
+enter. For these, only the last message determines the resulting device
+state, so the earlier ones can be left out.
+
+"""
+
+from collections import OrderedDict
+
+from .commands import ORDERED_CONTROLLERS
+
+__all__ = ('TransitionCache', 'compile_transition', 'reduce_messages')
+
+
+def _merge(*command_lists):
+    # Merge (port, ((delta, message), ...)) lists into a dict mapping ports to
+    # lists of (delta, phase, message) tuples in the order the sequencer
+    # sends them, i.e. by delta and, for equal deltas, by the order they were
+    # queued. ``phase`` is the index of the command list of the message.
+    ports = OrderedDict()
+
+    for phase, commands in enumerate(command_lists):
+        for port, messages in commands:
+            events = ports.setdefault(port, [])
+            start = len(events)
+            events.extend((delta, phase, start + i, msg)
+                          for i, (delta, msg) in enumerate(messages))
+
+    return OrderedDict((port, [(evt[0], evt[1], evt[3]) for evt in sorted(events)])
+                       for port, events in ports.items())
+
+
+def _state_key(msg):
+    # Return the key of the device state set by the message, None if the
+    # message does not set a state, or a channel (0-15) or -1 (all
+    # channels), if later messages must not replace earlier ones across it.
+    status = msg[0]
+    kind = status & 0xF0
+
+    if msg.__class__ is tuple:
+        # Ramps send values over time, so they must keep their place
+        return status & 0x0F
+    elif kind == 0xB0:
+        if msg[1] in ORDERED_CONTROLLERS:
+            return status & 0x0F
+
+        return (status, msg[1])
+    elif kind == 0xC0 or kind == 0xE0:
+        return (status,)
+    elif 0xF0 <= status < 0xF8 or status == 0xFF:
+        return -1
+
+    return None
+
+
+def reduce_messages(messages):
+    """Remove messages from a list of (delta, message) pairs, which are overridden.
+
+    The items may also be longer tuples with the message as the last item.
+
+    A controller, program or pitch bend message is removed, if a later
+    message for the same controller etc. on the same channel follows, and
+    there is no message between them, whose effect depends on the order
+    (e.g. (N)RPN, data entry, channel mode messages, system exclusive).
+    Channel mode messages like 'All Notes Off' are never removed.
+
+    """
+    result = []
+    seen = set()
+
+    for item in reversed(messages):
+        key = _state_key(item[-1])
+
+        if key.__class__ is tuple:
+            if key in seen:
+                continue
+
+            seen.add(key)
+        elif key == -1:
+            seen.clear()
+        elif key is not None:
+            channel = key
+            seen = {k for k in seen if k[0] & 0x0F != channel}
+
+        result.append(item)
+
+    result.reverse()
+    return tuple(result)
+
+
+def compile_transition(from_scene, to_scene):
+    """Return the messages for the transition between two scenes.
+
+    The result is an ``(on_exit, on_enter)`` pair of the remaining messages
+    of ``from_scene``'s 'on_exit' and ``to_scene``'s 'on_enter' list. Each
+    is a tuple of ``(port, ((delta, message), ...))`` pairs like these items
+    of a :class:`~.config.Scene`. Sending the first and then the second at
+    the same tick results in the same device state as sending both lists
+    unchanged.
+
+    """
+    merged = _merge(from_scene.on_exit, to_scene.on_enter)
+    phases = ([], [])
+
+    for port, events in merged.items():
+        events = reduce_messages(events)
+
+        for phase, commands in enumerate(phases):
+            messages = tuple((delta, msg) for delta, p, msg in events if p == phase)
+
+            if messages:
+                commands.append((port, messages))
+
+    return tuple(phases[0]), tuple(phases[1])
+
+
+class TransitionCache(object):
+    """Compiled transitions between scenes with least-recently-used eviction.
+
+    ``scenes`` is a dict mapping scene names to :class:`~.config.Scene`
+    instances. At most ``maxsize`` transitions are kept.
+
+    """
+
+    def __init__(self, scenes, maxsize=256):
+        self.scenes = scenes
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, from_name, to_name):
+        """Return the compiled transition from scene ``from_name`` to ``to_name``."""
+        key = (from_name, to_name)
+        cache = self._cache
+
+        try:
+            transition = cache[key]
+        except KeyError:
+            transition = cache[key] = compile_transition(self.scenes[from_name],
+                                                         self.scenes[to_name])
+
+            if len(cache) > self.maxsize:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+
+        return transition
+
+    def clear(self):
+        self._cache.clear()
@@ -86,7 +86,8 @@ setup(
     install_requires=install_requires,
     entry_points={
         'console_scripts': [
-            'midiscenemanager=midiscenemanager.midiscenemanager:main'
+            'midiscenemanager=midiscenemanager.midiscenemanager:main',
+            'midiscenemanager-headless=midiscenemanager.headless:main',
         ]
     },
     cmdclass={'test': ToxTestCommand},
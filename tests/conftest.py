@@ -6,6 +6,21 @@ import shutil
 import pytest
 
 
+def pytest_addoption(parser):
+    parser.addoption('--runslow', action='store_true', help="run tests marked as slow")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--runslow'):
+        return
+
+    skip_slow = pytest.mark.skip(reason="needs --runslow option to run")
+
+    for item in items:
+        if 'slow' in item.keywords:
+            item.add_marker(skip_slow)
+
+
 @pytest.fixture(autouse=True)
 def ignore_app_ini(request):
     settings_file = 'midiscenemanager/MIDISceneManagerApp.ini'
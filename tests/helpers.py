@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Stand-ins for the clock and MIDI output used by the tests."""
+
+import time
+
+
+class FakeClock(object):
+    """Nanosecond clock, which only advances when told to."""
+
+    def __init__(self, now=10 ** 9):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingMidiOut(object):
+    """Stand-in for ``rtmidi.MidiOut``, which records ``(clock(), message)`` pairs."""
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.sent = []
+        self.closed = False
+
+    @property
+    def messages(self):
+        """Return list of sent messages without their times."""
+        return [msg for _, msg in self.sent]
+
+    def send_message(self, message):
+        self.sent.append((self.clock(), message))
+
+    def close_port(self):
+        self.closed = True
+
+    def wait_for(self, count, timeout=5):
+        """Wait until ``count`` messages were sent. Returns False on timeout."""
+        end = time.perf_counter() + timeout
+
+        while len(self.sent) < count:
+            if time.perf_counter() > end:
+                return False
+
+            time.sleep(0.001)
+
+        return True
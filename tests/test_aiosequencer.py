@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from midiscenemanager.aiosequencer import AsyncSequencer, get_event_loop_thread
+from midiscenemanager.midiio import MidiOutWrapper
+
+from helpers import RecordingMidiOut
+
+
+@pytest.fixture
+def sequencers():
+    sequencers = []
+    yield sequencers
+
+    for seq in sequencers:
+        seq.stop()
+
+
+def test_many_outputs_share_one_thread(sequencers):
+    get_event_loop_thread()
+    threads = threading.active_count()
+
+    for i in range(20):
+        seq = AsyncSequencer(RecordingMidiOut())
+        seq.start()
+        sequencers.append(seq)
+
+    time.sleep(0.01)
+
+    for i, seq in enumerate(sequencers):
+        seq.add_many([[0xB0, 7, n] for n in range(10)], deltas=range(0, 50, 5))
+
+    for seq in sequencers:
+        seq.midiout.wait_for(10)
+        assert [msg[2] for _, msg in seq.midiout.sent] == list(range(10))
+
+    assert threading.active_count() == threads
+
+
+def test_events_sent_at_deadline(sequencers):
+    seq = AsyncSequencer(RecordingMidiOut(), bpm=120, ppqn=480)
+    seq.start()
+    sequencers.append(seq)
+    time.sleep(0.01)
+    tick = seq.add([0x90, 60, 100], delta=48)
+    seq.midiout.wait_for(1)
+    sent, msg = seq.midiout.sent[0]
+    # loop timers have about millisecond resolution
+    assert 0 <= sent - seq.tick_to_time(tick) < 20 * 10 ** 6
+
+
+def test_stop(sequencers):
+    seq = AsyncSequencer(RecordingMidiOut())
+    seq.start()
+    time.sleep(0.01)
+    assert seq.is_alive()
+    seq.add([0x90, 60, 100], delta=100)
+    seq.stop()
+    assert not seq.is_alive()
+    time.sleep(0.15)
+    assert seq.midiout.sent == []
+
+
+def test_awaitable_send():
+    wrapper = MidiOutWrapper(RecordingMidiOut(), 'out', engine='asyncio')
+
+    async def send():
+        await wrapper.aio.send_program_change(program=10, delay=10)
+        return len(wrapper.midi.midiout.sent)
+
+    try:
+        assert asyncio.run(send()) == 1
+    finally:
+        wrapper._cleanup()
+
+    assert wrapper.midi.midiout.sent[0][1] == b'\xC0\x0A'
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        MidiOutWrapper(RecordingMidiOut(), 'out', engine='greenlet')
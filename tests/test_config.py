@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from os.path import dirname, join
+
+import pytest
+
+from midiscenemanager.config import ConfigError, get_cache_filename, parse_config
+
+EXAMPLE_CFG = join(dirname(dirname(__file__)), 'examples', 'example.cfg')
+
+SCENE_CFG = """\
+[global]
+default_panel: main
+
+[panel:main]
+title: Main
+cols: 2
+scenes: one
+
+[scene:one]
+title: One
+on_enter:
+    bank_select ch=2 bank=1025
+    program_change ch=2 program=20
+    channel_volume value=90 delay=10
+on_exit:
+    all_notes_off ch=16
+"""
+
+
+def write_config(tmp_path, text):
+    path = tmp_path / 'scenes.cfg'
+    path.write_text(text)
+    return str(path)
+
+
+def test_parse_example_config():
+    config = parse_config(EXAMPLE_CFG, cache=False)
+    assert config['default_panel'] == 'set1'
+    assert set(config['panels']) == {'set1', 'programs'}
+    assert config['scenes']['pc05'].on_enter == ((None, ((0, b'\xc0\x05'),)),)
+
+
+def test_scene_commands_compiled(tmp_path):
+    scene = parse_config(write_config(tmp_path, SCENE_CFG))['scenes']['one']
+    assert scene.title == 'One'
+    # commands are delayed by their index, unless they have a delay argument
+    assert scene.on_enter == ((None, (
+        (0, b'\xb1\x00\x08'),
+        (0, b'\xb1\x20\x01'),
+        (1, b'\xc1\x14'),
+        (10, b'\xb0\x07\x5a'),
+    )),)
+    assert scene.on_exit == ((None, ((0, b'\xbf\x7b\x00'),)),)
+
+
+def test_commands_grouped_by_port(tmp_path):
+    text = SCENE_CFG.replace('[global]', '[ports]\nsynth2: USB MIDI 2\nfx: 3\n\n[global]')
+    text = text.replace('program_change ch=2 program=20', 'program_change program=20 port=synth2')
+    text = text.replace('channel_volume value=90 delay=10', 'channel_volume value=90 port=fx\n'
+                        '    channel_volume value=80 port=synth2')
+    config = parse_config(write_config(tmp_path, text))
+    assert config['ports'] == {'synth2': 'USB MIDI 2', 'fx': '3'}
+    assert config['scenes']['one'].on_enter == (
+        (None, ((0, b'\xb1\x00\x08'), (0, b'\xb1\x20\x01'))),
+        ('synth2', ((1, b'\xc0\x14'), (3, b'\xb0\x07\x50'))),
+        ('fx', ((2, b'\xb0\x07\x5a'),)),
+    )
+    # cached configuration is identical
+    assert parse_config(write_config(tmp_path, text)) == config
+
+
+@pytest.mark.parametrize('command', [
+    'no_such_command',
+    'program_change program=128',
+    'control_change cc=7 value=-1',
+    'note_on ch=17',
+    'program_change prog=1',
+    'program_change program',
+    'pitch_bend value=4000h',
+    'program_change program=1 port=nosuchport',
+    'program_change program=1 delay=abc',
+    'program_change program=1 delay=-1',
+])
+def test_invalid_command_raises_at_load_time(tmp_path, command):
+    text = SCENE_CFG.replace('all_notes_off ch=16', command)
+
+    with pytest.raises(ConfigError) as exc:
+        parse_config(write_config(tmp_path, text))
+
+    assert "Scene 'one', 'on_exit'" in str(exc.value)
+
+
+def test_sysex_parsed_and_split_at_load_time(tmp_path):
+    text = SCENE_CFG.replace('all_notes_off ch=16', 'system_exclusive value=F07E01F7F0430002F7')
+    scene = parse_config(write_config(tmp_path, text))['scenes']['one']
+    assert scene.on_exit == ((None, ((0, b'\xf0\x7e\x01\xf7'), (0, b'\xf0\x43\x00\x02\xf7'))),)
+
+
+@pytest.mark.parametrize('value', ['F07E01', '7E01F7', 'F07E01F701', 'F07EF0F7', 'F07X01F7'])
+def test_invalid_sysex_raises(tmp_path, value):
+    text = SCENE_CFG.replace('all_notes_off ch=16', 'system_exclusive value=' + value)
+
+    with pytest.raises(ConfigError):
+        parse_config(write_config(tmp_path, text))
+
+
+def test_triggers(tmp_path):
+    text = SCENE_CFG + """
+[scene:two]
+trigger:
+    program_change ch=16 program=2
+    note_on ch=10 note=36
+    control_change cc=80 value=127
+"""
+    triggers = parse_config(write_config(tmp_path, text))['triggers']
+    assert triggers == {b'\xcf\x02': 'two', b'\x99\x24': 'two', b'\xb0\x50\x7f': 'two'}
+    # cached triggers are identical
+    assert parse_config(write_config(tmp_path, text))['triggers'] == triggers
+
+
+def test_duplicate_trigger_raises(tmp_path):
+    text = SCENE_CFG.replace('title: One', 'title: One\ntrigger: program_change program=2')
+    text += "\n[scene:two]\ntrigger: program_change program=2\n"
+
+    with pytest.raises(ConfigError) as exc:
+        parse_config(write_config(tmp_path, text))
+
+    assert "already triggers scene 'one'" in str(exc.value)
+
+
+def test_ramp_cached_and_not_a_trigger(tmp_path):
+    text = SCENE_CFG.replace('channel_volume value=90 delay=10',
+                             'cc_ramp cc=7 from=0 to=90 duration=960 delay=10')
+    filename = write_config(tmp_path, text)
+    ramp = (10, (0xB0, (7,), 0, 90, 960, 10))
+    assert parse_config(filename)['scenes']['one'].on_enter[0][1][-1] == ramp
+    assert parse_config(filename)['scenes']['one'].on_enter[0][1][-1] == ramp
+
+    text = text.replace('title: One', 'title: One\ntrigger: cc_ramp cc=7')
+
+    with pytest.raises(ConfigError):
+        parse_config(write_config(tmp_path, text))
+
+
+def test_cache_written_and_used(tmp_path, mocker):
+    filename = write_config(tmp_path, SCENE_CFG)
+    config = parse_config(filename)
+    assert (tmp_path / 'scenes.cfg.cache').exists()
+
+    parse_scenes = mocker.patch('midiscenemanager.config.parse_scenes')
+    assert parse_config(filename) == config
+    assert not parse_scenes.called
+
+
+def test_cache_invalidated_by_content_change(tmp_path):
+    filename = write_config(tmp_path, SCENE_CFG)
+    parse_config(filename)
+    write_config(tmp_path, SCENE_CFG.replace('title: One', 'title: Uno'))
+    assert parse_config(filename)['scenes']['one'].title == 'Uno'
+
+
+def test_cache_validated_by_mtime_and_size(tmp_path, mocker):
+    filename = write_config(tmp_path, SCENE_CFG)
+    os.utime(filename, ns=(10 ** 18, 10 ** 18))
+    parse_config(filename)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['scenes.cfg', 'scenes.cfg.cache']
+
+    # unchanged modification time and size: the file is not read again
+    sha1 = mocker.patch('midiscenemanager.config.hashlib.sha1')
+    assert parse_config(filename)['scenes']['one'].title == 'One'
+    assert not sha1.called
+    mocker.stopall()
+
+    # touched, but same content: the digest still matches
+    os.utime(filename, ns=(2 * 10 ** 18, 2 * 10 ** 18))
+    parse_scenes = mocker.patch('midiscenemanager.config.parse_scenes')
+    assert parse_config(filename)['scenes']['one'].title == 'One'
+    assert not parse_scenes.called
+
+
+def test_corrupt_cache_ignored(tmp_path):
+    filename = write_config(tmp_path, SCENE_CFG)
+    config = parse_config(filename)
+
+    with open(get_cache_filename(filename), 'wb') as fp:
+        fp.write(b'garbage')
+
+    assert parse_config(filename) == config
+
+
+def test_no_cache(tmp_path):
+    parse_config(write_config(tmp_path, SCENE_CFG), cache=False)
+    assert not (tmp_path / 'scenes.cfg.cache').exists()
+
+
+def test_scene_quantize(tmp_path):
+    text = SCENE_CFG.replace('title: One', 'title: One\nquantize: bar')
+    text += "\n[scene:two]\nquantize: 240\n"
+    scenes = parse_config(write_config(tmp_path, text))['scenes']
+    assert scenes['one'].quantize == 'bar'
+    assert scenes['two'].quantize == 240
+    # cached scenes are identical
+    assert parse_config(write_config(tmp_path, text))['scenes'] == scenes
+
+
+@pytest.mark.parametrize('value', ['bars', '0', '-1'])
+def test_invalid_quantize_raises(tmp_path, value):
+    text = SCENE_CFG.replace('title: One', 'title: One\nquantize: ' + value)
+
+    with pytest.raises(ConfigError):
+        parse_config(write_config(tmp_path, text))
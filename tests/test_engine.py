@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from midiscenemanager.config import parse_config
+from midiscenemanager.engine import SceneEngine
+from midiscenemanager.headless import CommandHandler, main, make_server
+from midiscenemanager.sequencer import SequencerThread
+
+SCENE_CFG = """\
+[ports]
+synth2: Synth 2
+
+[global]
+default_panel: main
+
+[panel:main]
+title: Main
+scenes: one two
+
+[scene:one]
+on_enter: program_change program=1
+on_exit: all_notes_off
+
+[scene:two]
+on_enter: program_change program=2
+
+[scene:three]
+on_enter:
+    program_change program=3
+    program_change program=4 port=synth2
+"""
+
+
+class RecordingMidi(object):
+    name = 'out'
+
+    def __init__(self, midi=None):
+        self.midi = midi
+        self.sent = []
+        self.ticks = []
+        self.tags = []
+        self.cancelled = []
+
+    def send_messages(self, messages, tick=None, force=False, tag=None):
+        self.sent.extend(msg for delta, msg in messages)
+        self.ticks.append(tick)
+        self.tags.append(tag)
+
+    def cancel(self, tag):
+        self.cancelled.append(tag)
+        return True
+
+
+@pytest.fixture
+def engine(tmpdir):
+    cfg = tmpdir.join('scenes.cfg')
+    cfg.write(SCENE_CFG)
+    return SceneEngine(parse_config(str(cfg), cache=False), RecordingMidi(),
+                       ports={'synth2': RecordingMidi()})
+
+
+def test_enter_exits_previous_scene(engine):
+    events = []
+    engine.add_listener(lambda *args: events.append(args))
+    engine.enter('one')
+    engine.enter('two')
+    assert engine.current_scene == 'two'
+    assert engine.midi.sent == [b'\xC0\x01', b'\xB0\x7B\x00', b'\xC0\x02']
+    assert events == [('enter', 'one'), ('exit', 'one'), ('enter', 'two')]
+
+
+def test_enter_current_scene_does_nothing(engine):
+    engine.enter('one')
+    engine.enter('one')
+    assert engine.midi.sent == [b'\xC0\x01']
+
+
+def test_force_resends_current_scene(engine):
+    engine.enter('one')
+    engine.enter('one', force=True)
+    assert engine.midi.sent == [b'\xC0\x01', b'\xC0\x01']
+
+
+def test_toggle(engine):
+    assert engine.toggle('one') == 'one'
+    assert engine.toggle('one') is None
+    assert engine.midi.sent == [b'\xC0\x01', b'\xB0\x7B\x00']
+
+
+def test_messages_sent_to_port_of_command(engine):
+    engine.enter('three')
+    assert engine.midi.sent == [b'\xC0\x03']
+    assert engine.ports['synth2'].sent == [b'\xC0\x04']
+
+
+def test_messages_for_closed_port_dropped(engine):
+    engine.ports = {}
+    engine.enter('three')
+    assert engine.midi.sent == [b'\xC0\x03']
+
+
+def test_enter_unknown_scene(engine):
+    with pytest.raises(KeyError):
+        engine.enter('four')
+
+    assert engine.current_scene is None
+
+
+def test_command_handler(engine):
+    handler = CommandHandler(engine)
+    assert handler('list\n') == 'OK one two three'
+    assert handler('one\n') == 'OK one'
+    assert handler('enter two') == 'OK two'
+    assert handler('toggle two') == 'OK '
+    assert handler('current') == 'OK '
+    assert handler('four').startswith('ERR')
+    assert handler('enter').startswith('ERR')
+
+
+def test_switch_sends_compiled_transition(engine):
+    engine.scenes['one'] = engine.scenes['one']._replace(
+        on_exit=((None, ((0, b'\xC0\x00'), (1, b'\xB0\x7B\x00'))),))
+    engine.enter('one')
+    engine.enter('two')
+    # the program change on exit is overridden by the one on enter
+    assert engine.midi.sent == [b'\xC0\x01', b'\xB0\x7B\x00', b'\xC0\x02']
+    assert engine.midi.tags == [1, None, 2]
+
+
+def test_scene_change_cancels_pending_messages_of_scene(engine):
+    engine.enter('one')
+    engine.enter('two')
+    engine.enter('two', force=True)
+    engine.enter('one')
+    engine.exit()
+    engine.enter('three')
+    # 'on_exit' messages sent by exit() or in a transition have no tag
+    assert engine.midi.tags == [1, None, 2, 3, 4, None, 5]
+    assert engine.midi.cancelled == [1, 2, 3, 4]
+    assert engine.ports['synth2'].cancelled == [1, 2, 3, 4]
+    assert engine.ports['synth2'].tags == [5]
+    assert engine.current_tag == 5
+
+
+def test_quick_switch_keeps_on_exit_messages_of_transition(tmpdir):
+    cfg = tmpdir.join('scenes.cfg')
+    cfg.write(SCENE_CFG + """
+[scene:four]
+on_enter: note_on note=60
+on_exit: note_off note=60 delay=480
+""")
+    engine = SceneEngine(parse_config(str(cfg), cache=False), RecordingMidi())
+    engine.enter('four')
+    engine.enter('two')
+    engine.enter('one')
+    # the delayed note off is sent without tag, so switching on does not cancel it
+    assert engine.midi.sent == [b'\x90\x3C\x7F', b'\x80\x3C\x00', b'\xC0\x02',
+                                b'\xC0\x01']
+    assert engine.midi.tags == [1, None, 2, 3]
+    assert engine.midi.cancelled == [1, 2]
+
+
+def test_switch_with_different_quantize_exits_first(tmpdir):
+    cfg = tmpdir.join('scenes.cfg')
+    cfg.write(SCENE_CFG.replace('[scene:one]', '[scene:one]\nquantize: bar'))
+    engine = SceneEngine(parse_config(str(cfg), cache=False), RecordingMidi())
+    engine._grid_time = lambda quantize: quantize
+    engine._send_at = lambda commands, when=None, force=False, tag=None: sent.append(
+        (when, [msg for port, messages in commands for delta, msg in messages]))
+    sent = []
+    engine.enter('one')
+    engine.enter('two')
+    # the 'on_exit' messages of scene one are quantized like with exit()
+    assert sent == [('bar', [b'\xC0\x01']), ('bar', [b'\xB0\x7B\x00']), (None, [b'\xC0\x02'])]
+
+
+def test_quantize_aligns_outputs(tmpdir):
+    now = [0]
+    clock = lambda: now[0]
+    # 120 bpm, 480 ppqn: one tick lasts 1/960 s
+    default = SequencerThread(None, clock=clock)
+    default._start_clock()
+    now[0] = 10 ** 8
+    other = SequencerThread(None, clock=clock)
+    other._start_clock()
+    now[0] = 2 * 10 ** 8
+    cfg = tmpdir.join('scenes.cfg')
+    cfg.write(SCENE_CFG.replace('[scene:three]', '[scene:three]\nquantize: beat'))
+    engine = SceneEngine(parse_config(str(cfg), cache=False), RecordingMidi(default),
+                         ports={'synth2': RecordingMidi(other)})
+    engine.enter('three')
+    assert engine.midi.ticks == [480]
+    tick, = engine.ports['synth2'].ticks
+    # next beat of the default output, not of the other one's own grid
+    assert tick == 384
+    assert abs(other.tick_to_time(tick) - default.tick_to_time(480)) < 10 ** 6
+
+
+def test_quantize_with_output_not_started(tmpdir):
+    now = [10 ** 8]
+    clock = lambda: now[0]
+    default = SequencerThread(None, clock=clock)
+    other = SequencerThread(None, clock=clock)
+    cfg = tmpdir.join('scenes.cfg')
+    cfg.write(SCENE_CFG.replace('[scene:three]', '[scene:three]\nquantize: beat'))
+    engine = SceneEngine(parse_config(str(cfg), cache=False), RecordingMidi(default),
+                         ports={'synth2': RecordingMidi(other)})
+    # no sequencer started: send now
+    engine.enter('three')
+    assert engine.midi.ticks == [None]
+    assert engine.ports['synth2'].ticks == [None]
+
+    # grid of the first started output
+    other._start_clock()
+    now[0] += 2 * 10 ** 8
+    engine.exit()
+    engine.enter('three')
+    assert engine.midi.ticks == [None, None]
+    assert engine.ports['synth2'].ticks == [None, 480]
+
+
+def test_headless_unix_socket_not_supported(tmpdir, mocker):
+    cfg = tmpdir.join('scenes.cfg')
+    cfg.write(SCENE_CFG.split('[scene:three]')[0].replace('[ports]\nsynth2: Synth 2\n', ''))
+    mocker.patch('midiscenemanager.headless.socketserver', spec=['StreamRequestHandler'])
+
+    with pytest.raises(ValueError):
+        make_server(str(tmpdir.join('socket')), None)
+
+    error = main(['--no-stdin', '--listen', str(tmpdir.join('socket')), str(cfg)])
+    assert error.startswith("Could not listen on")
+
+
+class FakeListener(object):
+    name = 'in'
+
+    def close(self):
+        self.closed = True
+
+    def latency_stats(self):
+        return None
+
+
+def test_headless_keeps_running_for_midi_input(tmpdir, mocker):
+    cfg = tmpdir.join('scenes.cfg')
+    cfg.write(SCENE_CFG.split('[scene:three]')[0].replace('[ports]\nsynth2: Synth 2\n', ''))
+    listener = FakeListener()
+    mocker.patch('midiscenemanager.midiio.get_midiin', return_value=listener)
+    timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM))
+    start = time.perf_counter()
+    timer.start()
+
+    try:
+        assert main(['--no-stdin', '--input', '0', str(cfg)]) is None
+    finally:
+        timer.cancel()
+
+    # runs until SIGTERM, not until the end of the input
+    assert time.perf_counter() - start >= 0.2
+    assert listener.closed
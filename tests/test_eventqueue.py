@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+from math import ceil
+
+import pytest
+
+from midiscenemanager.eventqueue import EventHeap, TimingWheel
+
+
+@pytest.fixture(params=['heap', 'wheel', 'small-wheel'])
+def store(request):
+    if request.param == 'heap':
+        return EventHeap()
+    elif request.param == 'wheel':
+        return TimingWheel()
+    else:
+        # tiny wheel, so events go through all levels and the overflow heap
+        return TimingWheel(bits=2, levels=2)
+
+
+def test_empty(store):
+    assert len(store) == 0
+    assert store.next_tick() is None
+    assert store.pop_due(1000) == []
+
+
+def test_pop_due_sorted(store):
+    store.extend([(5, 0, 'a'), (1, 1, 'b'), (5, 2, 'c')])
+    store.push((3, 3, 'd'))
+    store.push((100, 4, 'e'))
+    assert len(store) == 5
+    assert store.next_tick() == 1
+    assert store.pop_due(5) == [(1, 1, 'b'), (3, 3, 'd'), (5, 0, 'a'), (5, 2, 'c')]
+    assert store.next_tick() == 100
+    assert store.pop_due(99) == []
+    assert store.pop_due(100) == [(100, 4, 'e')]
+    assert len(store) == 0
+
+
+def test_late_events_are_due_immediately(store):
+    store.pop_due(50)
+    store.push((10, 0, 'late'))
+    assert store.next_tick() == 10
+    assert store.pop_due(50) == [(10, 0, 'late')]
+
+
+def test_matches_reference(store):
+    rnd = random.Random(1)
+    reference = []
+    seq = 0
+    now = 0
+
+    for step in range(300):
+        for i in range(rnd.randint(0, 10)):
+            tick = now + rnd.choice([0, 1, 10, 100, 1000, 100000]) * rnd.randint(0, 5)
+            reference.append((tick, seq, None))
+            store.push(reference[-1])
+            seq += 1
+
+        assert len(store) == len(reference)
+
+        if reference:
+            assert store.next_tick() == min(reference)[0]
+
+        now += rnd.choice([0, 1, 3, 50, 500, 50000])
+        due = sorted(evt for evt in reference if evt[0] <= now)
+        reference = [evt for evt in reference if evt[0] > now]
+        assert store.pop_due(now) == due
+
+
+def test_sparse_events_expire_in_order(store):
+    # like the sequencer: wait for the next tick, then pop the due events
+    rnd = random.Random(2)
+    events = sorted((rnd.randrange(10 ** 6), seq, None) for seq in range(200))
+    store.extend(events)
+    expired = []
+
+    while len(store):
+        tick = store.next_tick()
+        due = store.pop_due(tick)
+        assert due and all(evt[0] == tick for evt in due)
+        expired.extend(due)
+
+    assert expired == events
+
+
+def test_wheel_rounds_fractional_ticks_up():
+    wheel = TimingWheel()
+    wheel.push((10.5, 0, None))
+    assert wheel.pop_due(10.9) == []
+    assert wheel.next_tick() == ceil(10.5)
+    assert wheel.pop_due(11) == [(10.5, 0, None)]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+
+from midiscenemanager.metrics import Histogram, SequencerMetrics
+
+
+def test_empty_histogram():
+    hist = Histogram()
+    assert hist.percentile(50) is None
+    assert hist.summary()['count'] == 0
+
+
+@pytest.mark.parametrize('sub_bits', [2, 5])
+def test_histogram_relative_error(sub_bits):
+    hist = Histogram(sub_bits=sub_bits)
+    rnd = random.Random(42)
+    values = sorted(int(rnd.expovariate(1e-6)) for i in range(10000))
+
+    for value in values:
+        hist.record(value)
+
+    assert hist.count == len(values)
+    assert hist.min == values[0]
+    assert hist.max == values[-1]
+
+    for percent in (1, 50, 90, 99, 99.9):
+        exact = values[int(len(values) * percent / 100.) - 1]
+        assert abs(hist.percentile(percent) - exact) <= exact * 2 ** -sub_bits + 1
+
+
+def test_histogram_clamps_values():
+    hist = Histogram(max_bits=10)
+    hist.record(-5)
+    hist.record(1 << 20)
+    assert hist.min == 0
+    assert hist.percentile(100) == 1 << 20
+
+
+def test_sequencer_metrics_batches():
+    metrics = SequencerMetrics()
+    metrics.record_batch(3, 10)
+    metrics.record_batch(1, 2)
+    snapshot = metrics.snapshot()
+    assert snapshot['events'] == 4
+    assert snapshot['batches'] == 2
+    assert snapshot['pending'] == 2
+    assert snapshot['max_pending'] == 10
+    assert snapshot['max_batch'] == 3
+    assert 'events 4' in metrics.format()
+    metrics.reset()
+    assert metrics.snapshot()['events'] == 0
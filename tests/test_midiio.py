@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import pytest
+
+from midiscenemanager import commands, midiio
+from midiscenemanager.midiio import MidiInputListener, MidiOutPool, MidiOutWrapper, StateCache
+
+from helpers import RecordingMidiOut
+
+TRIGGERS = {b'\xcf\x02': 'two', b'\x99\x24': 'drums'}
+
+
+class FakeMidiIn(object):
+    def set_callback(self, func):
+        self.callback = func
+
+
+class FakeSequencer(object):
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callback(self, func):
+        self.callbacks.append(func)
+
+
+class FakeMidiOut(object):
+    def __init__(self):
+        self.midi = FakeSequencer()
+
+
+def test_listener_triggers_scenes():
+    midiin = FakeMidiIn()
+    scenes = []
+    MidiInputListener(midiin, 'in', TRIGGERS, scenes.append)
+    midiin.callback(([0xCF, 2], 0.0))
+    midiin.callback(([0xCF, 3], 0.0))
+    midiin.callback(([0x99, 36, 100], 0.0))
+    # 'Note On' with velocity 0 is a 'Note Off'
+    midiin.callback(([0x99, 36, 0], 0.0))
+    midiin.callback(([0xF8], 0.0))
+    assert scenes == ['two', 'drums']
+
+
+def test_listener_measures_latency():
+    midiin = FakeMidiIn()
+    midiout = FakeMidiOut()
+    listener = MidiInputListener(midiin, 'in', TRIGGERS, lambda scene: None, midiout=midiout)
+    assert listener.latency_stats() is None
+
+    midiin.callback(([0xCF, 2], 0.0))
+    assert len(midiout.midi.callbacks) == 1
+    # called by the sequencer thread after sending the scene's messages
+    midiout.midi.callbacks[0]()
+    stats = listener.latency_stats()
+    assert stats['count'] == 1
+    assert 0 <= stats['min'] == stats['max'] < 1000
+
+
+class NullMidiOut(object):
+    def send_message(self, message):
+        pass
+
+    def close_port(self):
+        pass
+
+
+@pytest.fixture
+def wrapper():
+    wrapper = MidiOutWrapper(NullMidiOut(), 'out')
+    yield wrapper
+    wrapper._cleanup()
+
+
+def test_sysex_sent_unchanged_by_default(wrapper):
+    messages = [(0, b'\xF0\x01\x02\x03\xF7')]
+    wrapper.midi.add_timed = lambda events, tick, tag=None: sent.extend(events)
+    sent = []
+    wrapper.send_messages(messages)
+    assert sent == messages
+
+
+def test_sysex_chunked_and_paced(wrapper):
+    # 120 bpm, 480 ppqn = 960 ticks/sec, 960 bytes/sec = 1 tick/byte
+    wrapper.sysex_chunk_size = 4
+    wrapper.sysex_rate = 960
+    messages = [
+        (0, b'\xF0\x01\x02\x03\x04\x05\xF7'),
+        (1, b'\xC0\x05'),
+        (2, b'\xF0\x06\xF7'),
+    ]
+    paced, chunks = wrapper._pace_sysex(messages, 100)
+    assert paced == [
+        (0, b'\xF0\x01\x02\x03'),
+        (4, b'\x04\x05\xF7'),
+        # other messages are not delayed
+        (1, b'\xC0\x05'),
+        # next sysex waits until the previous one is transferred
+        (7, b'\xF0\x06\xF7'),
+    ]
+    assert chunks == {0, 1}
+    # and so does a sysex sent later
+    assert wrapper._pace_sysex([(0, b'\xF0\x07\xF7')], 105) == ([(5, b'\xF0\x07\xF7')], set())
+
+
+def test_state_cache_drops_redundant_messages():
+    cache = StateCache()
+    scene = [(0, b'\xB0\x00\x01'), (0, b'\xC0\x05'), (1, b'\xB0\x07\x64'), (2, b'\xE0\x00\x40')]
+    assert cache.filter(scene) == scene
+    assert cache.filter(scene) == []
+    # other channel and other values go through
+    assert cache.filter([(0, b'\xB1\x07\x64'), (0, b'\xB0\x07\x65')]) == [
+        (0, b'\xB1\x07\x64'), (0, b'\xB0\x07\x65')]
+    assert cache.filter(scene, force=True) == scene
+
+
+def test_state_cache_bank_change_resends_program():
+    cache = StateCache()
+    cache.filter([(0, b'\xB0\x00\x01'), (0, b'\xC0\x05')])
+    messages = [(0, b'\xB0\x00\x02'), (0, b'\xC0\x05')]
+    assert cache.filter(messages) == messages
+
+
+def test_state_cache_never_drops_actions():
+    cache = StateCache()
+    messages = [(0, b'\xB0\x7B\x00'), (0, b'\xB0\x06\x10'), (0, b'\xF0\x01\xF7')]
+    cache.filter(messages)
+    assert cache.filter(messages) == messages
+
+
+def test_state_cache_reset():
+    cache = StateCache()
+    messages = [(0, b'\xB0\x07\x64'), (0, b'\xB1\x07\x64'), (0, b'\xC0\x05')]
+    cache.filter(messages)
+    # 'Reset All Controllers' on channel 1
+    cache.filter([(0, b'\xB0\x79\x00')])
+    assert cache.filter(messages) == [(0, b'\xB0\x07\x64')]
+    cache.filter([(0, b'\xF0\x01\xF7')])
+    assert cache.filter(messages) == messages
+
+
+def test_state_cache_reset_clears_pitch_bend():
+    cache = StateCache()
+    bend = [(0, b'\xE0\x00\x50')]
+    assert cache.filter(bend) == bend
+    cache.filter([(0, b'\xB0\x79\x00')])
+    assert cache.filter(bend) == bend
+
+
+def test_wrapper_state_invalidated_on_reconnect(wrapper):
+    wrapper.state_cache = True
+    sent = []
+    wrapper.midi.add_timed = lambda events, tick, tag=None: sent.extend(events)
+    wrapper.send_program_change(5)
+    wrapper.send_program_change(5)
+    assert len(sent) == 1
+    wrapper.midi = NullMidiOut()
+    wrapper.send_program_change(5)
+    assert len(sent) == 2
+
+
+def test_wrapper_cancel_clears_state_only_if_pending(wrapper):
+    wrapper.state_cache = True
+    wrapper.midi.stop()
+    wrapper.send_messages([(0, b'\xC0\x05')], tag=1)
+    wrapper.send_messages([(0, b'\xC0\x06'), (1000, b'\xB0\x07\x64')], tick=0, tag=2)
+    wrapper.midi.clock = lambda: wrapper.midi.tick_to_time(500)
+    # the message with tag 1 has been sent, so the state is kept
+    assert not wrapper.cancel(1)
+    assert wrapper.state.filter([(0, b'\xC0\x06')]) == []
+    assert wrapper.cancel(2)
+    assert wrapper.midi._cancelled
+    assert wrapper.state.filter([(0, b'\xB0\x07\x64')]) == [(0, b'\xB0\x07\x64')]
+    # unknown tags
+    assert not wrapper.cancel(2)
+
+
+def test_chunked_sysex_not_cancelled(wrapper):
+    wrapper.sysex_chunk_size = 4
+    wrapper.midi.stop()
+    wrapper.send_messages([(10, b'\xF0\x01\x02\x03\x04\x05\xF7'), (20, b'\xF0\x06\xF7'),
+                           (2000, b'\xC0\x05')], tag=1)
+    queue = sorted(wrapper.midi.queue)
+    # only the chunks are untagged
+    assert [len(evt) for evt in queue] == [3, 3, 4, 4]
+    assert wrapper.cancel(1)
+    queue = wrapper.midi._drop_cancelled(queue)
+    assert [evt[2] for evt in queue] == [b'\xF0\x01\x02\x03', b'\x04\x05\xF7']
+
+
+def test_swap_hands_pending_events_to_new_output(wrapper):
+    threads = threading.active_count()
+    old, new = RecordingMidiOut(), RecordingMidiOut()
+    wrapper.swap(old, 'old')
+    sequencer = wrapper.midi
+    wrapper.send_program_change(1)
+    # about 50 ms from now
+    tick = wrapper.send_program_change(2, delay=48)
+    time.sleep(0.01)
+    wrapper.swap(new, 'new')
+
+    while wrapper.midi.tick <= tick + 10:
+        time.sleep(0.01)
+
+    assert old.messages == [b'\xC0\x01']
+    assert old.closed
+    assert new.messages == [b'\xC0\x02']
+    assert wrapper.name == 'new'
+    assert wrapper.midi is sequencer
+    assert threading.active_count() == threads
+
+
+def test_pool_reopens_output_on_port_change(monkeypatch):
+    ports = []
+
+    def open_midiout(port, api="UNSPECIFIED"):
+        ports.append(RecordingMidiOut())
+        return ports[-1], 'port %s' % port
+
+    monkeypatch.setattr(midiio, 'open_midiout', open_midiout)
+    pool = MidiOutPool()
+
+    try:
+        assert pool.open({'synth': 1}) == {}
+        output = pool.get('synth')
+        assert pool.open({'synth': 2}) == {}
+        assert pool.get('synth') is output
+        assert output.name == 'port 2'
+        assert output.midi.midiout is ports[1]
+        assert ports[0].closed
+    finally:
+        pool.close()
+
+    assert not output.midi.is_alive()
+
+
+def test_message_table_reuses_messages():
+    table = commands.MessageTable()
+    msg = table.get(0xB0, 11, 100, ch=2)
+    assert msg == b'\xB1\x0B\x64'
+    assert table.get(0xB0, 11, 100, ch=2) is msg
+    assert table.get(0xC0, 5, ch=16) == b'\xCF\x05'
+
+    for args in ((0xB0, 128, 0), (0xB0, 0, -1), (0xF0, 0, 0), (0xB0, 0, 0, 0)):
+        with pytest.raises(ValueError):
+            table.get(*args)
+
+
+def test_fast_path_messages(wrapper):
+    sent = []
+    wrapper.midi.add = lambda msg, tick, delta: sent.append(msg)
+    wrapper.send_control_change(7, 100, ch=3)
+    wrapper.send_program_change(10)
+    wrapper.send_pitch_bend(0x2001)
+    wrapper.send_channel_message(0x93, 60, 1)
+    wrapper.send_local_control(False)
+    assert sent == [b'\xB2\x07\x64', b'\xC0\x0A', b'\xE0\x01\x40', b'\x90\x3C\x01',
+                    b'\xB0\x7A\x00']
+
+    with pytest.raises(ValueError):
+        wrapper.send_pitch_bend(16384)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import types
+
+import pytest
+
+from midiscenemanager import portregistry
+from midiscenemanager.portregistry import PortRegistry
+
+
+class FakeClient(object):
+    ports = []
+    created = 0
+
+    def __init__(self, rtapi=0):
+        FakeClient.created += 1
+        self.port = None
+
+    def get_ports(self):
+        return list(self.ports)
+
+    def get_port_name(self, number):
+        return self.ports[number] if number < len(self.ports) else None
+
+    def open_port(self, number):
+        self.port = number
+
+    def delete(self):
+        pass
+
+
+class FakeMidiOut(FakeClient):
+    ports = ['Synth A', 'Synth B']
+
+
+class FakeMidiIn(FakeClient):
+    ports = ['Keyboard']
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    fake = types.SimpleNamespace(API_UNSPECIFIED=0, MidiOut=FakeMidiOut, MidiIn=FakeMidiIn,
+                                 InvalidPortError=ValueError)
+    monkeypatch.setattr(portregistry, 'rtmidi', fake)
+    monkeypatch.setattr(FakeMidiOut, 'ports', ['Synth A', 'Synth B'])
+    monkeypatch.setattr(FakeClient, 'created', 0)
+    return PortRegistry()
+
+
+def test_ports_enumerated_once(registry):
+    assert registry.outputs() == ['Synth A', 'Synth B']
+    assert registry.inputs() == ['Keyboard']
+    assert registry.outputs() == ['Synth A', 'Synth B']
+    # one client per direction
+    assert FakeClient.created == 2
+
+
+def test_refresh_notifies_listeners(registry):
+    changes = []
+    registry.add_listener(lambda outputs, inputs: changes.append(outputs))
+    registry.outputs()
+    assert not registry.refresh()
+    FakeMidiOut.ports = ['Synth A', 'Synth B', 'Synth C']
+    assert registry.refresh()
+    assert changes == [['Synth A', 'Synth B'], ['Synth A', 'Synth B', 'Synth C']]
+
+
+@pytest.mark.parametrize('port,number', [(1, 1), ('1', 1), ('Synth B', 1), ('A', 0)])
+def test_open_output(registry, port, number):
+    midiout, name = registry.open_output(port)
+    assert midiout.port == number
+    assert name == FakeMidiOut.ports[number]
+
+
+def test_open_refreshes_stale_list(registry):
+    registry.outputs()
+    FakeMidiOut.ports = ['Synth B', 'Synth C']
+    # port number changed since the list was cached
+    midiout, name = registry.open_output('Synth B')
+    assert (midiout.port, name) == (0, 'Synth B')
+    midiout, name = registry.open_output('Synth C')
+    assert (midiout.port, name) == (1, 'Synth C')
+
+
+def test_open_unknown_port(registry):
+    with pytest.raises(ValueError):
+        registry.open_output('Drum Machine')
+
+    with pytest.raises(ValueError):
+        registry.open_input(1)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from midiscenemanager import commands
+from midiscenemanager.midiio import MidiOutWrapper, StateCache
+from midiscenemanager.ramps import RampEvent, bind_ramps
+from midiscenemanager.sequencer import SequencerThread
+from midiscenemanager.transitions import reduce_messages
+
+from helpers import FakeClock, RecordingMidiOut
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def fakeseq(clock):
+    seq = SequencerThread(RecordingMidiOut(), bpm=120, ppqn=480, clock=clock)
+    seq._start_clock()
+    return seq
+
+
+def run_ramp(seq, clock, spec, tick=0):
+    """Run ramp on the fake clock, return list of (tick, message) and max. pending events."""
+    seq.add_timed(bind_ramps(((0, spec),), seq, tick), tick=tick)
+    sent = seq.midiout.sent
+    result = []
+    max_pending = 0
+
+    while True:
+        count = len(sent)
+        deadline = seq._process(clock.now)
+        result.extend((seq.tick, msg) for _, msg in sent[count:])
+        max_pending = max(max_pending, len(seq._pending))
+
+        if deadline is None:
+            return result, max_pending
+
+        clock.now = seq.tick_to_time(deadline)
+
+
+def test_cc_ramp_generated_lazily(fakeseq, clock):
+    spec, = commands.cc_ramp(cc=7, start=0, end=100, duration=1000, interval=10, ch=2)
+    sent, max_pending = run_ramp(fakeseq, clock, spec)
+    assert max_pending == 1
+    assert sent[0] == (0, b'\xb1\x07\x00')
+    assert sent[-1] == (1000, b'\xb1\x07\x64')
+    assert len(sent) == 101
+    assert [tick for tick, _ in sent] == list(range(0, 1001, 10))
+
+
+def test_unchanged_values_thinned(fakeseq, clock):
+    spec, = commands.cc_ramp(cc=1, start=10, end=13, duration=960, interval=1)
+    sent, _ = run_ramp(fakeseq, clock, spec, tick=100)
+    assert [msg[2] for _, msg in sent] == [10, 11, 12, 13]
+    assert [tick for tick, _ in sent] == [100, 260, 580, 900]
+
+
+def test_long_flat_ramp_sent_once(fakeseq, clock):
+    spec, = commands.cc_ramp(cc=7, start=64, end=64, duration=10 ** 8, interval=1)
+    sent, _ = run_ramp(fakeseq, clock, spec)
+    assert sent == [(0, b'\xb0\x07\x40')]
+
+
+def test_long_ramp_with_few_values(fakeseq, clock):
+    spec, = commands.cc_ramp(cc=7, start=3, end=0, duration=6 * 10 ** 6, interval=1)
+    sent, _ = run_ramp(fakeseq, clock, spec)
+    assert sent == [(0, b'\xb0\x07\x03'), (1000001, b'\xb0\x07\x02'),
+                    (3000001, b'\xb0\x07\x01'), (5000001, b'\xb0\x07\x00')]
+
+
+def test_next_step_matches_stepwise_thinning():
+    for start, end, duration, interval in ((0, 127, 1000, 7), (100, 3, 999, 1), (5, 6, 10, 3),
+                                           (0, 16383, 4000, 1), (127, 0, 25, 10)):
+        ramp = RampEvent(SequencerThread(None), (0xB0, (7,), start, end, duration, interval), 0)
+        step = 0
+
+        while step <= ramp.steps:
+            value = ramp.value(step)
+            expected = step + 1
+
+            while expected <= ramp.steps and ramp.value(expected) == value:
+                expected += 1
+
+            assert ramp.next_step(step, value) == expected
+            step = expected
+
+
+def test_downward_ramp_ends_at_end_value(fakeseq, clock):
+    spec, = commands.cc_ramp(cc=7, start=127, end=0, duration=25, interval=10)
+    sent, _ = run_ramp(fakeseq, clock, spec)
+    assert sent == [(0, b'\xb0\x07\x7f'), (10, b'\xb0\x07\x4c'), (20, b'\xb0\x07\x19'),
+                    (25, b'\xb0\x07\x00')]
+
+
+def test_zero_duration_sends_end_value(fakeseq, clock):
+    spec, = commands.cc_ramp(cc=7, start=0, end=90, duration=0)
+    assert run_ramp(fakeseq, clock, spec)[0] == [(0, b'\xb0\x07\x5a')]
+
+
+def test_pitch_bend_ramp(fakeseq, clock):
+    spec, = commands.pitch_bend_ramp(start=8192, end=16383, duration=20, interval=10, ch=3)
+    sent, _ = run_ramp(fakeseq, clock, spec)
+    assert sent == [(0, b'\xe2\x00\x40'), (10, b'\xe2\x00\x60'), (20, b'\xe2\x7f\x7f')]
+
+
+def test_cc14_ramp_sends_msb_only_when_changed(fakeseq, clock):
+    spec, = commands.cc14_ramp(cc=1, start=126, end=130, duration=4, interval=1)
+    sent, _ = run_ramp(fakeseq, clock, spec)
+    assert [msg for _, msg in sent] == [
+        b'\xb0\x01\x00', b'\xb0\x21\x7e',
+        b'\xb0\x21\x7f',
+        b'\xb0\x01\x01', b'\xb0\x21\x00',
+        b'\xb0\x21\x01',
+        b'\xb0\x21\x02',
+    ]
+
+
+@pytest.mark.parametrize('args', [
+    dict(cc=128),
+    dict(end=128),
+    dict(duration=-1),
+    dict(interval=0),
+    dict(ch=17),
+])
+def test_invalid_ramp_arguments(args):
+    with pytest.raises(ValueError):
+        commands.cc_ramp(**args)
+
+
+def test_ramp_command_from_to_arguments():
+    assert commands.compile_command('cc_ramp', {'cc': 74, 'from': 0, 'to': 64,
+                                                'duration': 960, 'delay': 5}) == (
+        (5, (0xB0, (74,), 0, 64, 960, commands.RAMP_INTERVAL)),)
+
+    with pytest.raises(ValueError):
+        commands.compile_command('cc14_ramp', {'cc': 32})
+
+
+def test_wrapper_sends_ramp_with_state_cache():
+    wrapper = MidiOutWrapper(RecordingMidiOut(), 'out', state_cache=True)
+    wrapper.midi.stop()
+    wrapper.send_channel_volume(100)
+    end = wrapper.send_cc_ramp(cc=7, start=100, end=0, duration=480, delay=10)
+    assert end == wrapper.midi.queue[1][0] + 480
+    # the ramp has changed the controller, so setting it again is not redundant
+    wrapper.send_channel_volume(100)
+    assert len(wrapper.midi.queue) == 3
+    assert callable(wrapper.midi.queue[1][2])
+
+
+def test_state_cache_passes_ramps():
+    cache = StateCache()
+    ramp = (0, commands.cc_ramp(cc=7, start=127, end=127)[0])
+    messages = [(0, b'\xb0\x07\x7f'), ramp, ramp, (0, b'\xb0\x07\x7f')]
+    assert cache.filter(messages) == messages
+
+
+def test_transition_keeps_ramps():
+    ramp = commands.cc_ramp(cc=7, start=0, end=100)[0]
+    messages = ((0, b'\xb0\x07\x00'), (0, ramp), (1, b'\xb0\x07\x64'))
+    assert reduce_messages(messages) == messages
+
+
+def test_cancel_stops_running_ramp(fakeseq, clock):
+    spec, = commands.cc_ramp(cc=7, start=0, end=100, duration=1000, interval=10)
+    fakeseq.add_timed(bind_ramps(((0, spec),), fakeseq, 0, tag='scene'), tick=0, tag='scene')
+    clock.now = fakeseq.tick_to_time(95)
+
+    while fakeseq._process(clock.now) <= 95:
+        pass
+
+    assert len(fakeseq.midiout.sent) == 10
+    fakeseq.cancel('scene')
+    assert fakeseq._process(fakeseq.tick_to_time(2000)) is None
+    assert len(fakeseq.midiout.sent) == 10
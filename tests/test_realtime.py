@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from midiscenemanager import realtime
+from midiscenemanager.realtime import apply_realtime, parse_cpus
+from midiscenemanager.sequencer import SequencerThread
+
+from helpers import RecordingMidiOut
+
+needs_sched = pytest.mark.skipif(not hasattr(os, 'sched_setscheduler'),
+                                 reason="needs os.sched_setscheduler")
+
+
+def test_parse_cpus():
+    assert parse_cpus('') is None
+    assert parse_cpus('1') == {1}
+    assert parse_cpus('0, 2-4') == {0, 2, 3, 4}
+
+    with pytest.raises(ValueError):
+        parse_cpus('a-b')
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        apply_realtime('deadline')
+
+
+@needs_sched
+def test_falls_back_without_permission(monkeypatch):
+    def setscheduler(pid, policy, param):
+        raise PermissionError(1, "Operation not permitted")
+
+    monkeypatch.setattr(os, 'sched_setscheduler', setscheduler)
+    monkeypatch.setattr(realtime, '_lock_memory', lambda: False)
+    effective = apply_realtime('fifo', 99, lock_memory=True)
+    assert effective['policy'] == 'other'
+    assert effective['priority'] == 0
+    assert effective['memory_locked'] is False
+
+
+@pytest.mark.slow
+@needs_sched
+def test_lateness_under_cpu_hog():
+    # keep the CPU the sequencer is pinned to busy with a process of normal priority
+    cpu = min(os.sched_getaffinity(0))
+    hogs = [subprocess.Popen([sys.executable, '-c', 'while True: pass'],
+                             preexec_fn=lambda: os.sched_setaffinity(0, {cpu}))]
+    seq = SequencerThread(RecordingMidiOut(), bpm=120, ppqn=480, sched_policy='fifo',
+                          cpus={cpu})
+
+    try:
+        time.sleep(0.1)
+        seq.start()
+
+        while seq.realtime is None:
+            time.sleep(0.001)
+
+        count = 200
+        # one message every 2 ms
+        ticks = [seq.tick + 20 + i * 2 for i in range(count)]
+        seq.add_many([[0xB0, 7, i % 128] for i in range(count)], tick=0, deltas=ticks)
+        seq.midiout.wait_for(count)
+    finally:
+        seq.stop()
+
+        for hog in hogs:
+            hog.kill()
+            hog.wait()
+
+    assert seq.realtime['policy'] in ('fifo', 'other')
+    sent = seq.midiout.sent
+    assert len(sent) == count
+    lateness = sorted(t - seq.tick_to_time(tick) for (t, msg), tick in zip(sent, ticks))
+    assert lateness[0] >= 0
+    # the median is not affected, even if the real-time policy was not permitted
+    assert lateness[count // 2] < 5 * 10 ** 6
+
+    if seq.realtime['policy'] == 'fifo':
+        # the hogs never preempt a real-time thread
+        assert lateness[count * 99 // 100] < 2 * 10 ** 6
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+import random
+import time
+
+import pytest
+
+from midiscenemanager.eventqueue import TimingWheel
+from midiscenemanager.metrics import SequencerMetrics
+from midiscenemanager.sequencer import MidiEvent, SequencerThread
+
+from helpers import FakeClock, RecordingMidiOut
+
+
+@pytest.fixture
+def midiout():
+    return RecordingMidiOut()
+
+
+@pytest.fixture
+def seq(midiout):
+    seq = SequencerThread(midiout, bpm=120, ppqn=480)
+    yield seq
+    if seq.is_alive():
+        seq.stop()
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def fakeseq(clock):
+    seq = SequencerThread(RecordingMidiOut(clock), bpm=120, ppqn=480, clock=clock)
+    seq._start_clock()
+    return seq
+
+
+def run_fake(seq, clock, max_oversleep=0):
+    """Drive the sequencer loop on a fake clock until no events are left.
+
+    Every sleep overshoots its deadline by a random amount of up to
+    ``max_oversleep`` nanoseconds.
+
+    """
+    rnd = random.Random(42)
+
+    while True:
+        deadline = seq._process(clock.now)
+
+        if deadline is None:
+            break
+
+        clock.now = max(clock.now, seq.tick_to_time(deadline)) + rnd.randint(0, max_oversleep)
+
+
+def test_events_sent_in_tick_order(seq, midiout):
+    seq.add([0x90, 62, 100], tick=48)
+    seq.add([0x90, 60, 100], tick=0)
+    seq.add([0x90, 61, 100], tick=24)
+    seq.start()
+    time.sleep(0.2)
+    assert [msg for _, msg in midiout.sent] == [
+        [0x90, 60, 100], [0x90, 61, 100], [0x90, 62, 100]]
+
+
+def test_sleeps_until_deadline(seq, midiout):
+    seq.start()
+    wakeups = []
+    wait = seq._wakeup.wait
+
+    def counting_wait(timeout=None):
+        wakeups.append(timeout)
+        return wait(timeout)
+
+    seq._wakeup.wait = counting_wait
+    # one beat = 0.5 s at 120 bpm
+    tick = seq.tick + 480
+    seq.add([0xB0, 7, 100], tick=tick)
+    time.sleep(0.7)
+    assert len(midiout.sent) == 1
+    # Far fewer wake-ups than ticks elapsed (~670)
+    assert len(wakeups) < 10
+    assert abs(midiout.sent[0][0] - seq.tick_to_time(tick)) < 5e6
+
+
+def test_add_wakes_up_idle_thread(seq, midiout):
+    seq.start()
+    time.sleep(0.05)
+    start = time.perf_counter_ns()
+    seq.add([0xC0, 5])
+    time.sleep(0.05)
+    assert len(midiout.sent) == 1
+    assert midiout.sent[0][0] - start < 1e7
+
+
+def test_stop_wakes_up_idle_thread(seq):
+    seq.start()
+    start = time.monotonic()
+    seq.stop()
+    assert not seq.is_alive()
+    assert time.monotonic() - start < 1
+
+
+def test_no_drift_with_oversleeping_clock(fakeseq, clock):
+    max_oversleep = 500000  # 0.5 ms
+    ticks = [i * 24 for i in range(2000)]
+
+    for tick in ticks:
+        fakeseq.add([0xB0, 1, tick % 128], tick=tick)
+
+    run_fake(fakeseq, clock, max_oversleep)
+    sent = fakeseq.midiout.sent
+    assert len(sent) == len(ticks)
+    lateness = [t - fakeseq.tick_to_time(tick) for (t, _), tick in zip(sent, ticks)]
+    # Jitter is bounded by a single oversleep and does not accumulate
+    assert min(lateness) >= 0
+    assert max(lateness) <= max_oversleep
+    assert max(lateness[-100:]) <= max_oversleep
+
+
+def test_tempo_change_keeps_tick_position(fakeseq, clock):
+    clock.now = fakeseq.tick_to_time(1000)
+    assert fakeseq.tick == 1000
+    fakeseq.bpm = 60
+    assert fakeseq.tick == 1000
+    # ticks now last twice as long
+    clock.now += int(480 * 6e10 / 60 / 480)
+    assert fakeseq.tick == 1480
+
+
+def test_tempo_change_reschedules_pending_events(fakeseq, clock):
+    fakeseq.add([0x90, 60, 100], tick=480)
+    fakeseq.add([0x90, 62, 100], tick=960)
+    change_time = fakeseq.tick_to_time(720)
+    clock.now = change_time
+    fakeseq._process(clock.now)
+    fakeseq.bpm = 240
+    run_fake(fakeseq, clock)
+    sent = fakeseq.midiout.sent
+    # second event comes 240 ticks at 240 bpm after the tempo change
+    assert sent[1][0] - change_time == pytest.approx(240 * 6e10 / 240 / 480, abs=1)
+
+
+def test_add_does_not_modify_event(fakeseq, clock):
+    event = MidiEvent(10, [0x90, 60, 100])
+    fakeseq.add(event, delta=5)
+    fakeseq.add(event, delta=5)
+    assert event.tick == 10
+    run_fake(fakeseq, clock)
+    assert len(fakeseq.midiout.sent) == 2
+
+
+def test_add_many_deltas(fakeseq, clock):
+    fakeseq.add_many([[0xB0, 7, 0], [0xB0, 7, 64], [0xB0, 7, 127]], tick=100,
+                     deltas=[20, 0, 10])
+    fakeseq.add_many([[0xC0, 1], [0xC0, 2]], tick=100, deltas=5)
+    fakeseq.add_many([[0xC0, 3]], tick=100)
+    run_fake(fakeseq, clock)
+    times = {tuple(msg): t for t, msg in fakeseq.midiout.sent}
+    expected = {(0xB0, 7, 0): 120, (0xB0, 7, 64): 100, (0xB0, 7, 127): 110,
+                (0xC0, 1): 105, (0xC0, 2): 105, (0xC0, 3): 100}
+    assert times == {msg: fakeseq.tick_to_time(tick) for msg, tick in expected.items()}
+
+
+def test_burst_ingested_in_one_iteration(fakeseq, clock):
+    fakeseq.add_many([[0xB0, i % 128, 0] for i in range(500)], deltas=range(500))
+    fakeseq.add_many([[0xF0, 0x7E, 0x7F, 0x06, 0x01, 0xF7]] * 10)
+    fakeseq._process(clock.now)
+    assert not fakeseq.queue
+    assert len(fakeseq._pending) == 499
+    assert len(fakeseq.midiout.sent) == 11
+
+
+def test_same_tick_events_keep_insertion_order(fakeseq, clock):
+    fakeseq.add([0xB0, 0, 1], tick=10)
+    fakeseq.add_many([[0xB0, 32, 2], [0xC0, 3]], tick=10)
+    fakeseq._process(clock.now)
+    fakeseq.add([0xB0, 7, 100], tick=10)
+    clock.now = fakeseq.tick_to_time(10)
+    run_fake(fakeseq, clock)
+    assert [msg for _, msg in fakeseq.midiout.sent] == [
+        [0xB0, 0, 1], [0xB0, 32, 2], [0xC0, 3], [0xB0, 7, 100]]
+
+
+def test_timing_wheel_backend(clock):
+    seq = SequencerThread(RecordingMidiOut(clock), clock=clock, pending=TimingWheel())
+    seq._start_clock()
+    ticks = [(i * 7919) % 100000 for i in range(1000)]
+    seq.add_many([[0xB0, 1, i % 128] for i in range(1000)], tick=0, deltas=ticks)
+    run_fake(seq, clock)
+    sent = seq.midiout.sent
+    assert len(sent) == 1000
+    assert [t for t, _ in sent] == [seq.tick_to_time(tick) for tick in sorted(ticks)]
+
+
+def test_callback_runs_after_events_of_same_tick(fakeseq, clock):
+    called = []
+    fakeseq.add_many([[0xC0, 1], [0xB0, 7, 100]], tick=10)
+    fakeseq.add_callback(lambda: called.append(len(fakeseq.midiout.sent)), tick=10)
+    fakeseq.add([0xB0, 7, 90], tick=10)
+    clock.now = fakeseq.tick_to_time(10)
+    run_fake(fakeseq, clock)
+    assert called == [2]
+    assert len(fakeseq.midiout.sent) == 3
+
+
+def test_cancel_drops_pending_events_of_tag(fakeseq, clock):
+    fakeseq.add_many([[0xC0, 1], [0xB0, 7, 100]], tick=0, deltas=[0, 100], tag='one')
+    fakeseq.add([0xB0, 7, 90], tick=100)
+    fakeseq.add([0xB0, 10, 64], tick=100, tag='two')
+    fakeseq._process(clock.now)
+    fakeseq.cancel('one')
+    # events added with the tag after cancelling it are sent
+    fakeseq.add_timed([(200, [0xC0, 2])], tick=0, tag='one')
+    run_fake(fakeseq, clock)
+    assert [msg for _, msg in fakeseq.midiout.sent] == [
+        [0xC0, 1], [0xB0, 7, 90], [0xB0, 10, 64], [0xC0, 2]]
+    # cancelled tags are forgotten when no events are pending
+    assert fakeseq._cancelled == {}
+
+
+def test_cancelled_tag_kept_while_events_pending(fakeseq, clock):
+    fakeseq.add([0xC0, 1], tick=100, tag='one')
+    fakeseq.add([0xC0, 2], tick=200)
+    fakeseq.cancel('one')
+    clock.now = fakeseq.tick_to_time(150)
+    fakeseq._process(clock.now)
+    assert 'one' in fakeseq._cancelled
+    run_fake(fakeseq, clock)
+    assert [msg for _, msg in fakeseq.midiout.sent] == [[0xC0, 2]]
+    assert fakeseq._cancelled == {}
+
+
+def test_metrics(clock):
+    seq = SequencerThread(RecordingMidiOut(clock), clock=clock, metrics=SequencerMetrics())
+    seq._start_clock()
+    seq.add_many([[0xB0, 7, i] for i in range(10)], tick=0, deltas=range(0, 100, 10))
+    run_fake(seq, clock, max_oversleep=1000)
+    metrics = seq.metrics.snapshot()
+    assert metrics['events'] == 10
+    assert metrics['max_pending'] == 9
+    assert metrics['pending'] == 0
+    assert 0 <= metrics['lateness']['max'] <= 1000
+
+
+class SlowMidiOut(RecordingMidiOut):
+    """Recording MIDI output, which takes ``cost`` ns of fake time per message."""
+
+    def __init__(self, clock, cost):
+        super(SlowMidiOut, self).__init__(clock)
+        self.cost = cost
+
+    def send_message(self, message):
+        super(SlowMidiOut, self).send_message(message)
+        self.clock.now += self.cost
+
+
+def test_quantize(fakeseq, clock):
+    assert fakeseq.quantize(1, None) == 1
+    assert fakeseq.quantize(1, 'beat') == 480
+    assert fakeseq.quantize(480, 'beat') == 480
+    assert fakeseq.quantize(480, 'bar') == 1920
+    assert fakeseq.quantize(481, 100) == 500
+    fakeseq.add([0xC0, 1], tick=5, quantize='beat')
+    run_fake(fakeseq, clock)
+    assert fakeseq.midiout.sent == [(fakeseq.tick_to_time(480), [0xC0, 1])]
+
+
+def test_midi_clock(fakeseq, clock):
+    fakeseq.start_midi_clock(tick=100)
+    fakeseq.stop_midi_clock(tick=100 + 2 * 480)
+    run_fake(fakeseq, clock)
+    sent = fakeseq.midiout.sent
+    assert sent[0] == (fakeseq.tick_to_time(100), b'\xFA')
+    assert sent[-1] == (fakeseq.tick_to_time(1060), b'\xFC')
+    assert [t for t, msg in sent[1:-1]] == [fakeseq.tick_to_time(tick)
+                                            for tick in range(100, 1061, 20)]
+    assert not fakeseq.midi_clock_running
+    # beat grid starts where the clock was started
+    assert fakeseq.quantize(101, 'beat') == 580
+
+
+def test_midi_clock_continue(fakeseq, clock):
+    fakeseq.start_midi_clock(tick=0, song_position=200)
+    fakeseq.stop_midi_clock(tick=0)
+    run_fake(fakeseq, clock)
+    assert [msg for _, msg in fakeseq.midiout.sent] == [
+        bytes((0xF2, 72, 1)), b'\xFB', b'\xFC']
+
+
+def test_midi_clock_jitter_during_burst(clock):
+    # every message takes 50 us to send, so a burst of 2000 messages takes
+    # 100 ms, which is longer than the interval of several clock pulses
+    seq = SequencerThread(SlowMidiOut(clock, 50000), clock=clock)
+    seq._start_clock()
+    seq.start_midi_clock(tick=0)
+    seq.add_many([[0xB0, 7, i % 128] for i in range(2000)], tick=30)
+    seq.stop_midi_clock(tick=480 * 4)
+    run_fake(seq, clock, max_oversleep=100000)
+    pulses = [t for t, msg in seq.midiout.sent if msg == b'\xF8']
+    assert len(pulses) == 97
+    lateness = [t - seq.tick_to_time(i * 20) for i, t in enumerate(pulses)]
+    assert 0 <= min(lateness) and max(lateness) < 10 ** 6
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from midiscenemanager.config import Scene
+from midiscenemanager.transitions import TransitionCache, compile_transition, reduce_messages
+
+
+def scene(on_enter=(), on_exit=()):
+    return Scene('', ((None, tuple(on_enter)),), ((None, tuple(on_exit)),))
+
+
+def test_overridden_controllers_and_programs_removed():
+    messages = [
+        (0, b'\xB0\x07\x00'),
+        (0, b'\xC0\x01'),
+        (1, b'\xB1\x07\x00'),
+        (2, b'\xB0\x07\x64'),
+        (2, b'\x90\x3C\x7F'),
+        (3, b'\xC0\x02'),
+    ]
+    assert reduce_messages(messages) == (
+        (1, b'\xB1\x07\x00'),
+        (2, b'\xB0\x07\x64'),
+        (2, b'\x90\x3C\x7F'),
+        (3, b'\xC0\x02'),
+    )
+
+
+def test_order_dependent_messages_keep_earlier_state():
+    messages = [
+        (0, b'\xB0\x07\x00'),
+        (0, b'\xB1\x07\x00'),
+        (0, b'\xB0\x79\x00'),
+        (0, b'\xB0\x07\x64'),
+        (0, b'\xB1\x07\x64'),
+    ]
+    # 'Reset All Controllers' on channel 1 is a barrier only for channel 1
+    assert reduce_messages(messages) == tuple(messages[:1] + messages[2:])
+
+    messages = [(0, b'\xC0\x01'), (0, b'\xF0\x01\xF7'), (0, b'\xC0\x02')]
+    assert reduce_messages(messages) == tuple(messages)
+
+
+def test_channel_mode_messages_never_removed():
+    # 'All Notes Off' on exit must stop the old notes before the new scene's
+    # 'All Notes Off' later on
+    old = scene(on_exit=[(0, b'\xB0\x7B\x00')])
+    new = scene(on_enter=[(0, b'\x90\x3C\x7F'), (100, b'\xB0\x7B\x00')])
+    assert compile_transition(old, new) == (
+        ((None, ((0, b'\xB0\x7B\x00'),)),),
+        ((None, ((0, b'\x90\x3C\x7F'), (100, b'\xB0\x7B\x00'))),),
+    )
+
+    messages = [(0, b'\xB0\x78\x00'), (0, b'\xB0\x78\x00')]
+    assert reduce_messages(messages) == tuple(messages)
+
+
+def test_transition_merges_exit_and_enter_by_delta():
+    old = scene(on_exit=[(0, b'\xB0\x07\x00'), (1, b'\xB0\x0A\x40'), (3, b'\xB0\x7B\x00')])
+    new = scene(on_enter=[(0, b'\xB0\x00\x01'), (1, b'\xC0\x05'), (2, b'\xB0\x07\x64')])
+    assert compile_transition(old, new) == (
+        ((None, ((1, b'\xB0\x0A\x40'), (3, b'\xB0\x7B\x00'))),),
+        ((None, ((0, b'\xB0\x00\x01'), (1, b'\xC0\x05'), (2, b'\xB0\x07\x64'))),),
+    )
+
+
+def test_transition_per_port():
+    old = Scene('', (), (('synth2', ((0, b'\xC0\x01'),)),))
+    new = Scene('', ((None, ((0, b'\xC0\x02'),)), ('synth2', ((0, b'\xC0\x03'),))), ())
+    assert compile_transition(old, new) == (
+        (),
+        (('synth2', ((0, b'\xC0\x03'),)), (None, ((0, b'\xC0\x02'),))),
+    )
+
+
+def test_transition_cache_lru():
+    scenes = {name: scene([(0, bytes([0xC0, i]))]) for i, name in enumerate('abcd')}
+    cache = TransitionCache(scenes, maxsize=2)
+    ab = cache.get('a', 'b')
+    assert cache.get('a', 'b') is ab
+    cache.get('a', 'c')
+    cache.get('a', 'b')
+    cache.get('a', 'd')
+    assert len(cache) == 2
+    # 'a' -> 'c' was least recently used and got evicted
+    assert set(cache._cache) == {('a', 'b'), ('a', 'd')}